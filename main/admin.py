@@ -4,7 +4,21 @@ from django.forms.widgets import Textarea, NumberInput
 from django.contrib.admin.views.main import ChangeList
 from django.core.paginator import EmptyPage, InvalidPage, Paginator
 from adminsortable2.admin import SortableAdminMixin
-from . import models
+from . import models, server_info, table_stats
+
+
+class ServerInfoSortableAdminMixin(SortableAdminMixin):
+    # reordering is done with bulk updates which don't emit model signals
+
+    def _update_order(self, *args, **kwargs):
+        res = super()._update_order(*args, **kwargs)
+        server_info.invalidate()
+        return res
+
+    def _bulk_move(self, *args, **kwargs):
+        res = super()._bulk_move(*args, **kwargs)
+        server_info.invalidate()
+        return res
 
 
 class TokenInline(admin.TabularInline):
@@ -15,9 +29,11 @@ class TokenInline(admin.TabularInline):
 
 
 @admin.register(models.Army)
-class ArmyAdmin(SortableAdminMixin, admin.ModelAdmin):
+class ArmyAdmin(ServerInfoSortableAdminMixin, admin.ModelAdmin):
     inlines = [TokenInline]
     list_display = ("name", "owner", "custom", "private", "readonly", "utility")
+    # owner is nullable so it isn't followed by default select_related()
+    list_select_related = ("owner",)
     search_fields = ("name", "owner__username")
     list_filter = ("custom", "private", "readonly", "utility")
 
@@ -36,7 +52,7 @@ class SortableFooterLinkAdmin(SortableAdminMixin, admin.ModelAdmin):
 
 
 @admin.register(models.Link)
-class SortableLinkAdmin(SortableAdminMixin, admin.ModelAdmin):
+class SortableLinkAdmin(ServerInfoSortableAdminMixin, admin.ModelAdmin):
     pass
 
 
@@ -55,11 +71,14 @@ class InlineChangeList(object):
 
 class TableVisitInline(admin.TabularInline):
     model = models.TableVisit
-    readonly_fields = ["user", "visited_at"]
+    readonly_fields = ["user", "visited_at", "visit_count"]
     extra = 0
     template = "main/adminTableVisits.html"
     per_page = 10
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related("user")
+
     def get_formset(self, request, obj=None, **kwargs):
         formset_class = super(TableVisitInline, self).get_formset(
             request, obj, **kwargs
@@ -94,14 +113,46 @@ class TableVisitInline(admin.TabularInline):
         return PaginationFormSet
 
 
+class TableChangeList(ChangeList):
+    def get_results(self, request):
+        super().get_results(request)
+        # single bulk request per shard for the whole page
+        self.result_list = table_stats.annotate(list(self.result_list))
+
+
 @admin.register(models.Table)
 class TableAdmin(admin.ModelAdmin):
-    list_display = ("name", "owner", "created_at", "updated_at")
+    list_display = (
+        "name",
+        "owner",
+        "shard",
+        "occupancy",
+        "last_activity",
+        "created_at",
+        "updated_at",
+    )
+    # owner is nullable so it isn't followed by default select_related()
+    list_select_related = ("owner",)
     search_fields = ("name", "owner__username")
-    list_filter = ("owner",)
+    list_filter = ("owner", "shard")
     readonly_fields = ("created_at", "updated_at")
     inlines = [TableVisitInline]
 
+    def get_changelist(self, request, **kwargs):
+        return TableChangeList
+
+    @admin.display(description="Online")
+    def occupancy(self, obj):
+        stats = getattr(obj, "live_stats", None)
+        return (
+            None if stats is None else f"{stats['online']} ({stats['players']} playing)"
+        )
+
+    @admin.display(description="Last activity")
+    def last_activity(self, obj):
+        stats = getattr(obj, "live_stats", None)
+        return None if stats is None else stats["last_activity"]
+
 
 admin.site.register(models.Resource)
 admin.site.register(models.PublicationRequest)
@@ -119,3 +170,9 @@ class UserDiskQuotaAdmin(admin.ModelAdmin):
             "label": "Value (bytes)",
         }
     }
+
+
+@admin.register(models.ProfilingRule)
+class ProfilingRuleAdmin(admin.ModelAdmin):
+    list_display = ("url_name", "sample_rate", "enabled", "expires_at")
+    list_editable = ("sample_rate", "enabled", "expires_at")
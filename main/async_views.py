@@ -0,0 +1,93 @@
+import json
+from http import HTTPStatus
+from django.http import Http404, HttpResponse, JsonResponse
+from django.shortcuts import aget_object_or_404
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
+from django.views.decorators.csrf import csrf_exempt
+from .authorization import NOT_FOUND, aauthorize_role_requests
+from .models import ArmyInfo, Board, Table
+from .server_info import aget_server_info_content
+from .views import (
+    get_table_chairs,
+    get_table_info,
+    only_GET,
+    only_POST,
+    parse_role_requests,
+)
+
+# Async versions of endpoints called by table servers and table clients at high
+# fan-out whenever a table fills up. They are served instead of their sync
+# counterparts from views module when running under ASGI (see nhex/asgi.py), so
+# requests waiting on database or cache don't hold worker threads.
+
+
+@only_GET
+async def table_info(request, pk):
+    table = await aget_object_or_404(Table, pk=pk)
+    chairs = [chair async for chair in get_table_chairs(table)]
+    return JsonResponse(get_table_info(table, chairs))
+
+
+@only_GET
+async def army_info(request, pk):
+    entry = await ArmyInfo.aget_content(pk)
+    if entry is None:
+        return JsonResponse({"error": "Army not found"}, status=HTTPStatus.NOT_FOUND)
+    content, etag = entry
+    response = HttpResponse(content, content_type="application/json")
+    response["ETag"] = etag
+    patch_cache_control(response, no_cache=True)
+    return get_conditional_response(request, etag=etag, response=response)
+
+
+@only_GET
+async def board_info(request, pk):
+    board = await aget_object_or_404(Board, pk=pk)
+    return JsonResponse(board.get_info())
+
+
+@only_GET
+async def server_info(request):
+    shard = None
+    if "table" in request.GET:
+        tables = Table.objects.filter(pk=request.GET["table"])
+        shard = await tables.values_list("shard", flat=True).afirst()
+    user = await request.auser()
+    content, etag = await aget_server_info_content(user, shard)
+    response = HttpResponse(content, content_type="application/json")
+    response["ETag"] = etag
+    patch_cache_control(response, no_cache=True)
+    patch_vary_headers(response, ["Cookie"])
+    return get_conditional_response(request, etag=etag, response=response)
+
+
+@csrf_exempt
+@only_POST
+async def authorize_role_request(request):
+    data = json.loads(request.body)
+    requests = parse_role_requests([data])
+    if requests is None:
+        return HttpResponse(status=HTTPStatus.BAD_REQUEST)
+    [result] = await aauthorize_role_requests(await request.auser(), requests)
+    if result == NOT_FOUND:
+        raise Http404()
+    if not result["result"]:
+        return JsonResponse(result, status=HTTPStatus.UNAUTHORIZED)
+    return JsonResponse(result)
+
+
+@csrf_exempt
+@only_POST
+async def authorize_role_requests_batch(request):
+    try:
+        requests = parse_role_requests(json.loads(request.body).get("requests"))
+    except (ValueError, AttributeError):
+        requests = None
+    if requests is None:
+        return HttpResponse(status=HTTPStatus.BAD_REQUEST)
+    results = await aauthorize_role_requests(await request.auser(), requests)
+    return JsonResponse({"results": results})
@@ -0,0 +1,78 @@
+import hashlib
+from io import BytesIO
+from PIL import Image
+
+# empty pixels around packed images preventing bleeding of neighbours when scaled
+PADDING = 2
+
+
+def get_entry_key(digest, rect):
+    if not rect:
+        return digest
+    return f"{digest}:{rect.get('x', 0)},{rect.get('y', 0)},{rect['w']},{rect['h']}"
+
+
+def get_source_box(path, rect, page_size):
+    # Region of the source image used by a token or None if it can't be packed.
+    try:
+        with Image.open(path) as img:
+            if getattr(img, "is_animated", False):
+                return None
+            width, height = img.size
+    except (OSError, Image.DecompressionBombError):
+        return None
+    if rect:
+        try:
+            box = tuple(round(rect.get(key, 0)) for key in ("x", "y", "w", "h"))
+        except TypeError:
+            return None
+    else:
+        box = (0, 0, width, height)
+    if min(box[2:]) <= 0 or max(box[2:]) + 2 * PADDING > page_size:
+        return None
+    return box
+
+
+def pack(sizes, page_size):
+    # Shelf packing of (w, h) sizes into pages. Returns list of pages mapping keys
+    # to (x, y) positions.
+    pages = []
+    page = {}
+    x = y = shelf_height = 0
+    for key, (w, h) in sorted(sizes.items(), key=lambda item: (-item[1][1], item[0])):
+        w, h = w + 2 * PADDING, h + 2 * PADDING
+        if x + w > page_size:
+            x, y, shelf_height = 0, y + shelf_height, 0
+        if y + h > page_size:
+            pages.append(page)
+            page = {}
+            x = y = shelf_height = 0
+        page[key] = (x + PADDING, y + PADDING)
+        x += w
+        shelf_height = max(shelf_height, h)
+    if page:
+        pages.append(page)
+    return pages
+
+
+def render_page(sources, positions):
+    # Returns lossless WebP image and its digest. Sources map keys to source path
+    # and box as returned by get_source_box.
+    width = max(x + sources[key][1][2] + PADDING for key, (x, y) in positions.items())
+    height = max(y + sources[key][1][3] + PADDING for key, (x, y) in positions.items())
+    page = Image.new("RGBA", (width, height))
+    images = {}
+    try:
+        for key, (x, y) in positions.items():
+            path, (left, top, w, h) = sources[key]
+            if path not in images:
+                with Image.open(path) as img:
+                    images[path] = img.convert("RGBA")
+            page.paste(images[path].crop((left, top, left + w, top + h)), (x, y))
+    finally:
+        for img in images.values():
+            img.close()
+    out = BytesIO()
+    page.save(out, "WEBP", lossless=True)
+    content = out.getvalue()
+    return content, hashlib.sha256(content).hexdigest()
@@ -0,0 +1,198 @@
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from nanoid import generate
+from .metrics import count_cache_lookups
+from .models import Chair, NamedInvitation, Table
+from .tickets import verify_ticket
+
+UNAUTHORIZED = {"result": False, "reason": "Unauthorized"}
+NOT_FOUND = {"result": False, "reason": "Not found"}
+
+
+def get_version_key(table_id):
+    return f"role_decision:{table_id}:version"
+
+
+def invalidate(table_id):
+    # Once now and once again after commit, so decisions made based on data read
+    # before the commit don't survive it.
+    cache.delete(get_version_key(table_id))
+    transaction.on_commit(lambda: cache.delete(get_version_key(table_id)))
+
+
+def get_versions(table_ids):
+    keys = {table_id: get_version_key(table_id) for table_id in table_ids}
+    versions = cache.get_many(keys.values())
+    missing = {key: generate(size=12) for key in keys.values() if key not in versions}
+    cache.set_many(missing, None)
+    versions |= missing
+    return {table_id: versions[key] for table_id, key in keys.items()}
+
+
+async def aget_versions(table_ids):
+    keys = {table_id: get_version_key(table_id) for table_id in table_ids}
+    versions = await cache.aget_many(keys.values())
+    missing = {key: generate(size=12) for key in keys.values() if key not in versions}
+    await cache.aset_many(missing, None)
+    versions |= missing
+    return {table_id: versions[key] for table_id, key in keys.items()}
+
+
+def get_selector(role_request):
+    if role_request.get("role") == "owner":
+        return ("owner", "")
+    if role_request.get("namedInvitation") is not None:
+        return ("namedInvitation", str(role_request["namedInvitation"]))
+    if role_request.get("linkInvitation") is not None:
+        return ("linkInvitation", str(role_request["linkInvitation"]))
+    return None
+
+
+def get_querysets(entries):
+    # Rows needed to decide (table id, selector) entries, constant number of queries.
+    selected = {kind: set() for kind in ["owner", "namedInvitation", "linkInvitation"]}
+    for _, (kind, value) in entries:
+        selected[kind].add(value)
+    querysets = {
+        "owners": Table.objects.filter(
+            pk__in={table_id for table_id, _ in entries}
+        ).values_list("pk", "owner_id")
+    }
+    if selected["namedInvitation"]:
+        querysets["invitations"] = NamedInvitation.objects.filter(
+            pk__in=selected["namedInvitation"]
+        ).values_list("pk", "user_id", "chair__table_id", "chair__kind")
+    if selected["linkInvitation"]:
+        querysets["links"] = Chair.objects.filter(
+            link_invitation__in=selected["linkInvitation"]
+        ).values_list("link_invitation", "table_id", "kind")
+    return querysets
+
+
+def decide(user, entries, rows):
+    owners = dict(rows["owners"])
+    invitations = {
+        pk: (user_id, table_id, kind)
+        for pk, user_id, table_id, kind in rows.get("invitations", [])
+    }
+    links = {link: (table_id, kind) for link, table_id, kind in rows.get("links", [])}
+    decisions = {}
+    for entry in entries:
+        table_id, (kind, value) = entry
+        decision = UNAUTHORIZED
+        if table_id not in owners:
+            decision = NOT_FOUND
+        elif kind == "owner":
+            if owners[table_id] is None or owners[table_id] == user.pk:
+                decision = {"result": True, "role": "owner"}
+        elif kind == "namedInvitation":
+            if value not in invitations:
+                decision = NOT_FOUND
+            elif invitations[value][:2] == (user.pk, table_id):
+                role = Chair(kind=invitations[value][2]).get_role()
+                decision = {"result": True, "role": role}
+        elif kind == "linkInvitation":
+            if value not in links:
+                decision = NOT_FOUND
+            elif links[value][0] == table_id:
+                decision = {
+                    "result": True,
+                    "role": Chair(kind=links[value][1]).get_role(),
+                }
+        decisions[entry] = decision
+    return decisions
+
+
+def resolve(user, entries):
+    rows = {name: list(qs) for name, qs in get_querysets(entries).items()}
+    return decide(user, entries, rows)
+
+
+async def aresolve(user, entries):
+    rows = {
+        name: [row async for row in qs] for name, qs in get_querysets(entries).items()
+    }
+    return decide(user, entries, rows)
+
+
+def prepare(user, requests):
+    # Decides requests carrying valid ticket or no selector, the rest is returned
+    # as pending {index: (table id, selector)}. Tickets issued to other users are
+    # ignored, so requests carrying them are decided as if they had none.
+    user_id = user.pk if user.is_authenticated else None
+    results = [None] * len(requests)
+    pending = {}
+    for i, (table_id, role_request) in enumerate(requests):
+        table_id = str(table_id)
+        ticket = verify_ticket(role_request.get("ticket"), table_id)
+        selector = get_selector(role_request)
+        if ticket is not None and ticket.get("user") == user_id:
+            results[i] = {"result": True, "role": ticket["role"]}
+        elif selector is None:
+            results[i] = UNAUTHORIZED
+        else:
+            pending[i] = (table_id, selector)
+    return results, pending
+
+
+def get_decision_keys(user, pending, versions):
+    return {
+        i: f"role_decision:{table_id}:{versions[table_id]}:{user.pk}:{kind}:{value}"
+        for i, (table_id, (kind, value)) in pending.items()
+    }
+
+
+def get_decision_timeout():
+    # other processes can't invalidate decisions cached in memory of this one
+    if isinstance(caches["default"], LocMemCache):
+        return min(
+            settings.ROLE_DECISION_CACHE_TIMEOUT,
+            settings.ROLE_DECISION_LOCAL_CACHE_TIMEOUT,
+        )
+    return settings.ROLE_DECISION_CACHE_TIMEOUT
+
+
+def authorize_role_requests(user, requests):
+    # Returns decisions for (table id, role request) pairs of the given user.
+    # Decisions are cached for a short time and invalidated by signals whenever
+    # table ownership, chairs or invitations of the table change.
+    results, pending = prepare(user, requests)
+    if not pending:
+        return results
+    versions = get_versions({table_id for table_id, _ in pending.values()})
+    keys = get_decision_keys(user, pending, versions)
+    cached = cache.get_many(keys.values())
+    missing = {pending[i] for i in pending if keys[i] not in cached}
+    hits = sum(key in cached for key in keys.values())
+    count_cache_lookups("role_decisions", hits, len(keys) - hits)
+    decisions = resolve(user, missing) if missing else {}
+    cache.set_many(
+        {keys[i]: decisions[pending[i]] for i in pending if pending[i] in decisions},
+        get_decision_timeout(),
+    )
+    for i in pending:
+        results[i] = cached.get(keys[i]) or decisions[pending[i]]
+    return results
+
+
+async def aauthorize_role_requests(user, requests):
+    # async version of authorize_role_requests
+    results, pending = prepare(user, requests)
+    if not pending:
+        return results
+    versions = await aget_versions({table_id for table_id, _ in pending.values()})
+    keys = get_decision_keys(user, pending, versions)
+    cached = await cache.aget_many(keys.values())
+    missing = {pending[i] for i in pending if keys[i] not in cached}
+    hits = sum(key in cached for key in keys.values())
+    count_cache_lookups("role_decisions", hits, len(keys) - hits)
+    decisions = await aresolve(user, missing) if missing else {}
+    await cache.aset_many(
+        {keys[i]: decisions[pending[i]] for i in pending if pending[i] in decisions},
+        get_decision_timeout(),
+    )
+    for i in pending:
+        results[i] = cached.get(keys[i]) or decisions[pending[i]]
+    return results
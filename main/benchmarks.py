@@ -0,0 +1,201 @@
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone
+from io import StringIO
+from pathlib import Path
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from .models import Army, Board, Table
+from . import querycount
+from .tests import StandInTableServer
+
+# Benchmarks of hot endpoints against database seeded with realistic volumes. They
+# aren't part of the test suite, run them explicitly:
+#
+#   python -m pytest -s main/benchmarks.py
+#
+# BENCHMARK_SCALE multiplies seeded volumes, BENCHMARK_REQUESTS sets number of timed
+# requests per endpoint. Results are saved as JSON to BENCHMARK_OUTPUT (by default
+# bench_results/<commit>.json) and compared with BENCHMARK_BASELINE file if given.
+SCALE = float(os.environ.get("BENCHMARK_SCALE", 1))
+REQUESTS = int(os.environ.get("BENCHMARK_REQUESTS", 200))
+WARMUP = 5
+SEED = 0
+
+
+def scaled(count):
+    return max(1, round(count * SCALE))
+
+
+def get_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def get_middleware():
+    # measure what runs in production, queries are counted by benchmarks themselves
+    return [
+        m
+        for m in settings.MIDDLEWARE
+        if not m.startswith("debug_toolbar.")
+        and m != "main.querycount.QueryCountMiddleware"
+    ]
+
+
+def seed():
+    call_command(
+        "seed_load_data",
+        "--no-media",
+        *["--prefix", "bench", "--password", "bench", "--seed", str(SEED)],
+        *["--users", str(scaled(2000)), "--armies", str(scaled(50))],
+        *["--tokens", "300", "--army-images", "60", "--tables", str(scaled(5000))],
+        *["--visits", str(scaled(50_000))],
+        stdout=StringIO(),
+    )
+
+
+@override_settings(MIDDLEWARE=get_middleware())
+class EndpointBenchmark(TestCase):
+    results = {}
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        start = time.perf_counter()
+        seed()
+        cls.seed_time = time.perf_counter() - start
+        cls.user = get_user_model().objects.get(username="bench0")
+        # heavy user owning many tables and invited to many others
+        Table.objects.filter(pk__in=Table.objects.values("pk")[:200]).update(
+            owner=cls.user
+        )
+        cls.table = cls.user.table_set.first()
+        cls.public_army = Army.objects.filter(private=False).first()
+        cls.board = Board.objects.first()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.save_results()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.tss = self.enterContext(StandInTableServer())
+        self.enterContext(override_settings(INTERNAL_TSS_URL=self.tss.url))
+
+    def login(self):
+        self.client.login(username=self.user.username, password="bench")
+
+    def measure(self, name, path, method="get", **kwargs):
+        send = getattr(self.client, method)
+        for _ in range(WARMUP):
+            send(path, **kwargs)
+        latencies = []
+        queries = []
+        for _ in range(REQUESTS):
+            with querycount.record_queries() as log:
+                start = time.perf_counter()
+                response = send(path, **kwargs)
+                latencies.append(time.perf_counter() - start)
+            queries.append(len(log))
+            self.assertEqual(200, response.status_code)
+        latencies.sort()
+        self.results[name] = {
+            "path": path,
+            "requests": REQUESTS,
+            "mean_ms": statistics.fmean(latencies) * 1000,
+            **{
+                f"p{p}_ms": latencies[
+                    min(len(latencies) - 1, len(latencies) * p // 100)
+                ]
+                * 1000
+                for p in [50, 90, 95, 99]
+            },
+            "max_ms": latencies[-1] * 1000,
+            "queries": max(queries),
+            "response_bytes": len(response.content),
+        }
+
+    def test_server_info(self):
+        self.measure("server_info", reverse("main:server_info"))
+        self.login()
+        self.measure("server_info_authenticated", reverse("main:server_info"))
+
+    def test_army_info(self):
+        self.measure("army_info", reverse("main:army_info", args=[self.public_army.pk]))
+
+    def test_table_info(self):
+        self.measure("table_info", reverse("main:table_info", args=[self.table.pk]))
+
+    def test_board_info(self):
+        self.measure("board_info", reverse("main:board_info", args=[self.board.pk]))
+
+    def test_authorize_role_request(self):
+        self.login()
+        body = {"tableId": self.table.pk, "roleRequest": {"role": "owner"}}
+        self.measure(
+            "authorize_role_request",
+            "/authorizeRoleRequest/",
+            method="post",
+            data=json.dumps(body),
+            content_type="application/json",
+        )
+
+    def test_tables(self):
+        self.login()
+        self.measure("tables", reverse("main:tables"))
+
+    def test_resources(self):
+        self.client.force_login(self.public_army.owner)
+        self.measure("resources", reverse("main:resources", args=[self.public_army.pk]))
+
+    @classmethod
+    def save_results(cls):
+        commit = get_commit()
+        report = {
+            "commit": commit,
+            "date": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": settings.DATABASES["default"]["ENGINE"],
+            "scale": SCALE,
+            "seed_seconds": getattr(cls, "seed_time", None),
+            "endpoints": cls.results,
+        }
+        output = Path(
+            os.environ.get("BENCHMARK_OUTPUT", f"bench_results/{commit}.json")
+        )
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(report, indent=2))
+        baseline = None
+        if "BENCHMARK_BASELINE" in os.environ:
+            baseline = json.loads(Path(os.environ["BENCHMARK_BASELINE"]).read_text())
+        print(f"\nBenchmark results saved to {output}")
+        print(
+            f"{'endpoint':<26} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>7}"
+        )
+        for name, result in sorted(cls.results.items()):
+            line = (
+                f"{name:<26} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} "
+                f"{result['p99_ms']:>8.2f} {result['queries']:>7}"
+            )
+            if baseline and name in baseline["endpoints"]:
+                before = baseline["endpoints"][name]
+                change = result["p50_ms"] / before["p50_ms"] - 1
+                line += f"  p50 {change:+.0%}, queries {before['queries']} -> {result['queries']}"
+            print(line)
@@ -0,0 +1,14 @@
+import pytest
+from . import visits
+
+
+@pytest.fixture(autouse=True)
+def clear_pending_visits():
+    # Visits recorded by test requests would be flushed by the next test, by timer
+    # or at exit, when database access isn't allowed anymore.
+    yield
+    with visits.lock:
+        visits.pending.clear()
+        if visits.timer is not None:
+            visits.timer.cancel()
+            visits.timer = None
@@ -0,0 +1,13 @@
+import hashlib
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.http import quote_etag
+
+
+def serialize(data):
+    content = json.dumps(data, cls=DjangoJSONEncoder).encode()
+    return content, get_etag(content)
+
+
+def get_etag(content):
+    return quote_etag(hashlib.md5(content, usedforsecurity=False).hexdigest())
@@ -75,7 +75,7 @@ class RadioImageSelect(forms.RadioSelect):
         result = super().create_option(
             name, value, label.name, selected, index, subindex=subindex, attrs=attrs
         )
-        result["img_url"] = label.file.url
+        result["img_url"] = label.get_thumbnail_url()
         return result
 
     def get_context(self, name, value, attrs):
@@ -0,0 +1,43 @@
+import os
+from io import BytesIO
+from pathlib import Path
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+# formats which can be safely re-encoded, animated ones are left untouched
+NORMALIZED_FORMATS = {"PNG", "JPEG", "BMP", "TIFF"}
+
+
+def create_thumbnail(src, dest, size):
+    # Doesn't depend on django, so it can be run in worker processes.
+    try:
+        with Image.open(src) as img:
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail(size)
+            if img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGBA")
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            img.save(dest, "WEBP", quality=80)
+    except (OSError, Image.DecompressionBombError):
+        return False
+    return True
+
+
+def normalize_upload(file):
+    # Re-encodes uploaded raster image as WebP if it makes the file smaller.
+    try:
+        with Image.open(file) as img:
+            if img.format not in NORMALIZED_FORMATS:
+                raise ValueError()
+            lossless = img.format != "JPEG"
+            img = ImageOps.exif_transpose(img)
+            if img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGBA")
+            out = BytesIO()
+            img.save(out, "WEBP", lossless=lossless, quality=90)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        out = None
+    file.seek(0)
+    if out is None or out.tell() >= file.size:
+        return file
+    return ContentFile(out.getvalue(), name=f"{Path(file.name).stem}.webp")
@@ -0,0 +1,158 @@
+import asyncio
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.test import AsyncClient, Client, override_settings
+from main.models import Army, Board, Table
+
+MODES = ["sync", "async"]
+
+
+def get_endpoints():
+    # requests table servers and table clients make when table fills up
+    endpoints = {"server_info": ("GET", "/serverInfo/", None)}
+    table = Table.objects.first()
+    if table is not None:
+        endpoints["table_info"] = ("GET", f"/tables/{table.pk}/info/", None)
+        body = {"requests": [{"tableId": table.pk, "roleRequest": {"role": "owner"}}]}
+        endpoints["authorize"] = ("POST", "/authorizeRoleRequests/", json.dumps(body))
+    army = Army.objects.filter(private=False).first()
+    if army is not None:
+        endpoints["army_info"] = ("GET", f"/armies/{army.pk}/info/", None)
+    board = Board.objects.first()
+    if board is not None:
+        endpoints["board_info"] = ("GET", f"/boards/{board.pk}/info/", None)
+    return endpoints
+
+
+def get_middleware():
+    # debug toolbar is synchronous only and shouldn't run in production anyway
+    return [m for m in settings.MIDDLEWARE if not m.startswith("debug_toolbar.")]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures throughput and latency of endpoints called at high fan-out by "
+        "table servers when served by sync views through worker threads (like "
+        "WSGI deployment) and by async views (ASGI deployment, see nhex/asgi.py) "
+        "at given numbers of concurrent clients. Uses objects already present in "
+        "the database."
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "-c",
+            "--concurrency",
+            type=int,
+            nargs="+",
+            default=[1, 10, 50],
+            help="Numbers of concurrent clients to measure.",
+        )
+        parser.add_argument(
+            "-n",
+            "--requests",
+            type=int,
+            default=200,
+            help="Number of requests made at each concurrency level.",
+        )
+        parser.add_argument(
+            "-t",
+            "--threads",
+            type=int,
+            default=4,
+            help="Number of worker threads serving sync views.",
+        )
+        parser.add_argument(
+            "-e",
+            "--endpoint",
+            action="append",
+            help="Endpoint to measure (default all). Can be used many times.",
+        )
+        return super().add_arguments(parser)
+
+    def handle(self, *args, **options):
+        if min(options["concurrency"] + [options["requests"], options["threads"]]) < 1:
+            raise CommandError(
+                "Numbers of clients, requests and threads must be positive."
+            )
+        endpoints = get_endpoints()
+        names = options["endpoint"] or list(endpoints)
+        if unknown := set(names) - set(endpoints):
+            raise CommandError(
+                f"Unknown or unavailable endpoints {sorted(unknown)}, "
+                f"available are {sorted(endpoints)}."
+            )
+        self.stdout.write(
+            f"{'endpoint':<12} {'mode':<6} {'clients':>7} {'req/s':>9} "
+            f"{'p50 ms':>8} {'p95 ms':>8}"
+        )
+        for name in names:
+            for concurrency in options["concurrency"]:
+                for mode in MODES:
+                    latencies, elapsed = self.measure(
+                        mode, endpoints[name], concurrency, options
+                    )
+                    self.stdout.write(
+                        f"{name:<12} {mode:<6} {concurrency:>7} "
+                        f"{len(latencies) / elapsed:>9.1f} "
+                        f"{statistics.median(latencies) * 1000:>8.2f} "
+                        f"{self.percentile(latencies, 95) * 1000:>8.2f}"
+                    )
+
+    def percentile(self, values, percent):
+        values = sorted(values)
+        return values[min(len(values) - 1, len(values) * percent // 100)]
+
+    def measure(self, mode, endpoint, concurrency, options):
+        with override_settings(
+            MIDDLEWARE=get_middleware(),
+            ROOT_URLCONF="nhex.asgi_urls" if mode == "async" else settings.ROOT_URLCONF,
+        ):
+            return asyncio.run(self.run_clients(mode, endpoint, concurrency, options))
+
+    async def run_clients(self, mode, endpoint, concurrency, options):
+        method, path, body = endpoint
+        kwargs = {"data": body, "content_type": "application/json"} if body else {}
+        if mode == "async":
+            client = AsyncClient()
+
+            async def send():
+                return await getattr(client, method.lower())(path, **kwargs)
+
+        else:
+            # sync views are served by fixed pool of worker threads
+            pool = ThreadPoolExecutor(options["threads"])
+            local = threading.local()
+
+            def send_sync():
+                if not hasattr(local, "client"):
+                    local.client = Client()
+                return getattr(local.client, method.lower())(path, **kwargs)
+
+            async def send():
+                return await asyncio.get_running_loop().run_in_executor(pool, send_sync)
+
+        remaining = options["requests"]
+        latencies = []
+
+        async def run_client():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                start = time.perf_counter()
+                response = await send()
+                latencies.append(time.perf_counter() - start)
+                if response.status_code >= 400:
+                    raise CommandError(f"{path} responded with {response.status_code}.")
+
+        start = time.perf_counter()
+        try:
+            await asyncio.gather(*(run_client() for _ in range(concurrency)))
+        finally:
+            if mode == "sync":
+                pool.shutdown()
+        return latencies, time.perf_counter() - start
@@ -0,0 +1,75 @@
+import os
+from collections import defaultdict
+from pathlib import Path
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandParser
+from main.filesize import naturalsize
+from .helpers.export_target import get_file_hash
+
+
+class Command(BaseCommand):
+    help = (
+        "Replaces files with identical content stored in army media directories "
+        "by hard links to a single copy and reports reclaimed disk space."
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report duplicates without replacing them.",
+        )
+        return super().add_arguments(parser)
+
+    def handle(self, *args, **options):
+        media_root = Path(settings.MEDIA_ROOT)
+        # only files of equal size can have the same content
+        by_size = defaultdict(list)
+        for root in [media_root / "blobs", media_root / "armies"]:
+            for file_path in root.rglob("*"):
+                if file_path.is_file() and not file_path.is_symlink():
+                    by_size[file_path.stat().st_size].append(file_path)
+
+        collapsed = reclaimed = 0
+        for size, paths in by_size.items():
+            if len(paths) < 2:
+                continue
+            by_hash = defaultdict(list)
+            for file_path in paths:
+                by_hash[get_file_hash(file_path)].append(file_path)
+            for duplicates in by_hash.values():
+                files, space = self.collapse(duplicates, size, options["dry_run"])
+                collapsed += files
+                reclaimed += space
+
+        summary = (
+            f"{collapsed} duplicate file(s) occupying {naturalsize(reclaimed)} "
+            f"({reclaimed} B)"
+        )
+        if options["dry_run"]:
+            self.stdout.write(self.style.WARNING(f"Found {summary}. Nothing changed."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Collapsed {summary}."))
+
+    def collapse(self, paths, size, dry_run):
+        # blob files come first, so the blob store keeps its inode
+        by_inode = defaultdict(list)
+        for file_path in paths:
+            by_inode[file_path.stat().st_ino].append(file_path)
+        if len(by_inode) < 2:
+            return 0, 0
+        original, *duplicates = by_inode.values()
+        collapsed = reclaimed = 0
+        for inode_paths in duplicates:
+            # space is reclaimed only when no other link to the inode remains
+            if inode_paths[0].stat().st_nlink == len(inode_paths):
+                reclaimed += size
+            collapsed += len(inode_paths)
+            if dry_run:
+                continue
+            for file_path in inode_paths:
+                tmp_path = file_path.with_name(f".{file_path.name}.dedupe")
+                tmp_path.unlink(missing_ok=True)
+                os.link(original[0], tmp_path)
+                os.replace(tmp_path, file_path)
+        return collapsed, reclaimed
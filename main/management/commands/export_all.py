@@ -4,6 +4,7 @@ from django.core.management.base import BaseCommand, CommandError, CommandParser
 from django.core.management import call_command
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
+from .helpers.export_target import add_export_arguments
 
 
 class Command(BaseCommand):
@@ -19,13 +20,25 @@ class Command(BaseCommand):
             type=str,
             help="The path where assets should be saved.",
         )
+        add_export_arguments(parser)
         return super().add_arguments(parser)
 
     def handle(self, *args, **options):
         user_name = options.get("user_name")
         path = Path(options.get("path"))
-        call_command("export_server_info", path / "serverInfo", user_name=user_name)
-        call_command("export_army", "*", path / "armies", user_name=user_name)
-        call_command("export_board", "*", path / "boards")
-        call_command("export_emote", "*", path / "emojis")
+        export_options = {
+            "incremental": options["incremental"],
+            "link": options["link"],
+        }
+        call_command(
+            "export_server_info",
+            path / "serverInfo",
+            user_name=user_name,
+            **export_options,
+        )
+        call_command(
+            "export_army", "*", path / "armies", user_name=user_name, **export_options
+        )
+        call_command("export_board", "*", path / "boards", **export_options)
+        call_command("export_emote", "*", path / "emojis", **export_options)
         self.stdout.write(self.style.SUCCESS("All assets exported."))
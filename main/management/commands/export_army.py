@@ -1,11 +1,11 @@
 from django.core.management.base import BaseCommand, CommandError, CommandParser
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
-from main.models import Army
-from shutil import copytree
+from main.models import Army, AtlasPage
 from django.conf import settings
 from json import dumps
 from pathlib import Path
+from .helpers.export_target import ExportTarget, add_export_arguments
 
 
 class Command(BaseCommand):
@@ -26,6 +26,7 @@ class Command(BaseCommand):
             type=str,
             help="The path to the directory where the armies will be exported.",
         )
+        add_export_arguments(parser)
         return super().add_arguments(parser)
 
     def handle(self, *args, **options):
@@ -46,15 +47,21 @@ class Command(BaseCommand):
                 armies = Army.objects.filter(name=army_name)
             except Army.DoesNotExist:
                 raise CommandError("Specified army does not exist.")
+        target = ExportTarget(Path(options["path"]), options)
         for army in armies:
-            self.export_army(army, Path(options["path"]))
+            self.export_army(army, target)
+        summary = target.finish(remove_stale=army_name == "*")
+        self.stdout.write(f"Armies: {summary}")
 
-    def export_army(self, army, path):
-        army_dir = settings.MEDIA_ROOT / "armies" / army.id
-        exported_army_dir = path / army.id
-        copytree(army_dir, exported_army_dir, dirs_exist_ok=True)
-        self.stdout.write(f"Army {army.name} exported to {exported_army_dir}.")
-        # Export army info to info.json
-        with open(exported_army_dir / "info.json", "w") as f:
-            f.write(dumps(army.get_info()))
-        return
+    def export_army(self, army, target):
+        # pages are normally up to date, missing ones are written to army directory
+        AtlasPage.update(army.id)
+        info = army.get_info()
+        army_dir = Path(settings.MEDIA_ROOT) / "armies" / army.id
+        for file_path in sorted(army_dir.rglob("*")):
+            if file_path.is_file():
+                target.add_file(
+                    Path(army.id) / file_path.relative_to(army_dir), file_path
+                )
+        self.stdout.write(f"Army {army.name} exported to {target.root / army.id}.")
+        target.add_content(Path(army.id) / "info.json", dumps(info))
@@ -1,5 +1,5 @@
 from typing import override
-from shutil import copy, rmtree
+from pathlib import Path
 from main.models import Board
 from json import dumps
 from .helpers.simple_exporter import SimpleExporter
@@ -10,17 +10,12 @@ class Command(SimpleExporter):
     model = Board
 
     @override
-    def export(self, board, path, options):
-        board_img_path = board.image.path
-        exported_board_dir = path / board.id
-        if exported_board_dir.exists():
-            rmtree(exported_board_dir)
-        exported_board_dir.mkdir(parents=True)
-        copy(board_img_path, exported_board_dir)
-        self.stdout.write(f"Board {board.name} exported to {exported_board_dir}.")
+    def export(self, board, target, options):
+        board_img_path = Path(board.image.path)
+        target.add_file(f"{board.id}/{board_img_path.name}", board_img_path)
+        self.stdout.write(f"Board {board.name} exported to {target.root / board.id}.")
         # Export board info to info.json
-        with open(exported_board_dir / "info.json", "w") as f:
-            info = board.get_info()
-            info["image"] = f"boards/{board.id}/" + info["image"].split("/")[-1]
-            f.write(dumps(info))
+        info = board.get_info()
+        info["image"] = f"boards/{board.id}/" + info["image"].split("/")[-1]
+        target.add_content(f"{board.id}/info.json", dumps(info))
         return
@@ -1,7 +1,6 @@
 from typing import override
-from shutil import copy, rmtree
+from pathlib import Path
 from main.models import Emote
-from json import dumps
 from .helpers.simple_exporter import SimpleExporter
 
 
@@ -10,13 +9,11 @@ class Command(SimpleExporter):
     model = Emote
 
     @override
-    def export(self, emote, path, options):
-        exported_emote_dir = path
-        if exported_emote_dir.exists():
-            rmtree(exported_emote_dir)
-        exported_emote_dir.mkdir()
-        copy(emote.image.path, exported_emote_dir)
-        for img in emote.emotealternativeimage_set.all():
-            copy(img.image.path, exported_emote_dir)
-        self.stdout.write(f"Emote {emote.name} exported to {exported_emote_dir}.")
+    def export(self, emote, target, options):
+        images = [emote.image] + [
+            img.image for img in emote.emotealternativeimage_set.all()
+        ]
+        for image in images:
+            target.add_file(Path(image.path).name, image.path)
+        self.stdout.write(f"Emote {emote.name} exported to {target.root}.")
         return
@@ -1,8 +1,10 @@
 from django.core.management.base import BaseCommand, CommandError, CommandParser
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
-from main.views import get_server_info
+from main.server_info import get_server_info
 from json import dumps
+from pathlib import Path
+from .helpers.export_target import ExportTarget, add_export_arguments
 
 
 class Command(BaseCommand):
@@ -18,6 +20,7 @@ class Command(BaseCommand):
             type=str,
             help="The path where server info will be exported.",
         )
+        add_export_arguments(parser)
         return super().add_arguments(parser)
 
     def handle(self, *args, **options):
@@ -29,6 +32,8 @@ class Command(BaseCommand):
                 user = User.objects.get(username=user_name)
             except User.DoesNotExist:
                 raise CommandError("User does not exist.")
-        with open(options["path"], "w") as f:
-            f.write(dumps(get_server_info(user)))
+        path = Path(options["path"])
+        target = ExportTarget(path.parent, options)
+        target.add_content(path.name, dumps(get_server_info(user)))
+        target.finish(remove_stale=False)
         self.stdout.write(self.style.SUCCESS("Server info exported."))
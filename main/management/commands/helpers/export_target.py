@@ -0,0 +1,143 @@
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+from django.core.management.base import CommandParser
+
+MANIFEST_NAME = ".export_manifest.json"
+LINK_MODES = ["copy", "hardlink", "reflink"]
+# ioctl request cloning file extents on Linux (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+
+def add_export_arguments(parser: CommandParser):
+    parser.add_argument(
+        "-i",
+        "--incremental",
+        action="store_true",
+        help="Write only files whose content changed since previous export.",
+    )
+    parser.add_argument(
+        "-l",
+        "--link",
+        choices=LINK_MODES,
+        default="copy",
+        help="How media files are placed in the export directory.",
+    )
+
+
+def get_file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def reflink(src, dest):
+    import fcntl
+
+    with open(src, "rb") as src_file, open(dest, "wb") as dest_file:
+        fcntl.ioctl(dest_file.fileno(), FICLONE, src_file.fileno())
+
+
+class ExportTarget:
+    # Export directory keeping a manifest of exported files. Files are only
+    # rewritten when their content changes (in incremental mode) and files exported
+    # previously, but not anymore, are removed.
+
+    def __init__(self, root, options):
+        self.root = Path(root)
+        self.incremental = options.get("incremental", False)
+        self.link = options.get("link") or "copy"
+        self.manifest_path = self.root / MANIFEST_NAME
+        self.old_manifest = {}
+        if self.manifest_path.exists():
+            with open(self.manifest_path) as f:
+                self.old_manifest = json.load(f)
+        self.manifest = {}
+        self.copied = self.skipped = self.deleted = 0
+
+    def is_unchanged(self, rel_path, entry):
+        old_entry = self.old_manifest.get(rel_path)
+        return (
+            self.incremental
+            and old_entry is not None
+            and old_entry["hash"] == entry["hash"]
+            and (self.root / rel_path).exists()
+        )
+
+    def prepare_dest(self, rel_path):
+        dest = self.root / rel_path
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        # dest might be a hard link to the source, so it can't be overwritten
+        dest.unlink(missing_ok=True)
+        return dest
+
+    def add_file(self, rel_path, src):
+        rel_path = str(rel_path)
+        stat = os.stat(src)
+        entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        old_entry = self.old_manifest.get(rel_path, {})
+        if all(old_entry.get(key) == value for key, value in entry.items()):
+            entry["hash"] = old_entry["hash"]
+        else:
+            entry["hash"] = get_file_hash(src)
+        self.manifest[rel_path] = entry
+        if self.is_unchanged(rel_path, entry):
+            self.skipped += 1
+            return
+        dest = self.prepare_dest(rel_path)
+        try:
+            if self.link == "hardlink":
+                os.link(src, dest)
+            elif self.link == "reflink":
+                reflink(src, dest)
+            else:
+                shutil.copy2(src, dest)
+        except (OSError, ImportError):
+            # linking isn't supported between these locations
+            dest.unlink(missing_ok=True)
+            shutil.copy2(src, dest)
+        self.copied += 1
+
+    def add_content(self, rel_path, content):
+        rel_path = str(rel_path)
+        if isinstance(content, str):
+            content = content.encode()
+        entry = {"hash": hashlib.sha256(content).hexdigest()}
+        self.manifest[rel_path] = entry
+        if self.is_unchanged(rel_path, entry):
+            self.skipped += 1
+            return
+        self.prepare_dest(rel_path).write_bytes(content)
+        self.copied += 1
+
+    def finish(self, remove_stale=True):
+        if remove_stale:
+            for rel_path in self.old_manifest.keys() - self.manifest.keys():
+                self.remove(rel_path)
+        else:
+            self.manifest = self.old_manifest | self.manifest
+        self.root.mkdir(parents=True, exist_ok=True)
+        with open(self.manifest_path, "w") as f:
+            json.dump(self.manifest, f)
+        return (
+            f"{self.copied} file(s) written, {self.skipped} skipped, "
+            f"{self.deleted} deleted."
+        )
+
+    def remove(self, rel_path):
+        dest = self.root / rel_path
+        if dest.exists():
+            dest.unlink()
+            self.deleted += 1
+        # remove directories left empty
+        for parent in dest.parents:
+            if parent == self.root or not parent.is_relative_to(self.root):
+                break
+            try:
+                parent.rmdir()
+            except OSError:
+                break
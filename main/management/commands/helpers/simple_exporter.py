@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand, CommandError, CommandParser
 from pathlib import Path
 from abc import ABC, abstractmethod
+from .export_target import ExportTarget, add_export_arguments
 
 
 class SimpleExporter(BaseCommand, ABC):
@@ -15,6 +16,7 @@ class SimpleExporter(BaseCommand, ABC):
             type=str,
             help=f"The path to the directory where the {self.res_name} will be exported.",
         )
+        add_export_arguments(parser)
         return super().add_arguments(parser)
 
     def handle(self, *args, **options):
@@ -26,10 +28,12 @@ class SimpleExporter(BaseCommand, ABC):
                 objects = self.model.objects.filter(name=name)
             except self.model.DoesNotExist:
                 raise CommandError(f"Specified {self.res_name} does not exist.")
-        export_path = Path(options["path"])
+        target = ExportTarget(Path(options["path"]), options)
         for obj in objects:
-            self.export(obj, export_path, options)
+            self.export(obj, target, options)
+        summary = target.finish(remove_stale=name == "*")
+        self.stdout.write(f"{self.res_name.capitalize()}s: {summary}")
 
     @abstractmethod
-    def export(self, obj, path, options):
+    def export(self, obj, target, options):
         pass
@@ -1,12 +1,189 @@
+import hashlib
 import json
-import shutil
-import tempfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import partial
 from pathlib import Path
+from shutil import rmtree
+import django
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
-from django.core.files import File
 from django.contrib.auth import get_user_model
-from main.models import Army
+from nanoid import generate
+from main.models import Army, AtlasPage, Blob, Resource, Token, UserDiskQuota
+
+
+def read_file(src_dir, name):
+    path = src_dir / name
+    return path.read_bytes() if path.is_file() else None
+
+
+@contextmanager
+def open_army_source(zip_src):
+    if zip_src.suffix == ".zip":
+        with zipfile.ZipFile(zip_src) as archive:
+            members = set(archive.namelist())
+            yield lambda name: archive.read(name) if name in members else None
+    elif zip_src.suffix == ".json":
+        yield partial(read_file, zip_src.parent)
+    elif zip_src.is_dir():
+        yield partial(read_file, zip_src)
+    else:
+        raise CommandError("Unsupported file type.")
+
+
+def check_dict_keys(d, name, allowed, ignored, warnings):
+    if not isinstance(d, dict):
+        raise CommandError(f"{name} is not a dictionary.")
+    keys = d.keys()
+    if not keys <= allowed:
+        raise CommandError(f"{name} contains invalid keys {list(keys - allowed)}.")
+    if keys & ignored:
+        warnings.append(f"{name} contains ignored keys {list(keys & ignored)}.")
+
+
+def strip_fingerprint(img_name):
+    # exported info.json references images with `?v=<digest>` suffix
+    if isinstance(img_name, str):
+        return img_name.split("?", 1)[0]
+    return img_name
+
+
+def parse_army_info(army_info, name, warnings):
+    check_dict_keys(
+        army_info,
+        "info.json",
+        {
+            "name",
+            "bases",
+            "tokens",
+            "defBackImg",
+            "markers",
+            "defBackImgRect",
+            "instructionLink",
+            "tags",
+        },
+        {"instructionLink", "tags"},
+        warnings,
+    )
+    name = name or army_info.get("name")
+    if not name:
+        raise CommandError("Army name not found in info.json.")
+    def_back_img = strip_fingerprint(army_info.get("defBackImg"))
+    def_back_img_rect = army_info.get("defBackImgRect")
+    tokens = []
+
+    def append_token(kind, info, repeat_front=False):
+        name = info.get("name") if isinstance(info, dict) else None
+        if not name:
+            raise CommandError("Token info does not specify its name.")
+        check_dict_keys(
+            info,
+            f"{name} token",
+            {
+                "name",
+                "img",
+                "imgRect",
+                "q",
+                "backImg",
+                "backImgRect",
+                "info",
+                "secret",
+                "id",
+            },
+            {"id"},
+            warnings,
+        )
+        img_name = strip_fingerprint(info.get("img"))
+        rect = info.get("imgRect")
+        if repeat_front:
+            back_img_name = strip_fingerprint(info.get("backImg")) or img_name
+            back_img_rect = info.get("backImgRect") or rect
+        else:
+            back_img_name = strip_fingerprint(info.get("backImg")) or def_back_img
+            back_img_rect = info.get("backImgRect") or def_back_img_rect
+        quantity = info.get("q")
+        additional_info = {}
+        if "info" in info and info.get("info") != "":
+            additional_info["info"] = info.get("info")
+        if "secret" in info:
+            additional_info["secret"] = info.get("secret")
+        if None in [
+            name,
+            img_name,
+            back_img_name,
+            quantity,
+        ]:
+            raise CommandError("Token info contains missing values.")
+        tokens.append(
+            {
+                "name": name,
+                "img": img_name,
+                "rect": rect,
+                "back_img": back_img_name,
+                "back_rect": back_img_rect,
+                "q": quantity,
+                "kind": kind,
+                "additional_info": additional_info or None,
+            }
+        )
+
+    for token in army_info.get("tokens", []):
+        append_token("u", token)
+    for marker in army_info.get("markers", []):
+        append_token("m", marker, True)
+    for base in army_info.get("bases", []):
+        append_token("h", base)
+    return name, tokens
+
+
+# Validates army source and stores its resources under a fresh army id. It doesn't
+# touch the database, so it can be run in worker processes.
+def load_army(zip_src, name=None):
+    start = time.perf_counter()
+    warnings = []
+    army_id = generate(size=12)
+    with open_army_source(zip_src) as read:
+        info_data = read("info.json")
+        if info_data is None:
+            raise CommandError("info.json not found in zip file.")
+        name, tokens = parse_army_info(json.loads(info_data), name, warnings)
+        res_names = list(
+            dict.fromkeys(n for t in tokens for n in (t["img"], t["back_img"]))
+        )
+        resources = []
+        try:
+            for res_name in res_names:
+                data = read(res_name)
+                if data is None:
+                    raise CommandError(f"Resource {res_name} not found in zip file.")
+                file_name = default_storage.save(
+                    f"armies/{army_id}/{Path(res_name).name}", ContentFile(data)
+                )
+                resources.append(
+                    {
+                        "name": res_name,
+                        "file": file_name,
+                        "size": len(data),
+                        "digest": hashlib.sha256(data).hexdigest(),
+                    }
+                )
+        except BaseException:
+            rmtree(Path(settings.MEDIA_ROOT) / "armies" / army_id, ignore_errors=True)
+            raise
+    return {
+        "id": army_id,
+        "name": name,
+        "resources": resources,
+        "tokens": tokens,
+        "warnings": warnings,
+        "elapsed": time.perf_counter() - start,
+    }
 
 
 class Command(BaseCommand):
@@ -50,6 +227,13 @@ class Command(BaseCommand):
             action="store_true",
             help="Marks imported army as official.",
         )
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            type=int,
+            default=1,
+            help="Number of worker processes unpacking and validating armies.",
+        )
         return super().add_arguments(parser)
 
     def handle(self, *args, **options):
@@ -58,145 +242,109 @@ class Command(BaseCommand):
             owner = User.objects.get(username=options["owner"])
         except User.DoesNotExist:
             raise CommandError("User does not exist.")
-        for zip_src in options["zip_src"]:
-            self.import_army(owner, Path(zip_src), options)
-
-    def import_army(self, owner, zip_src, options):
-        self.stdout.write(f"Importing army from {zip_src}...")
-        if zip_src.suffix == ".zip":
-            with tempfile.TemporaryDirectory() as temp_dir:
-                shutil.unpack_archive(zip_src, temp_dir)
-                self._import_army(owner, Path(temp_dir), options)
-        elif zip_src.suffix == ".json":
-            self._import_army(owner, zip_src.parent, options)
-        elif zip_src.is_dir():
-            self._import_army(owner, zip_src, options)
+        if options["jobs"] < 1:
+            raise CommandError("Number of jobs has to be positive.")
+        sources = [Path(zip_src) for zip_src in options["zip_src"]]
+        start = time.perf_counter()
+        if options["jobs"] == 1:
+            results = (
+                self.try_load(partial(load_army, src, options["name"]))
+                for src in sources
+            )
+            stats = self.import_armies(owner, sources, results, options)
         else:
-            raise CommandError("Unsupported file type.")
-
-    def _import_army(self, owner, src_dir, options):
-        info_path = src_dir / "info.json"
-        if not (info_path).exists():
-            raise CommandError("info.json not found in zip file.")
-        with open(info_path) as f:
-            army_info = json.load(f)
-        self.check_dict_keys(
-            army_info,
-            "info.json",
-            {
-                "name",
-                "bases",
-                "tokens",
-                "defBackImg",
-                "markers",
-                "defBackImgRect",
-                "instructionLink",
-                "tags",
-            },
-            {"instructionLink", "tags"},
+            with ProcessPoolExecutor(options["jobs"], initializer=django.setup) as pool:
+                futures = [
+                    pool.submit(load_army, src, options["name"]) for src in sources
+                ]
+                results = (self.try_load(future.result) for future in futures)
+                stats = self.import_armies(owner, sources, results, options)
+        imported, failed, tokens, resources = stats
+        self.stdout.write(
+            f"Imported {imported} army(ies) with {tokens} token(s) and "
+            f"{resources} resource(s) in {time.perf_counter() - start:.2f}s."
         )
-        name = options["name"] or army_info.get("name")
-        if not name:
-            raise CommandError("Army name not found in info.json.")
-        def_back_img = army_info.get("defBackImg")
-        def_back_img_rect = army_info.get("defBackImgRect")
-        resources = dict()
-
-        def append_resource(name):
-            nonlocal resources
-            if not name in resources:
-                resource_path = src_dir / name
-                if not resource_path.exists():
-                    raise CommandError(f"Resource {name} not found in zip file.")
-                with resource_path.open(mode="rb") as f:
-                    resources[name] = army.resource_set.create(
-                        name=name, file=File(f, name=resource_path.name)
+        if failed:
+            raise CommandError(f"Failed to import {failed} army(ies).")
+
+    def try_load(self, load):
+        try:
+            return load()
+        except (CommandError, OSError, ValueError, zipfile.BadZipFile) as e:
+            return e
+
+    def import_armies(self, owner, sources, results, options):
+        imported = failed = tokens = resources = 0
+        for zip_src, loaded in zip(sources, results):
+            self.stdout.write(f"Importing army from {zip_src}...")
+            if not isinstance(loaded, Exception):
+                try:
+                    elapsed = self.save_army(owner, loaded, options)
+                except Exception as e:
+                    rmtree(
+                        Path(settings.MEDIA_ROOT) / "armies" / loaded["id"],
+                        ignore_errors=True,
                     )
-            return resources[name]
-
-        def append_token(army, kind, info, repeat_front=False):
-            name = info.get("name")
-            if not name:
-                raise CommandError("Token info does not specify its name.")
-            self.check_dict_keys(
-                info,
-                f"{name} token",
-                {
-                    "name",
-                    "img",
-                    "imgRect",
-                    "q",
-                    "backImg",
-                    "backImgRect",
-                    "info",
-                    "secret",
-                    "id",
-                },
-                {"id"},
-            )
-            name = info.get("name")
-            img_name = info.get("img")
-            rect = info.get("imgRect")
-            if repeat_front:
-                back_img_name = info.get("backImg") or img_name
-                back_img_rect = info.get("backImgRect") or rect
-            else:
-                back_img_name = info.get("backImg") or def_back_img
-                back_img_rect = info.get("backImgRect") or def_back_img_rect
-            quantity = info.get("q")
-            additional_info = {}
-            if "info" in info and info.get("info") != "":
-                additional_info["info"] = info.get("info")
-            if "secret" in info:
-                additional_info["secret"] = info.get("secret")
-            if None in [
-                name,
-                img_name,
-                back_img_name,
-                quantity,
-            ]:
-                raise CommandError("Token info contains missing values.")
-            img = append_resource(img_name)
-            back_img = append_resource(back_img_name)
-            army.token_set.create(
-                name=name,
-                front_image=img,
-                front_image_rect=rect,
-                back_image=back_img,
-                back_image_rect=back_img_rect,
-                multiplicity=quantity,
-                kind=kind,
-                additional_info=additional_info or None,
+                    loaded = e
+            if isinstance(loaded, Exception):
+                failed += 1
+                self.stderr.write(f"Failed to import army: {loaded}")
+                continue
+            imported += 1
+            tokens += len(loaded["tokens"])
+            resources += len(loaded["resources"])
+            for warning in loaded["warnings"]:
+                self.stdout.write(self.style.WARNING(warning))
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Successfully imported army {loaded['name']}! "
+                    f"(load {loaded['elapsed']:.2f}s, save {elapsed:.2f}s)"
+                )
             )
+        return imported, failed, tokens, resources
 
+    def save_army(self, owner, loaded, options):
+        start = time.perf_counter()
         with transaction.atomic():
             army = Army.objects.create(
-                name=name,
+                id=loaded["id"],
+                name=loaded["name"],
                 owner=owner,
                 private=not options["public"],
                 utility=options["utility"],
                 custom=not options["official"],
             )
-            for token in army_info.get("tokens", []):
-                append_token(army, "u", token)
-            for marker in army_info.get("markers", []):
-                append_token(army, "m", marker, True)
-            for base in army_info.get("bases", []):
-                append_token(army, "h", base)
-
-            self.stdout.write(self.style.SUCCESS(f"Successfully imported army {name}!"))
-
-    def check_dict_keys(self, d, name, allowed, ignored=None):
-        if ignored is None:
-            ignored = set()
-        if not isinstance(d, dict):
-            raise CommandError(f"{name} is not a dictionary.")
-        keys = d.keys()
-        if not keys <= allowed:
-            raise CommandError(f"{name} contains invalid keys {list(keys - allowed)}.")
-        if keys & ignored:
-            self.stdout.write(
-                self.style.WARNING(
-                    f"{name} contains ignored keys {list(keys & ignored)}."
+            resources = {
+                res["name"]: Resource(
+                    army=army,
+                    name=res["name"],
+                    file=res["file"],
+                    size=res["size"],
+                    digest=res["digest"],
                 )
+                for res in loaded["resources"]
+            }
+            Blob.acquire(resources.values())
+            Resource.objects.bulk_create(resources.values())
+            UserDiskQuota.charge(
+                owner.id, sum(res["size"] for res in loaded["resources"])
+            )
+            Token.objects.bulk_create(
+                [
+                    Token(
+                        army=army,
+                        name=token["name"],
+                        front_image=resources[token["img"]],
+                        front_image_rect=token["rect"],
+                        back_image=resources[token["back_img"]],
+                        back_image_rect=token["back_rect"],
+                        multiplicity=token["q"],
+                        kind=token["kind"],
+                        additional_info=token["additional_info"],
+                    )
+                    for token in loaded["tokens"]
+                ]
             )
+            # bulk_create doesn't emit signals which keep atlas pages up to date
+            AtlasPage.schedule_update(army.id)
+        return time.perf_counter() - start
@@ -0,0 +1,459 @@
+import asyncio
+import json
+import random
+import re
+import time
+from collections import Counter, defaultdict
+from http.cookies import SimpleCookie
+from pathlib import Path
+from urllib.parse import urlencode, urlsplit
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.urls import reverse
+from main.models import Chair, NamedInvitation, Table
+
+# upper bounds of latency histogram buckets in milliseconds
+BUCKETS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+ROLE_REQUEST = re.compile(
+    r'<script id="roleRequest" type="application/json">(.*?)</script>', re.S
+)
+CSRF_TOKEN = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+
+
+class RequestFailed(Exception):
+    pass
+
+
+def dechunk(content):
+    body = b""
+    while content:
+        size, _, content = content.partition(b"\r\n")
+        size = int(size.split(b";")[0], 16)
+        if size == 0:
+            break
+        body += content[:size]
+        content = content[size + 2 :]
+    return body
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, len(values) * percent // 100)]
+
+
+class Client:
+    # Minimal HTTP/1.1 client over asyncio streams. Like a browser opening a page it
+    # uses fresh connection for every request and keeps cookies of its user.
+    def __init__(self, url, timeout, cookies=None):
+        parts = urlsplit(url)
+        self.ssl = parts.scheme == "https"
+        self.host = parts.hostname
+        self.port = parts.port or (443 if self.ssl else 80)
+        self.timeout = timeout
+        self.cookies = dict(cookies or {})
+
+    async def request(self, method, path, body=None, headers=None):
+        return await asyncio.wait_for(
+            self.send(method, path, body, headers or {}), self.timeout
+        )
+
+    async def send(self, method, path, body, headers):
+        reader, writer = await asyncio.open_connection(
+            self.host, self.port, ssl=self.ssl or None
+        )
+        try:
+            headers = {
+                "Host": f"{self.host}:{self.port}",
+                "Connection": "close",
+                "User-Agent": "nhex-load-test",
+            } | headers
+            if self.cookies:
+                headers["Cookie"] = "; ".join(
+                    f"{k}={v}" for k, v in self.cookies.items()
+                )
+            if body is not None:
+                headers["Content-Length"] = str(len(body))
+            head = f"{method} {path} HTTP/1.1\r\n" + "".join(
+                f"{name}: {value}\r\n" for name, value in headers.items()
+            )
+            writer.write(f"{head}\r\n".encode("latin-1") + (body or b""))
+            await writer.drain()
+            status_line = (await reader.readline()).split()
+            if len(status_line) < 2 or not status_line[1].isdigit():
+                raise RequestFailed("malformed response")
+            response_headers = []
+            while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                name, _, value = line.decode("latin-1").partition(":")
+                response_headers.append((name.strip().lower(), value.strip()))
+            # server closes the connection after the response
+            content = await reader.read()
+        finally:
+            writer.close()
+        for name, value in response_headers:
+            if name == "set-cookie":
+                for key, morsel in SimpleCookie(value).items():
+                    self.cookies[key] = morsel.value
+            elif name == "transfer-encoding" and value.lower() == "chunked":
+                content = dechunk(content)
+        return int(status_line[1]), content
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(Counter)
+        self.sessions = 0
+        self.dropped = 0
+        self.elapsed = 0.0
+
+    async def timed(self, endpoint, request, expected=(200,)):
+        start = time.perf_counter()
+        try:
+            status, content = await request
+        except (OSError, asyncio.TimeoutError, RequestFailed, ValueError) as e:
+            self.errors[endpoint][type(e).__name__] += 1
+            return None
+        self.latencies[endpoint].append(time.perf_counter() - start)
+        if status not in expected:
+            self.errors[endpoint][str(status)] += 1
+            return None
+        return content
+
+    def get_requests(self, endpoint=None):
+        endpoints = [endpoint] if endpoint else set(self.latencies) | set(self.errors)
+        return sum(
+            len(self.latencies[name])
+            + sum(
+                count
+                for error, count in self.errors[name].items()
+                if not error.isdigit()
+            )
+            for name in endpoints
+        )
+
+    def get_errors(self, endpoint=None):
+        endpoints = [endpoint] if endpoint else list(self.errors)
+        return sum(sum(self.errors[name].values()) for name in endpoints)
+
+    def get_histogram(self, latencies):
+        counts = Counter(
+            next((b for b in BUCKETS if latency * 1000 <= b), None)
+            for latency in latencies
+        )
+        return [(bucket, counts[bucket]) for bucket in BUCKETS + [None]]
+
+    def summary(self, rate):
+        requests = self.get_requests()
+        all_latencies = [v for values in self.latencies.values() for v in values]
+        return {
+            "rate": rate,
+            "sessions": self.sessions,
+            "dropped": self.dropped,
+            "elapsed": self.elapsed,
+            "requests": requests,
+            "throughput": requests / self.elapsed if self.elapsed else 0,
+            "error_rate": self.get_errors() / requests if requests else 0,
+            "p95_ms": percentile(all_latencies, 95) * 1000 if all_latencies else None,
+            "histogram": self.get_histogram(all_latencies),
+            "endpoints": {
+                name: {
+                    "requests": self.get_requests(name),
+                    "errors": dict(self.errors[name]),
+                    **{
+                        f"p{p}_ms": percentile(latencies, p) * 1000
+                        for p in [50, 95, 99]
+                        if latencies
+                    },
+                    "max_ms": max(latencies, default=0) * 1000,
+                }
+                for name, latencies in [
+                    (name, self.latencies[name])
+                    for name in sorted(set(self.latencies) | set(self.errors))
+                ]
+            },
+        }
+
+
+class Command(BaseCommand):
+    help = (
+        "Replays realistic traffic against running main server to find the load it "
+        "can't handle anymore. Sessions arrive at given rates (Poisson process): "
+        "each loads play page of a table as its owner, invited user or through link "
+        "invitation, fetches server info, board info and army info and then "
+        "stand-in table server authorizes its role request with forwarded cookies. "
+        "Tables, invitations and accounts (see seed_load_data) are read from the "
+        "database of the server. Rates are tried in given order until error rate "
+        "or 95th latency percentile exceeds given limits."
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--url",
+            default="http://127.0.0.1:8000",
+            help="Base url of the main server.",
+        )
+        parser.add_argument(
+            "-r",
+            "--rate",
+            type=float,
+            nargs="+",
+            default=[1, 5, 10, 20],
+            help="Arrival rates of sessions per second tried one after another.",
+        )
+        parser.add_argument(
+            "-d",
+            "--duration",
+            type=float,
+            default=30,
+            help="Number of seconds sessions arrive at each rate.",
+        )
+        parser.add_argument(
+            "--max-sessions",
+            type=int,
+            default=1000,
+            help="Maximal number of open sessions, later arrivals are dropped.",
+        )
+        parser.add_argument(
+            "--anonymous-ratio",
+            type=float,
+            default=0.5,
+            help="Fraction of sessions joining through link invitations.",
+        )
+        parser.add_argument(
+            "--accounts",
+            type=int,
+            default=20,
+            help="Number of accounts logged in before test (owners and invited).",
+        )
+        parser.add_argument(
+            "--password",
+            default="load",
+            help="Password of accounts (seed_load_data sets it).",
+        )
+        parser.add_argument(
+            "--armies",
+            type=int,
+            default=2,
+            help="Number of armies loaded in each session.",
+        )
+        parser.add_argument(
+            "--timeout", type=float, default=10, help="Request timeout in seconds."
+        )
+        parser.add_argument(
+            "--max-error-rate",
+            type=float,
+            default=0.01,
+            help="Error rate at which the server is considered overloaded.",
+        )
+        parser.add_argument(
+            "--max-p95",
+            type=float,
+            default=1000,
+            help="95th latency percentile (ms) at which the server is overloaded.",
+        )
+        parser.add_argument(
+            "-s", "--seed", type=int, default=0, help="Seed of generated traffic."
+        )
+        parser.add_argument("--json", help="Save results to given JSON file.")
+        return super().add_arguments(parser)
+
+    def handle(self, *args, **options):
+        if min(options["rate"]) <= 0 or options["duration"] <= 0:
+            raise CommandError("Rates and duration have to be positive.")
+        if options["max_sessions"] < 1 or options["armies"] < 0:
+            raise CommandError("Invalid number of sessions or armies.")
+        self.options = options
+        self.rng = random.Random(options["seed"])
+        self.link_invitations = list(
+            Chair.objects.exclude(link_invitation=None).values_list(
+                "link_invitation", "table_id", "table__board_id"
+            )[:10000]
+        )
+        owned = Table.objects.exclude(owner=None).order_by("?")
+        invitations = NamedInvitation.objects.order_by("?")
+        half = options["accounts"] // 2
+        self.owners = list(
+            owned.values_list("owner__username", "pk", "pk", "board_id")[
+                : options["accounts"] - half
+            ]
+        )
+        self.invited = list(
+            invitations.values_list(
+                "user__username", "pk", "chair__table_id", "chair__table__board_id"
+            )[:half]
+        )
+        if not self.link_invitations and not (self.owners or self.invited):
+            raise CommandError("There are no tables to play, run seed_load_data.")
+        results = asyncio.run(self.run())
+        if options["json"]:
+            Path(options["json"]).write_text(json.dumps(results, indent=2))
+
+    async def run(self):
+        options = self.options
+        # accounts are logged in once, sessions reuse their cookies
+        self.accounts = {"owner": [], "invited": []}
+        for kind, rows in [("owner", self.owners), ("invited", self.invited)]:
+            for username, *rest in rows:
+                cookies = await self.login(username)
+                if cookies is not None:
+                    self.accounts[kind].append((cookies, *rest))
+        if not self.link_invitations and not any(self.accounts.values()):
+            raise CommandError("No session can be started, login failed.")
+        results = []
+        for rate in options["rate"]:
+            stats = await self.run_stage(rate)
+            summary = stats.summary(rate)
+            results.append(summary)
+            self.report(summary)
+            if (
+                summary["error_rate"] > options["max_error_rate"]
+                or (summary["p95_ms"] or 0) > options["max_p95"]
+            ):
+                self.stdout.write(
+                    self.style.ERROR(f"Server is overloaded at {rate} sessions/s.")
+                )
+                break
+        else:
+            self.stdout.write(
+                self.style.SUCCESS("Server handled all rates within limits.")
+            )
+        return results
+
+    async def login(self, username):
+        client = Client(self.options["url"], self.options["timeout"])
+        path = reverse("users:login")
+        try:
+            _, content = await client.request("GET", path)
+            token = CSRF_TOKEN.search(content.decode())
+            body = urlencode(
+                {
+                    "username": username,
+                    "password": self.options["password"],
+                    "csrfmiddlewaretoken": token.group(1) if token else "",
+                }
+            ).encode()
+            status, _ = await client.request(
+                "POST",
+                path,
+                body,
+                {
+                    "Content-Type": "application/x-www-form-urlencoded",
+                    "Referer": self.options["url"] + path,
+                },
+            )
+        except (OSError, asyncio.TimeoutError, RequestFailed) as e:
+            raise CommandError(f"Can't connect to {self.options['url']}: {e}")
+        if status != 302:
+            self.stderr.write(f"Failed to log in as {username}.")
+            return None
+        return client.cookies
+
+    async def run_stage(self, rate):
+        stats = Stats()
+        sessions = set()
+        loop = asyncio.get_running_loop()
+        start = next_arrival = loop.time()
+        while True:
+            next_arrival += self.rng.expovariate(rate)
+            if next_arrival - start > self.options["duration"]:
+                break
+            await asyncio.sleep(max(0, next_arrival - loop.time()))
+            if len(sessions) >= self.options["max_sessions"]:
+                stats.dropped += 1
+                continue
+            stats.sessions += 1
+            session = asyncio.create_task(self.run_session(stats))
+            sessions.add(session)
+            session.add_done_callback(sessions.discard)
+        await asyncio.gather(*sessions)
+        stats.elapsed = loop.time() - start
+        return stats
+
+    def start_session(self):
+        kinds = [kind for kind, accounts in self.accounts.items() if accounts]
+        if self.link_invitations and (
+            not kinds or self.rng.random() < self.options["anonymous_ratio"]
+        ):
+            link, table_id, board_id = self.rng.choice(self.link_invitations)
+            path = reverse("main:link_invitation_play", args=[link])
+            return (
+                Client(self.options["url"], self.options["timeout"]),
+                path,
+                (
+                    table_id,
+                    board_id,
+                ),
+            )
+        kind = self.rng.choice(kinds)
+        cookies, pk, table_id, board_id = self.rng.choice(self.accounts[kind])
+        view = "main:play" if kind == "owner" else "main:named_invitation_play"
+        client = Client(self.options["url"], self.options["timeout"], cookies)
+        return client, reverse(view, args=[pk]), (table_id, board_id)
+
+    async def run_session(self, stats):
+        client, path, (table_id, board_id) = self.start_session()
+        content = await stats.timed("play", client.request("GET", path))
+        match = ROLE_REQUEST.search(content.decode()) if content else None
+        if match is None:
+            return
+        role_request = json.loads(match.group(1))
+        query = urlencode({"table": table_id})
+        content = await stats.timed(
+            "server_info",
+            client.request("GET", f"{reverse('main:server_info')}?{query}"),
+        )
+        armies = json.loads(content)["res"]["armies"] if content else []
+        chosen = self.rng.sample(armies, min(self.options["armies"], len(armies)))
+        requests = [
+            stats.timed(
+                "army_info",
+                client.request("GET", reverse("main:army_info", args=[army["id"]])),
+            )
+            for army in chosen
+        ]
+        if board_id:
+            path = reverse("main:board_info", args=[board_id])
+            requests.append(stats.timed("board_info", client.request("GET", path)))
+        await asyncio.gather(*requests)
+        # table server forwards cookies of the client connecting to the table
+        table_server = Client(
+            self.options["url"], self.options["timeout"], client.cookies
+        )
+        body = json.dumps({"tableId": table_id, "roleRequest": role_request}).encode()
+        await stats.timed(
+            "authorize_role_request",
+            table_server.request(
+                "POST",
+                reverse("main:authorize_role_request"),
+                body,
+                {"Content-Type": "application/json"},
+            ),
+        )
+
+    def report(self, summary):
+        self.stdout.write(
+            f"\n{summary['rate']} sessions/s: {summary['sessions']} session(s) "
+            f"({summary['dropped']} dropped), {summary['requests']} request(s) in "
+            f"{summary['elapsed']:.1f}s, {summary['throughput']:.1f} req/s, "
+            f"{summary['error_rate']:.2%} errors"
+        )
+        self.stdout.write(
+            f"{'endpoint':<24} {'requests':>8} {'errors':>6} {'p50 ms':>8} "
+            f"{'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+        )
+        for name, endpoint in summary["endpoints"].items():
+            self.stdout.write(
+                f"{name:<24} {endpoint['requests']:>8} "
+                f"{sum(endpoint['errors'].values()):>6} "
+                + " ".join(
+                    f"{endpoint.get(key, 0):>8.1f}"
+                    for key in ["p50_ms", "p95_ms", "p99_ms", "max_ms"]
+                )
+            )
+            for error, count in endpoint["errors"].items():
+                self.stdout.write(f"  {error}: {count}")
+        total = sum(count for _, count in summary["histogram"]) or 1
+        for bucket, count in summary["histogram"]:
+            label = f"<= {bucket} ms" if bucket else f"> {BUCKETS[-1]} ms"
+            self.stdout.write(
+                f"{label:>12} {'#' * round(40 * count / total):<40} {count}"
+            )
@@ -0,0 +1,242 @@
+import hashlib
+import json
+import math
+import os
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.db import transaction
+from main.filesize import naturalsize
+from main.models import ProvisionedTable, Table
+from main import shards
+from .helpers.export_target import get_file_hash
+
+
+class IntegrityError(Exception):
+    pass
+
+
+def get_dump_files(data_dir, table_id):
+    # Dump file of the table and files its history continues from (referenced by
+    # "prev" entries), paths relative to data directory of table sync server.
+    files = []
+    pending = [f"tables/{table_id}"]
+    while pending:
+        name = pending.pop()
+        if name in files:
+            continue
+        files.append(name)
+        with open(Path(data_dir) / name, encoding="utf8") as f:
+            for line in f:
+                try:
+                    prev_file = json.loads(line).get("prev", {}).get("file")
+                except (ValueError, AttributeError):
+                    continue
+                if isinstance(prev_file, str):
+                    pending.append(prev_file)
+    return files
+
+
+def copy_file(src, dest):
+    # Copy is written next to its destination and renamed when it is verified.
+    before = src.stat()
+    digest = hashlib.sha256()
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dest.with_name(f".{dest.name}.rebalance")
+    try:
+        with open(src, "rb") as f, open(tmp, "wb") as out:
+            while chunk := f.read(1024 * 1024):
+                digest.update(chunk)
+                out.write(chunk)
+            out.flush()
+            os.fsync(out.fileno())
+        after = src.stat()
+        if (before.st_size, before.st_mtime_ns) != (after.st_size, after.st_mtime_ns):
+            raise IntegrityError(f"{src} changed while being copied")
+        if get_file_hash(tmp) != digest.hexdigest():
+            raise IntegrityError(f"copy of {src} doesn't match the original")
+        os.replace(tmp, dest)
+    finally:
+        tmp.unlink(missing_ok=True)
+    return before.st_size
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves tables between table sync server shards, so they match placement "
+        "computed for shards configured in TSS_SHARDS. Dump files of moved tables "
+        "are copied between data directories of the shards (their data_dir) and "
+        "verified before Table rows are updated. Moved tables shouldn't be open "
+        "while the command runs."
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "-d",
+            "--drain",
+            action="append",
+            default=[],
+            help="Move all tables away from given shard. Can be used many times.",
+        )
+        parser.add_argument(
+            "-p",
+            "--placement",
+            choices=["hash", "least_loaded"],
+            help="Placement used to compute target shards (default TSS_PLACEMENT).",
+        )
+        parser.add_argument(
+            "-b",
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Number of tables moved before their rows are updated.",
+        )
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            type=int,
+            default=4,
+            help="Number of tables copied in parallel.",
+        )
+        parser.add_argument(
+            "--delete-source",
+            action="store_true",
+            help="Remove dump files of moved tables from their previous shard.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only print planned moves and sizes of transferred files.",
+        )
+        return super().add_arguments(parser)
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1 or options["jobs"] < 1:
+            raise CommandError("Batch size and number of jobs have to be positive.")
+        all_shards = shards.get_shards()
+        targets = {
+            name: shard
+            for name, shard in all_shards.items()
+            if name not in options["drain"]
+        }
+        if not targets:
+            raise CommandError("There is no shard left to move tables to.")
+        placement = options["placement"] or settings.TSS_PLACEMENT
+        tables = list(Table.objects.values_list("id", "placement_key", "shard"))
+        moves = self.plan(tables, targets, placement)
+        for shard in {name for move in moves for name in move[1:]}:
+            if "data_dir" not in all_shards.get(shard, {}):
+                raise CommandError(f"Shard {shard} has no data_dir configured.")
+
+        moved = failed = transferred = 0
+        for start in range(0, len(moves), options["batch_size"]):
+            batch = moves[start : start + options["batch_size"]]
+            if options["dry_run"]:
+                for move in batch:
+                    size = self.get_size(move, all_shards)
+                    transferred += size
+                    self.stdout.write(
+                        f"Would move {move[0]} from {move[1]} to {move[2]} "
+                        f"({naturalsize(size)})."
+                    )
+                continue
+            with ThreadPoolExecutor(options["jobs"]) as pool:
+                results = list(pool.map(lambda m: self.move(m, all_shards), batch))
+            done = [move for move, result in zip(batch, results) if result is not None]
+            self.update_tables(done)
+            if options["delete_source"]:
+                for table_id, src, _ in done:
+                    Path(all_shards[src]["data_dir"], "tables", table_id).unlink(
+                        missing_ok=True
+                    )
+            moved += len(done)
+            failed += len(batch) - len(done)
+            transferred += sum(result for result in results if result is not None)
+
+        if options["drain"] and not options["dry_run"]:
+            ProvisionedTable.objects.filter(shard__in=options["drain"]).delete()
+        summary = f"table(s) transferring {naturalsize(transferred)} ({transferred} B)"
+        if options["dry_run"]:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"Planned to move {len(moves)} {summary}. Nothing changed."
+                )
+            )
+            return
+        self.stdout.write(self.style.SUCCESS(f"Moved {moved} {summary}."))
+        if failed:
+            raise CommandError(f"Failed to move {failed} table(s).")
+
+    def plan(self, tables, targets, placement):
+        if len(targets) == 1 or placement == "hash":
+            moves = []
+            for table_id, placement_key, shard in tables:
+                # tables created without placement key (e.g. in admin) by their id
+                target = shards.place_by_hash(placement_key or table_id, targets)
+                if target != shard:
+                    moves.append((table_id, shard, target))
+            return moves
+        # Least loaded placement moves as few tables as possible: tables of drained
+        # shards and tables over the fair share of their shard.
+        weights = {name: shards.get_weight(shard) for name, shard in targets.items()}
+        total_weight = sum(weights.values())
+        by_shard = defaultdict(list)
+        for table_id, _, shard in tables:
+            by_shard[shard].append(table_id)
+        counts = Counter()
+        movable = []
+        for shard, table_ids in by_shard.items():
+            if shard not in targets:
+                movable += [(table_id, shard) for table_id in table_ids]
+                continue
+            share = math.ceil(len(tables) * weights[shard] / total_weight)
+            movable += [(table_id, shard) for table_id in table_ids[share:]]
+            counts[shard] = min(len(table_ids), share)
+        moves = []
+        for table_id, shard in movable:
+            target = min(targets, key=lambda name: counts[name] / weights[name])
+            counts[target] += 1
+            if target != shard:
+                moves.append((table_id, shard, target))
+        return moves
+
+    def get_size(self, move, all_shards):
+        table_id, src, _ = move
+        data_dir = Path(all_shards[src]["data_dir"])
+        try:
+            files = get_dump_files(data_dir, table_id)
+            return sum((data_dir / name).stat().st_size for name in files)
+        except OSError:
+            return 0
+
+    def move(self, move, all_shards):
+        table_id, src, dest = move
+        src_dir = Path(all_shards[src]["data_dir"])
+        dest_dir = Path(all_shards[dest]["data_dir"])
+        size = 0
+        try:
+            for name in get_dump_files(src_dir, table_id):
+                target = dest_dir / name
+                # files shared by histories of many tables may be already there
+                if target.exists() and get_file_hash(target) == get_file_hash(
+                    src_dir / name
+                ):
+                    continue
+                size += copy_file(src_dir / name, target)
+        except (OSError, IntegrityError) as e:
+            self.stderr.write(f"Failed to move table {table_id}: {e}")
+            return None
+        self.stdout.write(
+            f"Moved {table_id} from {src} to {dest} ({naturalsize(size)})."
+        )
+        return size
+
+    def update_tables(self, moves):
+        groups = defaultdict(list)
+        for table_id, src, dest in moves:
+            groups[(src, dest)].append(table_id)
+        with transaction.atomic():
+            for (src, dest), table_ids in groups.items():
+                Table.objects.filter(pk__in=table_ids, shard=src).update(shard=dest)
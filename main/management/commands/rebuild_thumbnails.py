@@ -0,0 +1,59 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from main.images import create_thumbnail
+from main.models import Blob
+
+
+class Command(BaseCommand):
+    help = "Generates missing thumbnails of stored resources."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "-a",
+            "--all",
+            action="store_true",
+            help="Regenerate also already existing thumbnails.",
+        )
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            type=int,
+            default=None,
+            help="Number of worker processes. Number of CPUs by default.",
+        )
+        return super().add_arguments(parser)
+
+    def handle(self, *args, **options):
+        if options["jobs"] is not None and options["jobs"] < 1:
+            raise CommandError("Number of jobs has to be positive.")
+        blobs = (
+            Blob.objects.all() if options["all"] else Blob.objects.filter(thumbnail="")
+        )
+        blobs = list(blobs)
+        start = time.perf_counter()
+        size = settings.RESOURCE_THUMBNAIL_SIZE
+        with ProcessPoolExecutor(options["jobs"]) as pool:
+            results = pool.map(
+                create_thumbnail,
+                [blob.file.path for blob in blobs],
+                [
+                    blob.thumbnail.storage.path(blob.get_thumbnail_name())
+                    for blob in blobs
+                ],
+                [size] * len(blobs),
+                chunksize=16,
+            )
+            created = []
+            for blob, success in zip(blobs, results):
+                if success:
+                    blob.thumbnail = blob.get_thumbnail_name()
+                    created.append(blob)
+        Blob.objects.bulk_update(created, ["thumbnail"], batch_size=1000)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Generated {len(created)} thumbnail(s), {len(blobs) - len(created)} "
+                f"resource(s) skipped in {time.perf_counter() - start:.2f}s."
+            )
+        )
@@ -0,0 +1,73 @@
+from collections import defaultdict
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F
+from main.filesize import naturalsize
+from main.models import Resource, UserDiskQuota
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes resource sizes and users' disk usage counters based on "
+        "files stored on disk and reports detected drift."
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "-u",
+            "--user_name",
+            type=str,
+            help="The user whose disk usage will be reconciled. All users by default.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report drift without fixing stored counters.",
+        )
+        return super().add_arguments(parser)
+
+    def handle(self, *args, **options):
+        quotas = UserDiskQuota.objects.select_related("user")
+        resources = Resource.objects.annotate(owner_id=F("army__owner"))
+        user_name = options.get("user_name")
+        if user_name is not None:
+            User = get_user_model()
+            try:
+                user = User.objects.get(username=user_name)
+            except User.DoesNotExist:
+                raise CommandError("User does not exist.")
+            quotas = quotas.filter(user=user)
+            resources = resources.filter(army__owner=user)
+
+        usage = defaultdict(int)
+        changed_resources = []
+        for res in resources.iterator(chunk_size=1000):
+            size = res.get_size()
+            usage[res.owner_id] += size
+            if size != res.size:
+                res.size = size
+                changed_resources.append(res)
+
+        changed_quotas = []
+        for quota in quotas.iterator(chunk_size=1000):
+            actual = usage[quota.user_id]
+            if actual != quota.used:
+                self.stdout.write(
+                    f"{quota.user.username}: counted {naturalsize(quota.used)}, "
+                    f"actual {naturalsize(actual)} (drift {quota.used - actual:+d} B)."
+                )
+                quota.used = actual
+                changed_quotas.append(quota)
+
+        summary = (
+            f"{len(changed_resources)} resource size(s) and "
+            f"{len(changed_quotas)} disk usage counter(s) out of date."
+        )
+        if options["dry_run"]:
+            self.stdout.write(self.style.WARNING(f"{summary} Nothing changed."))
+            return
+        with transaction.atomic():
+            Resource.objects.bulk_update(changed_resources, ["size"], batch_size=1000)
+            UserDiskQuota.objects.bulk_update(changed_quotas, ["used"], batch_size=1000)
+        self.stdout.write(self.style.SUCCESS(f"{summary} Fixed."))
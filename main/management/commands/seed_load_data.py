@@ -0,0 +1,509 @@
+import hashlib
+import random
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO
+from itertools import islice
+from pathlib import Path
+import django
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from nanoid.resources import alphabet
+from PIL import Image, ImageDraw
+from main.filesize import naturalsize
+from main.models import (
+    Army,
+    ArmyInfo,
+    Blob,
+    Board,
+    Chair,
+    Emote,
+    NamedInvitation,
+    Resource,
+    Table,
+    TableVisit,
+    Token,
+    UserDiskQuota,
+    blob_path,
+    link_file,
+)
+from main import server_info, shards
+from .import_army import parse_army_info
+
+TOKEN_IMAGE_SIZE = (160, 160)
+BOARD_IMAGE_SIZE = (1200, 1000)
+EMOTE_IMAGE_SIZE = (64, 64)
+
+
+def make_id(rng, size=12):
+    # the same alphabet as nanoid, but reproducible
+    return "".join(rng.choices(alphabet, k=size))
+
+
+def render_placeholder(seed, size):
+    rng = random.Random(seed)
+    color = tuple(rng.randrange(256) for _ in range(3))
+    image = Image.new("RGB", size, color)
+    draw = ImageDraw.Draw(image)
+    radius = min(size) * 0.4
+    draw.regular_polygon(
+        (size[0] / 2, size[1] / 2, radius), 6, fill=tuple(c // 2 for c in color)
+    )
+    draw.text((4, 4), str(seed), fill=(255, 255, 255))
+    out = BytesIO()
+    image.save(out, "PNG")
+    return out.getvalue()
+
+
+# Runs in worker processes. Writes placeholder image to given media file or to the
+# blob store (name None) and returns its name, size and digest.
+def write_placeholder(seed, size, name=None):
+    data = render_placeholder(seed, size)
+    digest = hashlib.sha256(data).hexdigest()
+    name = name or blob_path(digest, ".png")
+    dest = Path(default_storage.path(name))
+    if not dest.exists():
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        dest.write_bytes(data)
+    return name, len(data), digest
+
+
+def fake_placeholder(seed, size, name=None):
+    # rows reference files which aren't written (--no-media)
+    digest = hashlib.sha256(str(seed).encode()).hexdigest()
+    return name or blob_path(digest, ".png"), size[0] * size[1], digest
+
+
+def make_army_info(rng, name, images, tokens):
+    # army description in the info.json format of import_army command
+    def token(name, **kwargs):
+        return {
+            "name": name,
+            "img": rng.choice(images),
+            "q": rng.randint(1, 4),
+        } | kwargs
+
+    bases = max(1, tokens // 20)
+    markers = tokens // 5
+    return {
+        "name": name,
+        "defBackImg": images[0],
+        "bases": [token(f"HQ {i}", q=1) for i in range(bases)],
+        "markers": [token(f"Marker {i}") for i in range(markers)],
+        "tokens": [
+            token(f"Unit {i}", info=f"Initiative {rng.randint(0, 4)}")
+            for i in range(tokens - bases - markers)
+        ],
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates synthetic data for load testing: users, armies with tokens and "
+        "placeholder images, boards, emotes, tables with chairs, named and link "
+        "invitations and visit history. The same seed produces the same data (ids "
+        "included, apart from user ids and timestamps). Tables aren't created on "
+        "table sync servers."
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--users", type=int, default=1000, help="Number of users.")
+        parser.add_argument("--armies", type=int, default=100, help="Number of armies.")
+        parser.add_argument(
+            "--tokens", type=int, default=200, help="Number of tokens of each army."
+        )
+        parser.add_argument(
+            "--army-images",
+            type=int,
+            default=40,
+            help="Number of images (resources) of each army.",
+        )
+        parser.add_argument(
+            "--distinct-images",
+            type=int,
+            default=200,
+            help="Number of distinct token images shared by all armies.",
+        )
+        parser.add_argument(
+            "--public-ratio",
+            type=float,
+            default=0.2,
+            help="Fraction of armies which are public.",
+        )
+        parser.add_argument("--boards", type=int, default=5, help="Number of boards.")
+        parser.add_argument("--emotes", type=int, default=20, help="Number of emotes.")
+        parser.add_argument(
+            "--tables", type=int, default=5000, help="Number of tables."
+        )
+        parser.add_argument(
+            "--invitations",
+            type=int,
+            default=2,
+            help="Maximal number of named invitations of each chair.",
+        )
+        parser.add_argument(
+            "--visits", type=int, default=50000, help="Number of table visits."
+        )
+        parser.add_argument(
+            "--prefix",
+            default="load",
+            help="Prefix of names of generated users, armies and tables.",
+        )
+        parser.add_argument(
+            "--password",
+            default="load",
+            help="Password of all generated users.",
+        )
+        parser.add_argument(
+            "-s", "--seed", type=int, default=0, help="Seed of generated data."
+        )
+        parser.add_argument(
+            "-b",
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="Number of rows inserted at once.",
+        )
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            type=int,
+            default=4,
+            help="Number of worker processes writing media files.",
+        )
+        parser.add_argument(
+            "--no-media",
+            action="store_true",
+            help="Don't write media files, only rows referencing them.",
+        )
+        return super().add_arguments(parser)
+
+    def handle(self, *args, **options):
+        counts = [options[name] for name in ["users", "armies", "boards", "tables"]]
+        if min(counts) < 1 or options["batch_size"] < 1 or options["jobs"] < 1:
+            raise CommandError(
+                "Numbers of users, armies, boards, tables, batch size and jobs "
+                "have to be positive."
+            )
+        if options["army_images"] < 1 or options["distinct_images"] < 1:
+            raise CommandError("Numbers of images have to be positive.")
+        User = get_user_model()
+        prefix = options["prefix"]
+        if User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(
+                f"Users with prefix {prefix} already exist, use another --prefix."
+            )
+        self.options = options
+        # prefix is mixed in, so data generated with other prefix doesn't collide
+        self.rng = random.Random(f"{options['seed']}-{prefix}")
+        start = time.perf_counter()
+        media = self.write_media()
+        with transaction.atomic():
+            users = self.timed("user(s)", self.create_users)
+            boards = self.timed("board(s)", self.create_boards, media["boards"])
+            self.timed("emote(s)", self.create_emotes, media["emotes"])
+            self.timed("army(ies)", self.create_armies, users, media["images"])
+            tables = self.timed("table(s)", self.create_tables, users, boards)
+            self.timed("visit(s)", self.create_visits, users, tables)
+            server_info.invalidate()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Generated data in {time.perf_counter() - start:.2f}s. Password of "
+                f"generated users is {options['password']!r}."
+            )
+        )
+
+    def timed(self, label, create, *args):
+        start = time.perf_counter()
+        result, created = create(*args)
+        self.stdout.write(
+            f"Created {created} {label} in {time.perf_counter() - start:.2f}s."
+        )
+        return result
+
+    def insert(self, model, objs):
+        # objects are generated lazily, so only a batch of them is in memory
+        objs = iter(objs)
+        created = 0
+        while batch := list(islice(objs, self.options["batch_size"])):
+            model.objects.bulk_create(batch)
+            created += len(batch)
+        return created
+
+    def write_media(self):
+        prefix = self.options["prefix"]
+        seed = self.options["seed"]
+        jobs = (
+            [
+                ("images", seed * 1_000_000 + i, TOKEN_IMAGE_SIZE, None)
+                for i in range(self.options["distinct_images"])
+            ]
+            + [
+                (
+                    "boards",
+                    f"{seed}-board-{i}",
+                    BOARD_IMAGE_SIZE,
+                    f"boards/{prefix}{i}.png",
+                )
+                for i in range(self.options["boards"])
+            ]
+            + [
+                (
+                    "emotes",
+                    f"{seed}-emote-{i}",
+                    EMOTE_IMAGE_SIZE,
+                    f"emojis/{prefix}{i}.png",
+                )
+                for i in range(self.options["emotes"])
+            ]
+        )
+        start = time.perf_counter()
+        if self.options["no_media"]:
+            results = [fake_placeholder(*job[1:]) for job in jobs]
+        else:
+            with ProcessPoolExecutor(
+                self.options["jobs"], initializer=django.setup
+            ) as pool:
+                futures = [pool.submit(write_placeholder, *job[1:]) for job in jobs]
+                results = [future.result() for future in futures]
+            size = sum(result[1] for result in results)
+            self.stdout.write(
+                f"Wrote {len(jobs)} image(s) ({naturalsize(size)}) in "
+                f"{time.perf_counter() - start:.2f}s."
+            )
+        media = {"images": [], "boards": [], "emotes": []}
+        for job, result in zip(jobs, results):
+            media[job[0]].append(result)
+        return media
+
+    def create_users(self):
+        User = get_user_model()
+        prefix = self.options["prefix"]
+        password = make_password(self.options["password"])
+        created = self.insert(
+            User,
+            (
+                User(username=f"{prefix}{i}", password=password)
+                for i in range(self.options["users"])
+            ),
+        )
+        ids = dict(
+            User.objects.filter(username__startswith=prefix).values_list(
+                "username", "pk"
+            )
+        )
+        return [ids[f"{prefix}{i}"] for i in range(self.options["users"])], created
+
+    def create_boards(self, images):
+        rng = self.rng
+        priority = Board.objects.aggregate(Max("defaultPriority"))[
+            "defaultPriority__max"
+        ]
+        boards = [
+            Board(
+                id=make_id(rng),
+                name=f"{self.options['prefix']} board {i}",
+                image=name,
+                image_digest=digest,
+                defaultPriority=(priority or 0) + i + 1,
+            )
+            for i, (name, _, digest) in enumerate(images)
+        ]
+        Board.objects.bulk_create(boards)
+        return [board.pk for board in boards], len(boards)
+
+    def create_emotes(self, images):
+        emotes = [
+            Emote(
+                id=make_id(self.rng),
+                name=f"{self.options['prefix']} emote {i}",
+                image=name,
+                image_digest=digest,
+            )
+            for i, (name, _, digest) in enumerate(images)
+        ]
+        Emote.objects.bulk_create(emotes)
+        return None, len(emotes)
+
+    def create_armies(self, users, images):
+        options = self.options
+        order = Army.objects.aggregate(Max("my_order"))["my_order__max"] or 0
+        used = Counter()
+        if not options["no_media"]:
+            Blob.objects.bulk_create(
+                [
+                    Blob(digest=digest, file=name, size=size)
+                    for name, size, digest in images
+                ],
+                ignore_conflicts=True,
+            )
+        # armies are generated in chunks, so their tokens don't fill up memory
+        chunk = max(1, options["batch_size"] // max(1, options["tokens"]))
+        resources = tokens = 0
+        with ThreadPoolExecutor(options["jobs"]) as pool:
+            for start in range(0, options["armies"], chunk):
+                armies, army_resources, army_tokens = self.generate_armies(
+                    range(start, min(start + chunk, options["armies"])),
+                    users,
+                    images,
+                    order,
+                )
+                if not options["no_media"]:
+                    # army media directories contain hard links to blob files
+                    links = [
+                        (
+                            default_storage.path(blob_path(res.digest, ".png")),
+                            res.file.path,
+                        )
+                        for res in army_resources
+                    ]
+                    list(pool.map(lambda link: link_file(*link), links))
+                    Blob.add_references(Counter(r.digest for r in army_resources))
+                for res in army_resources:
+                    used[res.army.owner_id] += res.size
+                self.insert(Army, armies)
+                self.insert(ArmyInfo, (ArmyInfo(army=army) for army in armies))
+                resources += self.insert(Resource, army_resources)
+                tokens += self.insert(Token, army_tokens)
+        self.insert(
+            UserDiskQuota,
+            (
+                UserDiskQuota(id=make_id(self.rng), user_id=user, used=used[user])
+                for user in users
+            ),
+        )
+        self.stdout.write(f"Created {resources} resource(s) and {tokens} token(s).")
+        return None, options["armies"]
+
+    def generate_armies(self, indices, users, images, order):
+        rng = self.rng
+        options = self.options
+        armies = []
+        resources = []
+        tokens = []
+        for i in indices:
+            army = Army(
+                id=make_id(rng),
+                name=f"{options['prefix']} army {i}",
+                owner_id=rng.choice(users),
+                private=rng.random() >= options["public_ratio"],
+                my_order=order + i + 1,
+            )
+            armies.append(army)
+            names = [f"image{j}.png" for j in range(options["army_images"])]
+            _, army_tokens = parse_army_info(
+                make_army_info(rng, army.name, names, options["tokens"]), None, []
+            )
+            army_resources = {}
+            for name in names:
+                blob, size, digest = rng.choice(images)
+                army_resources[name] = Resource(
+                    id=make_id(rng),
+                    army=army,
+                    name=name,
+                    file=f"armies/{army.pk}/{name}",
+                    size=size,
+                    digest=digest,
+                    blob_id=None if options["no_media"] else digest,
+                )
+            resources += army_resources.values()
+            tokens += [
+                Token(
+                    id=make_id(rng),
+                    army=army,
+                    name=token["name"],
+                    front_image=army_resources[token["img"]],
+                    front_image_rect=token["rect"],
+                    back_image=army_resources[token["back_img"]],
+                    back_image_rect=token["back_rect"],
+                    multiplicity=token["q"],
+                    kind=token["kind"],
+                    additional_info=token["additional_info"],
+                )
+                for token in army_tokens
+            ]
+        return armies, resources, tokens
+
+    def create_tables(self, users, boards):
+        options = self.options
+        tables = []
+        chairs = invitations = 0
+        # tables are generated in batches together with their chairs and invitations
+        for start in range(0, options["tables"], options["batch_size"]):
+            batch = self.generate_tables(
+                range(start, min(start + options["batch_size"], options["tables"])),
+                users,
+                boards,
+            )
+            self.insert(Table, batch[0])
+            chairs += self.insert(Chair, batch[1])
+            invitations += self.insert(NamedInvitation, batch[2])
+            tables += [table.pk for table in batch[0]]
+        self.stdout.write(
+            f"Created {chairs} chair(s) and {invitations} named invitation(s)."
+        )
+        return tables, len(tables)
+
+    def generate_tables(self, indices, users, boards):
+        rng = self.rng
+        options = self.options
+        tables = []
+        chairs = []
+        invitations = []
+        # tables of the batch are saved only after all of them are placed
+        placed = Counter()
+        for i in indices:
+            # some tables are created by anonymous users
+            owner = rng.choice(users) if rng.random() < 0.9 else None
+            table = Table(
+                id=make_id(rng),
+                name=f"{options['prefix']} table {i}",
+                owner_id=owner,
+                board_id=rng.choice(boards),
+            )
+            # placed the same way as tables created in the tables view
+            table.placement_key = str(owner) if owner else make_id(rng)
+            table.shard = shards.place(table.placement_key, pending=placed)
+            placed[table.shard] += 1
+            tables.append(table)
+            for name, kind, arity in [("Players", "p", 2), ("Spectators", "s", 10)]:
+                chair = Chair(
+                    id=make_id(rng),
+                    table=table,
+                    name=name,
+                    kind=kind,
+                    arity=arity,
+                    link_invitation=make_id(rng, 10) if rng.random() < 0.5 else None,
+                )
+                chairs.append(chair)
+                count = min(rng.randint(0, options["invitations"]), len(users))
+                invitations += [
+                    NamedInvitation(id=make_id(rng), chair=chair, user_id=user)
+                    for user in rng.sample(users, count)
+                ]
+        return tables, chairs, invitations
+
+    def create_visits(self, users, tables):
+        rng = self.rng
+        now = timezone.now()
+        count = min(self.options["visits"], len(users) * len(tables))
+        pairs = set()
+        while len(pairs) < count:
+            pairs.add((rng.choice(users), rng.choice(tables)))
+        visits = (
+            TableVisit(
+                user_id=user,
+                table_id=table,
+                visited_at=now - timedelta(seconds=rng.randrange(90 * 24 * 3600)),
+                visit_count=rng.randint(1, 50),
+            )
+            for user, table in sorted(pairs)
+        )
+        return None, self.insert(TableVisit, visits)
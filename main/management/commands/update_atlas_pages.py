@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandParser
+from main.models import Army, AtlasPage
+
+
+class Command(BaseCommand):
+    help = (
+        "Packs token images of armies into texture atlas pages. Pages are updated "
+        "whenever army changes, so this is needed only for armies saved before."
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "army",
+            nargs="*",
+            type=str,
+            help="Ids of armies whose pages will be updated. All armies by default.",
+        )
+        return super().add_arguments(parser)
+
+    def handle(self, *args, **options):
+        armies = Army.objects.all()
+        if options["army"]:
+            armies = armies.filter(pk__in=options["army"])
+        army_ids = list(armies.values_list("pk", flat=True))
+        updated = sum(AtlasPage.update(army_id) for army_id in army_ids)
+        self.stdout.write(f"Updated pages of {updated} of {len(army_ids)} army(ies).")
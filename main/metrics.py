@@ -0,0 +1,271 @@
+import atexit
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from nanoid import generate
+from . import querycount
+
+# Metrics exposed in Prometheus text format at /metrics (see views.export_metrics).
+# Every process collects them in memory. With METRICS_DIR set (needed when running
+# multiple worker processes) every process also writes them to its own file in that
+# directory, at most once per METRICS_FLUSH_INTERVAL seconds (checked when request
+# finishes) and at exit, and /metrics sums files of all processes. Files of exited
+# processes are kept so counters never go back, the directory should be emptied on
+# deployment.
+logger = logging.getLogger(__name__)
+lock = threading.Lock()
+# (metric name, label values) -> counter value or histogram bucket counts
+values = {}
+registry = {}
+# pid alone could be reused by process started later
+process_file = f"{os.getpid()}-{generate(size=8)}.json"
+last_flush = time.monotonic()
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        registry[name] = self
+
+    def inc(self, amount=1, **labels):
+        key = (self.name, tuple(str(labels[label]) for label in self.labels))
+        with lock:
+            values[key] = values.get(key, 0) + amount
+
+    def merge(self, total, value):
+        return (total or 0) + value
+
+    def render(self, labels, value):
+        yield self.name, labels, value
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        registry[name] = self
+
+    def observe(self, value, **labels):
+        key = (self.name, tuple(str(labels[label]) for label in self.labels))
+        # counts of observations in every bucket (last one is +Inf) and their sum
+        index = next(
+            (i for i, bound in enumerate(self.buckets) if value <= bound),
+            len(self.buckets),
+        )
+        with lock:
+            counts = values.setdefault(key, [0] * (len(self.buckets) + 2))
+            counts[index] += 1
+            counts[-1] += value
+
+    def merge(self, total, value):
+        return [a + b for a, b in zip(total, value)] if total else value
+
+    def render(self, labels, counts):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), counts):
+            cumulative += count
+            yield f"{self.name}_bucket", labels + (("le", str(bound)),), cumulative
+        yield f"{self.name}_sum", labels, counts[-1]
+        yield f"{self.name}_count", labels, cumulative
+
+
+http_requests = Counter(
+    "nhex_http_requests_total",
+    "Handled HTTP requests.",
+    ("view", "method", "status"),
+)
+http_request_duration = Histogram(
+    "nhex_http_request_duration_seconds",
+    "Time spent handling HTTP requests.",
+    ("view",),
+)
+http_request_queries = Histogram(
+    "nhex_http_request_queries",
+    "Database queries made to handle HTTP requests.",
+    ("view",),
+    QUERY_BUCKETS,
+)
+http_response_size = Histogram(
+    "nhex_http_response_size_bytes",
+    "Sizes of HTTP response bodies.",
+    ("view",),
+    SIZE_BUCKETS,
+)
+tss_requests = Counter(
+    "nhex_tss_requests_total",
+    "Requests to table sync servers by outcome (ok, failures or rejected by open "
+    "circuit breaker).",
+    ("endpoint", "outcome"),
+)
+tss_request_duration = Histogram(
+    "nhex_tss_request_duration_seconds",
+    "Time spent waiting for table sync servers.",
+    ("endpoint",),
+)
+cache_lookups = Counter(
+    "nhex_cache_lookups_total",
+    "Cache lookups by cached data and result (hit or miss).",
+    ("cache", "result"),
+)
+uploaded_files = Counter(
+    "nhex_uploaded_files_total", "Files uploaded by users.", ("kind",)
+)
+uploaded_bytes = Counter(
+    "nhex_uploaded_bytes_total", "Bytes uploaded by users.", ("kind",)
+)
+
+
+def count_cache_lookups(cache, hits, misses):
+    if hits:
+        cache_lookups.inc(hits, cache=cache, result="hit")
+    if misses:
+        cache_lookups.inc(misses, cache=cache, result="miss")
+
+
+def snapshot():
+    with lock:
+        return [
+            [name, labels, value.copy() if isinstance(value, list) else value]
+            for (name, labels), value in values.items()
+        ]
+
+
+def flush():
+    global last_flush
+    last_flush = time.monotonic()
+    if not settings.METRICS_DIR:
+        return
+    directory = Path(settings.METRICS_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    # replaced atomically so other processes never read partially written file
+    with tempfile.NamedTemporaryFile(
+        "w", dir=directory, suffix=".tmp", delete=False
+    ) as file:
+        json.dump(snapshot(), file)
+    os.replace(file.name, directory / process_file)
+
+
+@atexit.register
+def flush_at_exit():
+    try:
+        flush()
+    except Exception as e:
+        logger.warning("Unable to save metrics: %s", e)
+
+
+def collect():
+    # merged metrics of all processes as {(name, labels): value}
+    if not settings.METRICS_DIR:
+        samples = [snapshot()]
+    else:
+        flush()
+        samples = []
+        for path in Path(settings.METRICS_DIR).glob("*.json"):
+            try:
+                samples.append(json.loads(path.read_text()))
+            except (OSError, ValueError) as e:
+                logger.warning("Unable to read metrics from %s: %s", path, e)
+    merged = {}
+    for sample in samples:
+        for name, labels, value in sample:
+            if name in registry:
+                key = (name, tuple(labels))
+                merged[key] = registry[name].merge(merged.get(key), value)
+    return merged
+
+
+def escape(value):
+    return value.replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def render():
+    merged = sorted(collect().items())
+    lines = []
+    for name, metric in registry.items():
+        lines.append(f"# HELP {name} {metric.help}")
+        lines.append(f"# TYPE {name} {metric.type}")
+        for (sample_name, label_values), value in merged:
+            if sample_name != name:
+                continue
+            for line_name, labels, line_value in metric.render(
+                tuple(zip(metric.labels, label_values)), value
+            ):
+                label_text = ",".join(f'{k}="{escape(v)}"' for k, v in labels)
+                lines.append(f"{line_name}{{{label_text}}} {float(line_value)!r}")
+    return "\n".join(lines) + "\n"
+
+
+def get_view_name(request):
+    # requests which didn't match any route have no resolver match
+    match = getattr(request, "resolver_match", None)
+    return match.view_name if match is not None else "unresolved"
+
+
+def get_response_size(response):
+    if not response.streaming:
+        return len(response.content)
+    if response.has_header("Content-Length"):
+        return int(response["Content-Length"])
+    return None
+
+
+class MetricsMiddleware:
+    # Records latency, number of database queries and response size of every request
+    # labeled by name of the URL which handled it.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        with querycount.record_queries() as log:
+            response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - start, log)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        with querycount.record_queries() as log:
+            response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - start, log)
+        return response
+
+    def record(self, request, response, elapsed, log):
+        view = get_view_name(request)
+        http_requests.inc(view=view, method=request.method, status=response.status_code)
+        http_request_duration.observe(elapsed, view=view)
+        http_request_queries.observe(len(log), view=view)
+        if (size := get_response_size(response)) is not None:
+            http_response_size.observe(size, view=view)
+        if time.monotonic() - last_flush >= settings.METRICS_FLUSH_INTERVAL:
+            try:
+                flush()
+            except OSError as e:
+                logger.warning("Unable to save metrics: %s", e)
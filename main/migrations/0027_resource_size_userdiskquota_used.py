@@ -0,0 +1,43 @@
+# Generated by Django 5.0.3 on 2026-10-18 10:27
+
+import os
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def compute_disk_usage(apps, schema_editor):
+    Resource = apps.get_model("main", "Resource")
+    UserDiskQuota = apps.get_model("main", "UserDiskQuota")
+    resources = []
+    for res in Resource.objects.iterator():
+        if res.file and os.path.exists(res.file.path):
+            res.size = os.path.getsize(res.file.path)
+            resources.append(res)
+    Resource.objects.bulk_update(resources, ["size"], batch_size=1000)
+    usage = Resource.objects.values("army__owner").annotate(total=Sum("size"))
+    for row in usage:
+        UserDiskQuota.objects.filter(user_id=row["army__owner"]).update(
+            used=row["total"]
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0026_alter_table_options_tablevisit_table_visits"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="resource",
+            name="size",
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="userdiskquota",
+            name="used",
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(compute_disk_usage, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.0.3 on 2026-10-18 10:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_army_infos(apps, schema_editor):
+    Army = apps.get_model('main', 'Army')
+    ArmyInfo = apps.get_model('main', 'ArmyInfo')
+    ArmyInfo.objects.bulk_create(
+        [ArmyInfo(army_id=army_id) for army_id in Army.objects.values_list('id', flat=True)],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0027_resource_size_userdiskquota_used'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArmyInfo',
+            fields=[
+                ('army', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='main.army')),
+                ('content', models.BinaryField(null=True)),
+                ('etag', models.CharField(blank=True, max_length=34)),
+                ('revision', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_army_infos, migrations.RunPython.noop),
+    ]
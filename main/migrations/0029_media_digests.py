@@ -0,0 +1,67 @@
+# Generated by Django 5.0.3 on 2026-10-18 10:37
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def get_digest(field_file):
+    digest = hashlib.sha256()
+    try:
+        with field_file.storage.open(field_file.name, "rb") as f:
+            for chunk in f.chunks():
+                digest.update(chunk)
+    except FileNotFoundError:
+        return ""
+    return digest.hexdigest()
+
+
+def compute_digests(apps, schema_editor):
+    for model_name, file_field, digest_field in [
+        ("Resource", "file", "digest"),
+        ("Board", "image", "image_digest"),
+        ("Emote", "image", "image_digest"),
+        ("EmoteAlternativeImage", "image", "image_digest"),
+    ]:
+        Model = apps.get_model("main", model_name)
+        objs = []
+        for obj in Model.objects.iterator():
+            field_file = getattr(obj, file_field)
+            if field_file:
+                setattr(obj, digest_field, get_digest(field_file))
+                objs.append(obj)
+        Model.objects.bulk_update(objs, [digest_field], batch_size=1000)
+    # stored army infos have to be rebuilt with fingerprinted urls
+    ArmyInfo = apps.get_model("main", "ArmyInfo")
+    ArmyInfo.objects.update(content=None, revision=models.F("revision") + 1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0028_armyinfo"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="board",
+            name="image_digest",
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name="emote",
+            name="image_digest",
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name="emotealternativeimage",
+            name="image_digest",
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name="resource",
+            name="digest",
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.RunPython(compute_digests, migrations.RunPython.noop),
+    ]
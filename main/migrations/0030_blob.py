@@ -0,0 +1,67 @@
+# Generated by Django 5.0.3 on 2026-10-18 10:41
+
+import os
+import shutil
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_blobs(apps, schema_editor):
+    Blob = apps.get_model("main", "Blob")
+    Resource = apps.get_model("main", "Resource")
+    blobs = {}
+    resources = []
+    for res in Resource.objects.exclude(digest="").iterator():
+        if res.digest not in blobs:
+            ext = os.path.splitext(res.file.name)[1]
+            name = f"blobs/{res.digest[:2]}/{res.digest}{ext}"
+            dest = res.file.storage.path(name)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            try:
+                if not os.path.exists(dest):
+                    try:
+                        os.link(res.file.path, dest)
+                    except OSError:
+                        shutil.copyfile(res.file.path, dest)
+            except FileNotFoundError:
+                continue
+            blobs[res.digest] = Blob(digest=res.digest, file=name, size=res.size)
+        blobs[res.digest].refcount += 1
+        res.blob_id = res.digest
+        resources.append(res)
+    Blob.objects.bulk_create(blobs.values(), batch_size=1000)
+    Resource.objects.bulk_update(resources, ["blob"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0029_media_digests"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Blob",
+            fields=[
+                (
+                    "digest",
+                    models.CharField(max_length=64, primary_key=True, serialize=False),
+                ),
+                ("file", models.FileField(max_length=255, upload_to="")),
+                ("size", models.PositiveBigIntegerField(default=0)),
+                ("refcount", models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="resource",
+            name="blob",
+            field=models.ForeignKey(
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                to="main.blob",
+            ),
+        ),
+        migrations.RunPython(create_blobs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.3 on 2026-10-18 10:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0030_blob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="blob",
+            name="thumbnail",
+            field=models.FileField(blank=True, max_length=255, upload_to=""),
+        ),
+    ]
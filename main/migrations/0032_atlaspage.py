@@ -0,0 +1,45 @@
+# Generated by Django 5.0.3 on 2026-10-18 10:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def invalidate_army_infos(apps, schema_editor):
+    # stored army infos have to be rebuilt to use atlases
+    ArmyInfo = apps.get_model("main", "ArmyInfo")
+    ArmyInfo.objects.update(content=None, revision=models.F("revision") + 1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0031_blob_thumbnail"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AtlasPage",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("file", models.FileField(max_length=255, upload_to="")),
+                ("digest", models.CharField(max_length=64)),
+                ("area", models.PositiveBigIntegerField(default=0)),
+                ("entries", models.JSONField(default=dict)),
+                (
+                    "army",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="main.army"
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(invalidate_army_infos, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.0.3 on 2026-10-18 10:58
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def collapse_visits(apps, schema_editor):
+    # keeps the latest row of each (user, table) pair holding all its visits
+    TableVisit = apps.get_model("main", "TableVisit")
+    groups = TableVisit.objects.values("user", "table").annotate(
+        keep=Max("id"), count=Count("id"), last=Max("visited_at")
+    )
+    collapsed = [
+        TableVisit(
+            id=group["keep"], visit_count=group["count"], visited_at=group["last"]
+        )
+        for group in groups.filter(count__gt=1).iterator()
+    ]
+    TableVisit.objects.exclude(id__in=groups.values("keep")).delete()
+    TableVisit.objects.bulk_update(
+        collapsed, ["visit_count", "visited_at"], batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0032_atlaspage"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="tablevisit",
+            name="visit_count",
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AlterField(
+            model_name="tablevisit",
+            name="visited_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(collapse_visits, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="tablevisit",
+            constraint=models.UniqueConstraint(
+                fields=("user", "table"), name="unique_user_table_visit"
+            ),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.0.3 on 2026-10-18 11:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0033_tablevisit_counter"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProvisionedTable",
+            fields=[
+                (
+                    "id",
+                    models.CharField(
+                        editable=False, max_length=12, primary_key=True, serialize=False
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.3 on 2026-10-18 11:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0034_provisionedtable"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="provisionedtable",
+            name="shard",
+            field=models.CharField(default="default", max_length=50),
+        ),
+        migrations.AddField(
+            model_name="table",
+            name="shard",
+            field=models.CharField(default="default", max_length=50),
+        ),
+    ]
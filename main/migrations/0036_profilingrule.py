@@ -0,0 +1,53 @@
+# Generated by Django 5.0.3 on 2026-10-18 12:07
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0035_table_shard"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProfilingRule",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "url_name",
+                    models.CharField(
+                        help_text="URL name as labeled in /metrics, e.g. main:server_info.",
+                        max_length=200,
+                        unique=True,
+                    ),
+                ),
+                (
+                    "sample_rate",
+                    models.FloatField(
+                        default=0.01,
+                        validators=[
+                            django.core.validators.MinValueValidator(0),
+                            django.core.validators.MaxValueValidator(1),
+                        ],
+                    ),
+                ),
+                ("enabled", models.BooleanField(default=True)),
+                (
+                    "expires_at",
+                    models.DateTimeField(
+                        blank=True, help_text="Profiling stops at this time.", null=True
+                    ),
+                ),
+            ],
+        ),
+    ]
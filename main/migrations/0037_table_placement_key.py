@@ -0,0 +1,29 @@
+# Generated by Django 5.0.3 on 2026-10-18 12:30
+
+from django.db import migrations, models
+from django.db.models.functions import Cast
+
+
+def set_placement_keys(apps, schema_editor):
+    # existing tables of owners were placed by owner's id, the ownerless ones by
+    # random keys which weren't kept, so they are left to be placed by their id
+    Table = apps.get_model("main", "Table")
+    Table.objects.filter(owner__isnull=False).update(
+        placement_key=Cast("owner_id", models.CharField())
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0036_profilingrule"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="table",
+            name="placement_key",
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.RunPython(set_placement_keys, migrations.RunPython.noop),
+    ]
@@ -1,19 +1,64 @@
+from collections import Counter, defaultdict
 from functools import partial
+import hashlib
 import os
 from os import path
 from shutil import rmtree
 import shutil
+from asgiref.sync import sync_to_async
 from django.db import models
 from django.conf import settings
 from django.urls import reverse
+from django.utils import timezone
 from django.core.exceptions import ValidationError, PermissionDenied
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import transaction
+from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
 from nanoid import generate
 from django.core.validators import URLValidator
 from django.core.exceptions import ValidationError
+from django.db.models import F, Sum
+from django.db.models.functions import Greatest
+from .etag import serialize
 from .filesize import naturalsize
+from .images import create_thumbnail
+from .metrics import count_cache_lookups
+from . import atlas as atlas_module
+
+
+def get_file_digest(field_file):
+    digest = hashlib.sha256()
+    if field_file._committed:
+        try:
+            with field_file.storage.open(field_file.name, "rb") as f:
+                for chunk in f.chunks():
+                    digest.update(chunk)
+        except FileNotFoundError:
+            return ""
+    else:
+        for chunk in field_file.file.chunks():
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def fingerprint(url, digest):
+    # content based version makes url safe to be cached forever
+    return f"{url}?v={digest[:12]}" if digest else url
+
+
+def link_file(src, dest):
+    # hard link shares content of the file instead of copying it
+    os.makedirs(path.dirname(dest), exist_ok=True)
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
+
+
+def delete_files(storage, names):
+    for name in names:
+        storage.delete(name)
 
 
 class NanoIdField(models.CharField):
@@ -26,15 +71,59 @@ class NanoIdField(models.CharField):
 
 
 class TableVisit(models.Model):
+    # last visit of the user at the table, see visits module
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     table = models.ForeignKey("Table", on_delete=models.CASCADE)
-    visited_at = models.DateTimeField(auto_now=True)
+    visited_at = models.DateTimeField(default=timezone.now)
+    visit_count = models.PositiveIntegerField(default=1)
 
     def __str__(self):
         return f"{self.user.username}'s visit"
 
+    @staticmethod
+    def add_visits(visits):
+        # Upserts (user id, table id) -> (count, last visit time) mapping, so
+        # counters are incremented safely by concurrent writers.
+        # Tables and users may have been deleted since their visits were buffered.
+        users = get_user_model().objects.filter(pk__in={u for u, _ in visits})
+        tables = Table.objects.filter(pk__in={t for _, t in visits})
+        existing_users = set(users.values_list("pk", flat=True))
+        existing_tables = set(tables.values_list("pk", flat=True))
+        visits = {
+            (user_id, table_id): visit
+            for (user_id, table_id), visit in visits.items()
+            if user_id in existing_users and table_id in existing_tables
+        }
+        with transaction.atomic():
+            TableVisit.objects.bulk_create(
+                [
+                    TableVisit(user_id=user_id, table_id=table_id, visit_count=0)
+                    for user_id, table_id in visits
+                ],
+                ignore_conflicts=True,
+            )
+            rows = TableVisit.objects.filter(
+                user_id__in={user_id for user_id, _ in visits},
+                table_id__in={table_id for _, table_id in visits},
+            ).only("pk", "user_id", "table_id")
+            updated = []
+            for row in rows:
+                if (row.user_id, row.table_id) in visits:
+                    count, visited_at = visits[(row.user_id, row.table_id)]
+                    row.visit_count = F("visit_count") + count
+                    row.visited_at = Greatest(F("visited_at"), visited_at)
+                    updated.append(row)
+            TableVisit.objects.bulk_update(
+                updated, ["visit_count", "visited_at"], batch_size=500
+            )
+
     class Meta:
         ordering = ["-visited_at"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "table"], name="unique_user_table_visit"
+            )
+        ]
 
 
 class Table(models.Model):
@@ -44,6 +133,11 @@ class Table(models.Model):
         settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True
     )
     board = models.ForeignKey("Board", on_delete=models.SET_NULL, null=True)
+    # name of table sync server hosting the table, see shards module
+    shard = models.CharField(max_length=50, default="default")
+    # key hashed to place the table (owner's id or random key of ownerless tables),
+    # kept so rebalancing places table the same way after owner changes
+    placement_key = models.CharField(max_length=50, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     visits = models.ManyToManyField(
@@ -71,19 +165,26 @@ class Table(models.Model):
         self.save()
 
     def get_chairs_with_existing_invitations(self):
-        return self.chair_set.filter(namedinvitation__isnull=False).distinct()
+        return (
+            self.chair_set.filter(namedinvitation__isnull=False)
+            .distinct()
+            .prefetch_related("namedinvitation_set__user")
+        )
 
     def get_chairs_with_link_invitation(self):
         return self.chair_set.filter(link_invitation__isnull=False)
 
-    def register_visit(self, user):
-        if user.is_authenticated:
-            TableVisit.objects.create(user=user, table=self)
-
     class Meta:
         ordering = ["created_at"]
 
 
+class ProvisionedTable(models.Model):
+    # table created by table sync server in advance, see table_pool module
+    id = models.CharField(primary_key=True, max_length=12, editable=False)
+    shard = models.CharField(max_length=50, default="default")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
 class ChairManager(models.Manager):
     def create(self, enable_link_invitation=False, **kwargs):
         chair = super().create(**kwargs)
@@ -185,7 +286,12 @@ class Army(models.Model):
         if transaction.get_connection().in_atomic_block:
             raise RuntimeError("Army.delete cannot be run inside a transaction block.")
         army_media_path = f"{settings.MEDIA_ROOT}/armies/{self.id}"
-        res = super().delete(using, keep_parents)
+        with transaction.atomic():
+            freed = self.resource_set.aggregate(total=Sum("size"))["total"] or 0
+            blobs = list(self.resource_set.values_list("blob", flat=True))
+            res = super().delete(using, keep_parents)
+            UserDiskQuota.charge(self.owner_id, -freed)
+            Blob.release(blobs)
         rmtree(army_media_path, ignore_errors=True)
         return res
 
@@ -205,22 +311,28 @@ class Army(models.Model):
             private=self.private,
             readonly=self.readonly,
         )
-        shutil.copytree(
-            f"{settings.MEDIA_ROOT}/armies/{self.id}",
-            f"{settings.MEDIA_ROOT}/armies/{new_army.id}",
-        )
         resource_mapping = {}
         resources = self.resource_set.all()
-        resource_mapping = {}
         new_resources = [
             Resource(
                 name=res.name,
                 army=new_army,
                 file=f"armies/{new_army.id}/{os.path.basename(res.file.name)}",
+                size=res.size,
+                digest=res.digest,
             )
             for res in resources
         ]
-        new_resources = Resource.objects.bulk_create(new_resources)
+        # resources share content with the source army, nothing is copied
+        for res, new_res in zip(resources, new_resources):
+            if res.is_valid():
+                link_file(res.file.path, new_res.file.path)
+        with transaction.atomic():
+            Blob.acquire(new_resources)
+            new_resources = Resource.objects.bulk_create(new_resources)
+            UserDiskQuota.charge(
+                new_army.owner_id, sum(res.size for res in new_resources)
+            )
         for res, new_res in zip(resources, new_resources):
             resource_mapping[res.id] = new_res
         Token.objects.bulk_create(
@@ -238,32 +350,91 @@ class Army(models.Model):
                 for token in self.token_set.all()
             ]
         )
+        # bulk_create doesn't emit signals which keep army info up to date
+        ArmyInfo.invalidate(new_army.id)
+        AtlasPage.schedule_update(new_army.id)
         return new_army
 
     def has_write_permission(self, user):
         return self.owner == user or user.is_staff
 
     def get_info(self):
-        tokens = self.token_set.select_related("front_image", "back_image").all()
+        tokens = list(self.token_set.select_related("front_image", "back_image"))
         hqs, units, markers = [
             [token for token in tokens if token.kind == kind]
             for kind in ["h", "u", "m"]
         ]
+        get_data = partial(Token.get_data, atlas=AtlasPage.get_placements(self, tokens))
         return {
             "name": self.name,
-            "tokens": list(map(Token.get_data, units)),
-            "bases": list(map(Token.get_data, hqs)),
-            "markers": list(map(Token.get_data, markers)),
+            "tokens": list(map(get_data, units)),
+            "bases": list(map(get_data, hqs)),
+            "markers": list(map(get_data, markers)),
         }
 
     def get_resource_choices(self):
-        return [(res.id, res) for res in self.resource_set.all()]
+        return [(res.id, res) for res in self.resource_set.select_related("blob")]
 
     class Meta:
         verbose_name_plural = "armies"
         ordering = ["my_order"]
 
 
+class ArmyInfo(models.Model):
+    # Serialized Army.get_info() output served by army_info view. Content is cleared
+    # whenever the army, its tokens or resources change and lazily rebuilt. Revision
+    # guards against storing content built from data read before invalidation.
+    army = models.OneToOneField(Army, on_delete=models.CASCADE, primary_key=True)
+    content = models.BinaryField(null=True)
+    etag = models.CharField(max_length=34, blank=True)
+    revision = models.PositiveIntegerField(default=0)
+
+    @staticmethod
+    def invalidate(army_id):
+        ArmyInfo.objects.filter(army_id=army_id).update(
+            content=None, revision=F("revision") + 1
+        )
+
+    @staticmethod
+    def get_content(army_id):
+        row = (
+            ArmyInfo.objects.filter(army_id=army_id)
+            .values_list("content", "etag", "revision")
+            .first()
+        )
+        if row is not None and row[0] is not None:
+            count_cache_lookups("army_info", 1, 0)
+            return bytes(row[0]), row[1]
+        count_cache_lookups("army_info", 0, 1)
+        try:
+            army = Army.objects.get(pk=army_id)
+        except Army.DoesNotExist:
+            return None
+        if row is None:
+            info, _ = ArmyInfo.objects.get_or_create(army=army)
+            revision = info.revision
+        else:
+            revision = row[2]
+        content, etag = serialize(army.get_info())
+        ArmyInfo.objects.filter(army_id=army_id, revision=revision).update(
+            content=content, etag=etag
+        )
+        return content, etag
+
+    @staticmethod
+    async def aget_content(army_id):
+        # only the common case of already built content is served without a thread
+        row = await (
+            ArmyInfo.objects.filter(army_id=army_id)
+            .values_list("content", "etag")
+            .afirst()
+        )
+        if row is not None and row[0] is not None:
+            count_cache_lookups("army_info", 1, 0)
+            return bytes(row[0]), row[1]
+        return await sync_to_async(ArmyInfo.get_content)(army_id)
+
+
 class PublicationRequest(models.Model):
     id = NanoIdField(primary_key=True, max_length=12)
     source_army = models.ForeignKey(Army, on_delete=models.CASCADE)
@@ -286,29 +457,174 @@ def army_directory_path(instance, filename):
     return f"armies/{instance.army.id}/{filename}"
 
 
+def blob_path(digest, file_name):
+    return f"blobs/{digest[:2]}/{digest}{path.splitext(file_name)[1]}"
+
+
+class Blob(models.Model):
+    # Content addressed file shared by all resources with the same digest. Army
+    # media directories contain hard links to blob files, so resource urls don't
+    # change. Blob is removed together with its last referencing resource.
+    digest = models.CharField(max_length=64, primary_key=True)
+    file = models.FileField(max_length=255)
+    size = models.PositiveBigIntegerField(default=0)
+    refcount = models.PositiveIntegerField(default=0)
+    thumbnail = models.FileField(max_length=255, blank=True)
+
+    def __str__(self):
+        return self.digest
+
+    def get_thumbnail_name(self):
+        return f"blobs/{self.digest[:2]}/{self.digest}.thumb.webp"
+
+    def make_thumbnail(self):
+        name = self.get_thumbnail_name()
+        storage = self.thumbnail.storage
+        if create_thumbnail(
+            self.file.path, storage.path(name), settings.RESOURCE_THUMBNAIL_SIZE
+        ):
+            self.thumbnail = name
+
+    @staticmethod
+    def add_references(counts):
+        # one query per distinct count, so usually a single one
+        digests_by_count = defaultdict(list)
+        for digest, count in counts.items():
+            digests_by_count[count].append(digest)
+        for count, digests in digests_by_count.items():
+            Blob.objects.filter(pk__in=digests).update(
+                refcount=Greatest(F("refcount") + count, 0)
+            )
+
+    @staticmethod
+    def acquire(resources):
+        # Sets blobs of stored, but not yet saved resources creating missing ones.
+        resources = [res for res in resources if res.digest]
+        counts = Counter(res.digest for res in resources)
+        existing = set(Blob.objects.filter(pk__in=counts).values_list("pk", flat=True))
+        new_blobs = {}
+        for res in resources:
+            if res.digest not in existing and res.digest not in new_blobs:
+                name = blob_path(res.digest, res.file.name)
+                dest = res.file.storage.path(name)
+                try:
+                    if not path.exists(dest):
+                        link_file(res.file.path, dest)
+                except FileNotFoundError:
+                    counts.pop(res.digest)
+                    continue
+                blob = Blob(digest=res.digest, file=name, size=res.size)
+                blob.make_thumbnail()
+                new_blobs[res.digest] = blob
+            if res.digest in counts:
+                res.blob_id = res.digest
+        Blob.objects.bulk_create(new_blobs.values(), ignore_conflicts=True)
+        Blob.add_references(counts)
+
+    @staticmethod
+    def release(digests):
+        counts = Counter(digest for digest in digests if digest)
+        if not counts:
+            return
+        Blob.add_references({digest: -count for digest, count in counts.items()})
+        unused = Blob.objects.filter(pk__in=counts, refcount=0)
+        names = [
+            name
+            for names in unused.values_list("file", "thumbnail")
+            for name in names
+            if name
+        ]
+        unused.delete()
+        storage = Blob._meta.get_field("file").storage
+        transaction.on_commit(partial(delete_files, storage, names))
+
+
+class ResourceQuerySet(models.QuerySet):
+    def delete(self):
+        with transaction.atomic():
+            freed = self.values("army__owner").annotate(total=Sum("size"))
+            for row in freed:
+                UserDiskQuota.charge(row["army__owner"], -row["total"])
+            files = list(self.values_list("file", "blob"))
+            res = super().delete()
+            Blob.release(blob for _, blob in files)
+            storage = Resource._meta.get_field("file").storage
+            transaction.on_commit(
+                partial(delete_files, storage, [name for name, _ in files])
+            )
+        return res
+
+
 class Resource(models.Model):
     id = NanoIdField(primary_key=True, max_length=12)
     name = models.CharField(max_length=100)
     army = models.ForeignKey(Army, on_delete=models.CASCADE)
     file = models.FileField(upload_to=army_directory_path)
+    # size of the stored file in bytes, charged to army owner's disk quota
+    size = models.PositiveBigIntegerField(default=0, editable=False)
+    digest = models.CharField(max_length=64, blank=True, editable=False)
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, null=True, editable=False)
+
+    objects = ResourceQuerySet.as_manager()
 
     def close_url(self):
         return reverse("main:del_res", args=(self.id,))
 
+    def save(self, *args, **kwargs):
+        if self.file and (not self.file._committed or not self.digest):
+            self.digest = get_file_digest(self.file)
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+        if self.file and not self.size:
+            self.size = self.file.size
+        if self.file and not self.file._committed:
+            # file has to be stored before it can be linked into the blob store
+            self.store_file()
+        with transaction.atomic():
+            Blob.acquire([self])
+            super().save(*args, **kwargs)
+            UserDiskQuota.charge_army(self.army_id, self.size)
+
+    def store_file(self):
+        # content already present in the blob store is linked instead of written
+        blob = Blob.objects.filter(pk=self.digest).first() if self.digest else None
+        if blob is None or not blob.file.storage.exists(blob.file.name):
+            self.file.save(self.file.name, self.file.file, save=False)
+            return
+        storage = self.file.storage
+        name = storage.get_available_name(
+            self.file.field.generate_filename(self, self.file.name)
+        )
+        link_file(blob.file.path, storage.path(name))
+        self.file.name = name
+        self.file._committed = True
+
     def delete(self, using=None, keep_parents=False):
         if transaction.get_connection().in_atomic_block:
             raise RuntimeError(
                 "Resource.delete cannot be run inside a transaction block."
             )
         self.file.delete(save=False)
-        return super().delete(using, keep_parents)
+        with transaction.atomic():
+            res = super().delete(using, keep_parents)
+            UserDiskQuota.charge_army(self.army_id, -self.size)
+            Blob.release([self.blob_id])
+        return res
 
     def __str__(self):
         return self.name
 
+    def get_file_name(self):
+        return fingerprint(path.basename(self.file.name), self.digest)
+
     def get_size(self):
         return self.file.size if self.is_valid() else 0
 
+    def get_thumbnail_url(self):
+        if self.blob_id and self.blob.thumbnail:
+            return self.blob.thumbnail.url
+        return self.file.url
+
     def is_valid(self):
         return self.file and os.path.exists(self.file.path)
 
@@ -362,12 +678,12 @@ class Token(models.Model):
     def has_write_permission(self, user):
         return self.army.owner == user or user.is_staff
 
-    def get_data(self):
+    def get_data(self, atlas=None):
         res = {
             "name": self.name,
             "q": self.multiplicity,
-            "img": path.basename(self.front_image.file.path),
-            "backImg": path.basename(self.back_image.file.path),
+            "img": self.front_image.get_file_name(),
+            "backImg": self.back_image.get_file_name(),
             "id": self.id,
         }
         if self.additional_info:
@@ -376,26 +692,200 @@ class Token(models.Model):
             res["imgRect"] = self.front_image_rect
         if self.back_image_rect:
             res["backImgRect"] = self.back_image_rect
+        for img_key, rect_key, image, rect in [
+            ("img", "imgRect", self.front_image, self.front_image_rect),
+            ("backImg", "backImgRect", self.back_image, self.back_image_rect),
+        ]:
+            placement = (atlas or {}).get(
+                atlas_module.get_entry_key(image.digest, rect)
+            )
+            if placement is not None:
+                res[img_key], res[rect_key] = placement
         return res
 
 
+class AtlasPage(models.Model):
+    # Image packing token images of an army, so a table loads few files instead of
+    # hundreds. Pages are derived data, so they aren't charged to disk quota.
+    army = models.ForeignKey(Army, on_delete=models.CASCADE)
+    file = models.FileField(max_length=255)
+    digest = models.CharField(max_length=64)
+    area = models.PositiveBigIntegerField(default=0)
+    # entry key (see atlas.get_entry_key) -> placement rect in the page
+    entries = models.JSONField(default=dict)
+
+    def get_file_name(self):
+        return fingerprint(path.basename(self.file.name), self.digest)
+
+    @staticmethod
+    def build(army, sources):
+        pages = []
+        sizes = {key: box[2:] for key, (_, box) in sources.items()}
+        storage = AtlasPage._meta.get_field("file").storage
+        for positions in atlas_module.pack(sizes, settings.ARMY_ATLAS_PAGE_SIZE):
+            content, digest = atlas_module.render_page(sources, positions)
+            name = f"armies/{army.id}/atlas-{digest[:16]}.webp"
+            if not storage.exists(name):
+                os.makedirs(path.dirname(storage.path(name)), exist_ok=True)
+                with open(storage.path(name), "wb") as f:
+                    f.write(content)
+            entries = {
+                key: {"x": x, "y": y, "w": sizes[key][0], "h": sizes[key][1]}
+                for key, (x, y) in positions.items()
+            }
+            area = sum(rect["w"] * rect["h"] for rect in entries.values())
+            pages.append(
+                AtlasPage(
+                    army=army, file=name, digest=digest, area=area, entries=entries
+                )
+            )
+        return pages
+
+    @staticmethod
+    def get_images(tokens):
+        # entry key -> (resource, rect) of every image used by given tokens
+        images = {}
+        for token in tokens:
+            for image, rect in [
+                (token.front_image, token.front_image_rect),
+                (token.back_image, token.back_image_rect),
+            ]:
+                if image.digest:
+                    images[atlas_module.get_entry_key(image.digest, rect)] = (
+                        image,
+                        rect,
+                    )
+        return images
+
+    @staticmethod
+    def get_placements(army, tokens):
+        # Placements of token images in already built pages. Images which aren't
+        # packed (yet) are left out and served as separate files.
+        if not settings.ARMY_ATLAS_PAGE_SIZE:
+            return {}
+        images = AtlasPage.get_images(tokens)
+        return {
+            key: (page.get_file_name(), rect)
+            for page in army.atlaspage_set.all()
+            for key, rect in page.entries.items()
+            if key in images
+        }
+
+    @staticmethod
+    def schedule_update(army_id):
+        # pages are updated once changes of army's tokens or resources are committed
+        transaction.on_commit(partial(AtlasPage.update, army_id), robust=True)
+
+    @staticmethod
+    def update(army_id):
+        # Incrementally updates army's pages, returns whether any page changed.
+        # Only images missing from existing pages are packed into new pages. Pages
+        # are repacked from scratch once most of their content isn't used anymore.
+        if not settings.ARMY_ATLAS_PAGE_SIZE:
+            return False
+        army = Army.objects.filter(pk=army_id).first()
+        if army is None:
+            return False
+        tokens = army.token_set.select_related("front_image", "back_image")
+        images = AtlasPage.get_images(tokens)
+        kept, stale, sources = AtlasPage.plan(army, images)
+        if not stale and not sources:
+            return False
+        # Concurrent updates (e.g. saves of several tokens) are serialized by lock
+        # on the army, so pages aren't built more than once.
+        with transaction.atomic():
+            if not Army.objects.select_for_update().filter(pk=army_id).exists():
+                return False
+            # pages and tokens might have changed while waiting for the lock
+            images = AtlasPage.get_images(tokens.all())
+            kept, stale, sources = AtlasPage.plan(army, images)
+            new = AtlasPage.build(army, sources) if sources else []
+            AtlasPage.objects.filter(pk__in=[page.pk for page in stale]).delete()
+            AtlasPage.objects.bulk_create(new)
+            # army info might have been built from previous pages meanwhile
+            ArmyInfo.invalidate(army_id)
+            used = {page.file.name for page in kept + new}
+            storage = AtlasPage._meta.get_field("file").storage
+            transaction.on_commit(
+                partial(
+                    delete_files,
+                    storage,
+                    [page.file.name for page in stale if page.file.name not in used],
+                )
+            )
+        return bool(stale or new)
+
+    @staticmethod
+    def plan(army, images):
+        # existing pages to keep and to remove and sources of images to pack
+        pages = list(army.atlaspage_set.all())
+        used_area = sum(
+            rect["w"] * rect["h"]
+            for page in pages
+            for key, rect in page.entries.items()
+            if key in images
+        )
+        if used_area * 2 < sum(page.area for page in pages):
+            stale = pages
+        else:
+            stale = [page for page in pages if not page.entries.keys() & images.keys()]
+        kept = [page for page in pages if page not in stale]
+        sources = AtlasPage.get_sources(images, kept)
+        # New images are packed together with content of small pages, so tokens
+        # added one at a time don't leave many small pages behind.
+        small = [
+            page for page in kept if page.area * 4 < settings.ARMY_ATLAS_PAGE_SIZE**2
+        ]
+        if sources and small:
+            stale += small
+            kept = [page for page in kept if page not in small]
+            sources = AtlasPage.get_sources(images, kept)
+        return kept, stale, sources
+
+    @staticmethod
+    def get_sources(images, kept):
+        # file paths and boxes of packable images missing from kept pages
+        placed = {key for page in kept for key in page.entries}
+        sources = {}
+        for key, (image, rect) in images.items():
+            if key not in placed and image.is_valid():
+                box = atlas_module.get_source_box(
+                    image.file.path, rect, settings.ARMY_ATLAS_PAGE_SIZE
+                )
+                if box is not None:
+                    sources[key] = (image.file.path, box)
+        return sources
+
+
 class UserDiskQuota(models.Model):
     id = NanoIdField(primary_key=True, max_length=12)
     user = models.OneToOneField(
         settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="disk_quota"
     )
     value = models.PositiveIntegerField(default=settings.DEFAULT_DISK_QUOTA_SIZE)
+    # bytes used by user's resources, maintained incrementally by Resource and Army
+    used = models.PositiveBigIntegerField(default=0, editable=False)
+
+    @staticmethod
+    def charge(user_id, delta):
+        if delta:
+            UserDiskQuota.objects.filter(user_id=user_id).update(
+                used=Greatest(F("used") + delta, 0)
+            )
+
+    @staticmethod
+    def charge_army(army_id, delta):
+        if delta:
+            UserDiskQuota.objects.filter(user__army=army_id).update(
+                used=Greatest(F("used") + delta, 0)
+            )
 
     def get_free_space(self):
         return max(self.value - self.used, 0)
 
-    @property
-    def used(self):
+    def compute_used(self):
         return sum(
-            res.get_size()
-            for res in Resource.objects.select_related("army").filter(
-                army__owner=self.user
-            )
+            res.get_size() for res in Resource.objects.filter(army__owner=self.user)
         )
 
     @property
@@ -410,7 +900,25 @@ class UserDiskQuota(models.Model):
         return f"{self.user.username} disk quota"
 
 
-class Board(models.Model):
+class FingerprintedImageModel(models.Model):
+    image_digest = models.CharField(max_length=64, blank=True, editable=False)
+
+    def save(self, *args, **kwargs):
+        if self.image and (not self.image._committed or not self.image_digest):
+            self.image_digest = get_file_digest(self.image)
+        super().save(*args, **kwargs)
+
+    def get_image_name(self):
+        return fingerprint(self.image.name, self.image_digest)
+
+    def get_image_url(self):
+        return fingerprint(self.image.url, self.image_digest)
+
+    class Meta:
+        abstract = True
+
+
+class Board(FingerprintedImageModel):
     id = NanoIdField(primary_key=True, max_length=12)
     name = models.CharField(max_length=100)
     image = models.FileField(upload_to="boards/")
@@ -422,7 +930,7 @@ class Board(models.Model):
 
     def get_info(self):
         res = self.info
-        res["image"] = self.image.url
+        res["image"] = self.get_image_url()
         return res
 
 
@@ -469,7 +977,7 @@ class FooterLink(BaseLink):
         super().clean()
 
 
-class Emote(models.Model):
+class Emote(FingerprintedImageModel):
     id = NanoIdField(primary_key=True, max_length=12)
     name = models.CharField(max_length=100)
     image = models.FileField(upload_to="emojis/")
@@ -483,12 +991,32 @@ class Emote(models.Model):
         return {
             "id": self.id,
             "name": self.name,
-            "image": [self.image.name] + [img.image.name for img in alternative_imgs],
+            "image": [self.get_image_name()]
+            + [img.get_image_name() for img in alternative_imgs],
             "keyshortcut": self.keyshortcut,
         }
 
 
-class EmoteAlternativeImage(models.Model):
+class EmoteAlternativeImage(FingerprintedImageModel):
     id = NanoIdField(primary_key=True, max_length=12)
     emote = models.ForeignKey(Emote, on_delete=models.CASCADE)
     image = models.FileField(upload_to="emojis/")
+
+
+class ProfilingRule(models.Model):
+    # Requests to the URL are profiled with given probability (see main/profiling.py).
+    url_name = models.CharField(
+        max_length=200,
+        unique=True,
+        help_text="URL name as labeled in /metrics, e.g. main:server_info.",
+    )
+    sample_rate = models.FloatField(
+        default=0.01, validators=[MinValueValidator(0), MaxValueValidator(1)]
+    )
+    enabled = models.BooleanField(default=True)
+    expires_at = models.DateTimeField(
+        null=True, blank=True, help_text="Profiling stops at this time."
+    )
+
+    def __str__(self):
+        return self.url_name
@@ -0,0 +1,265 @@
+import cProfile
+import json
+import logging
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import transaction
+from django.urls import Resolver404, resolve
+from django.utils import timezone
+from nanoid import generate
+from .models import ProfilingRule
+from . import querycount
+
+# Requests to URL names of enabled profiling rules (managed in admin) are profiled
+# with the rule's probability, requests with valid signed X-Profile header (see
+# get_header_value) are profiled always. Rules are cached without expiration whenever
+# they change, so requests load them from database only after cache was cleared or
+# evicted them. Every capture is saved to PROFILING_DIR as pstats file
+# (for snakeviz, gprof2dot or flameprof), collapsed stacks sampled every
+# PROFILING_SAMPLE_INTERVAL seconds (for flamegraph.pl or speedscope) and JSON summary
+# with breakdown of database queries. Only PROFILING_MAX_CAPTURES most recent
+# captures are kept.
+logger = logging.getLogger(__name__)
+RULES_KEY = "profiling:rules"
+HEADER = "HTTP_X_PROFILE"
+SIGNING_SALT = "main.profiling"
+FILE_SUFFIXES = (".json", ".prof", ".folded")
+
+
+def get_enabled_rules():
+    return ProfilingRule.objects.filter(enabled=True).values_list(
+        "url_name", "sample_rate", "expires_at"
+    )
+
+
+def load_rules():
+    # {url name: (sample rate, expiration)} of enabled rules
+    rules = {name: rule for name, *rule in get_enabled_rules()}
+    cache.set(RULES_KEY, rules, None)
+    return rules
+
+
+async def aload_rules():
+    rules = {name: rule async for name, *rule in get_enabled_rules()}
+    await cache.aset(RULES_KEY, rules, None)
+    return rules
+
+
+def update_rules():
+    # Once now and once again after commit, so rules read before the commit don't
+    # survive it.
+    load_rules()
+    transaction.on_commit(load_rules)
+
+
+def get_rules():
+    # no rules are cached as {}, None means cache lost them
+    rules = cache.get(RULES_KEY)
+    return load_rules() if rules is None else rules
+
+
+async def aget_rules():
+    rules = await cache.aget(RULES_KEY)
+    return await aload_rules() if rules is None else rules
+
+
+def get_header_value():
+    return signing.TimestampSigner(salt=SIGNING_SALT).sign(generate(size=8))
+
+
+def has_valid_header(request):
+    if HEADER not in request.META:
+        return False
+    try:
+        signing.TimestampSigner(salt=SIGNING_SALT).unsign(
+            request.META[HEADER], max_age=settings.PROFILING_HEADER_MAX_AGE
+        )
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def get_view_name(request):
+    try:
+        return resolve(request.path_info, getattr(request, "urlconf", None)).view_name
+    except Resolver404:
+        return None
+
+
+def get_trigger(request, rules):
+    if has_valid_header(request):
+        return "header"
+    if not rules:
+        return None
+    rule = rules.get(get_view_name(request))
+    if rule is None:
+        return None
+    sample_rate, expires_at = rule
+    if expires_at is not None and expires_at <= timezone.now():
+        return None
+    return "sample" if random.random() < sample_rate else None
+
+
+class StackSampler(threading.Thread):
+    # Samples stacks of the thread handling request up to the given frame (profile
+    # records only direct callers of functions, not whole stacks). Counts of samples
+    # are saved as collapsed stacks.
+    def __init__(self, base_frame, interval):
+        super().__init__(daemon=True)
+        self.thread_id = threading.get_ident()
+        self.base_frame = base_frame
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.stacks = Counter()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and frame is not self.base_frame:
+                code = frame.f_code
+                # semicolons separate frames of collapsed stacks
+                label = f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+                stack.append(label.replace(";", ","))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def get_folded_stacks(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.items())
+
+
+def get_query_breakdown(log):
+    shapes = {}
+    for sql, elapsed in log.queries:
+        shape = shapes.setdefault(querycount.get_shape(sql), {"count": 0, "time": 0.0})
+        shape["count"] += 1
+        shape["time"] += elapsed
+    breakdown = [{"sql": sql} | shape for sql, shape in shapes.items()]
+    return sorted(breakdown, key=lambda shape: shape["time"], reverse=True)
+
+
+class Capture:
+    # Profile, sampled stacks and database queries of code run in the with block.
+    def __enter__(self):
+        self.profiler = cProfile.Profile()
+        # stacks are sampled from the frame entering the block
+        self.sampler = StackSampler(
+            sys._getframe(1), settings.PROFILING_SAMPLE_INTERVAL
+        )
+        self.recording = querycount.record_queries()
+        self.log = self.recording.__enter__()
+        self.sampler.start()
+        self.start = time.perf_counter()
+        self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.disable()
+        self.elapsed = time.perf_counter() - self.start
+        self.sampler.stop()
+        self.recording.__exit__(*exc_info)
+
+
+def save(request, response, view, trigger, capture):
+    directory = Path(settings.PROFILING_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    # names sort in order of capturing
+    capture_id = f"{time.time_ns() // 1_000_000}-{generate(size=8)}"
+    capture.profiler.dump_stats(directory / f"{capture_id}.prof")
+    (directory / f"{capture_id}.folded").write_text(capture.sampler.get_folded_stacks())
+    summary = {
+        "id": capture_id,
+        "captured_at": timezone.now().isoformat(),
+        "method": request.method,
+        "path": request.get_full_path(),
+        "view": view,
+        "status": response.status_code,
+        "trigger": trigger,
+        "duration": capture.elapsed,
+        "queries": len(capture.log),
+        "query_time": capture.log.time,
+        "query_breakdown": get_query_breakdown(capture.log),
+    }
+    (directory / f"{capture_id}.json").write_text(json.dumps(summary))
+    rotate(directory)
+
+
+def rotate(directory):
+    captures = sorted(path.stem for path in directory.glob("*.json"))
+    for capture_id in captures[: -settings.PROFILING_MAX_CAPTURES or None]:
+        for suffix in FILE_SUFFIXES:
+            (directory / f"{capture_id}{suffix}").unlink(missing_ok=True)
+
+
+def get_captures():
+    # summaries of saved captures, slowest first
+    captures = []
+    for path in Path(settings.PROFILING_DIR).glob("*.json"):
+        try:
+            captures.append(json.loads(path.read_text()))
+        except (OSError, ValueError):
+            # removed by rotation or still being written
+            continue
+    return sorted(captures, key=lambda capture: capture["duration"], reverse=True)
+
+
+def get_capture_file(name):
+    # path of saved capture file with given name or None
+    path = Path(settings.PROFILING_DIR) / name
+    if path.name != name or path.suffix not in FILE_SUFFIXES or not path.is_file():
+        return None
+    return path
+
+
+class ProfilingMiddleware:
+    # Profiles requests chosen by get_trigger. Only the thread handling the request
+    # is profiled, under ASGI that's the event loop, so profiles of async views also
+    # include other coroutines running meanwhile and miss code run in worker threads.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if (trigger := get_trigger(request, get_rules())) is None:
+            return self.get_response(request)
+        with Capture() as capture:
+            response = self.get_response(request)
+        self.save(request, response, trigger, capture)
+        return response
+
+    async def __acall__(self, request):
+        if (trigger := get_trigger(request, await aget_rules())) is None:
+            return await self.get_response(request)
+        with Capture() as capture:
+            response = await self.get_response(request)
+        self.save(request, response, trigger, capture)
+        return response
+
+    def save(self, request, response, trigger, capture):
+        # profiling must never break the request
+        try:
+            save(request, response, get_view_name(request), trigger, capture)
+        except Exception as e:
+            logger.warning("Unable to save profile of %s: %s", request.path, e)
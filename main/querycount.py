@@ -0,0 +1,121 @@
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+# Queries are recorded by execute wrapper installed on every database connection into
+# log of the current context, so queries made by async views in other threads are
+# counted too. Queries which differ only in parameters share the same shape, many
+# queries of the same shape in one request usually mean N+1 problem (related objects
+# loaded one by one instead of with select_related or prefetch_related).
+logger = logging.getLogger(__name__)
+
+# logs of all (possibly nested) recordings active in the current context
+current_logs = ContextVar("current_query_logs", default=())
+
+
+def get_shape(sql):
+    # parameters are passed separately, only lists of them differ in length
+    sql = re.sub(r"IN \((?:%s, )*%s\)", "IN (...)", sql)
+    return re.sub(r"'(?:[^']|'')*'|\b\d+\b", "?", sql)
+
+
+class QueryLog:
+    def __init__(self):
+        self.queries = []
+
+    def __len__(self):
+        return len(self.queries)
+
+    @property
+    def time(self):
+        return sum(duration for _, duration in self.queries)
+
+    def get_repeated(self, threshold):
+        shapes = Counter(get_shape(sql) for sql, _ in self.queries)
+        return {shape: count for shape, count in shapes.items() if count >= threshold}
+
+    def __str__(self):
+        return "\n".join(f"{i}. {sql}" for i, (sql, _) in enumerate(self.queries, 1))
+
+
+def record(execute, sql, params, many, context):
+    logs = current_logs.get()
+    if not logs:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+        for log in logs:
+            log.queries.append((sql, elapsed))
+
+
+def install(connection):
+    if record not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record)
+
+
+@receiver(connection_created)
+def install_on_connect(sender, connection, **kwargs):
+    install(connection)
+
+
+@contextmanager
+def record_queries():
+    # connections of the current thread may have been opened before import
+    for connection in connections.all(initialized_only=True):
+        install(connection)
+    log = QueryLog()
+    token = current_logs.set(current_logs.get() + (log,))
+    try:
+        yield log
+    finally:
+        current_logs.reset(token)
+
+
+class QueryCountMiddleware:
+    # Adds number of queries made to handle request as X-Query-Count header and warns
+    # about query shapes repeated at least QUERY_REPEAT_THRESHOLD times.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.QUERY_INSTRUMENTATION:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with record_queries() as log:
+            response = self.get_response(request)
+        return self.process(request, response, log)
+
+    async def __acall__(self, request):
+        with record_queries() as log:
+            response = await self.get_response(request)
+        return self.process(request, response, log)
+
+    def process(self, request, response, log):
+        response["X-Query-Count"] = len(log)
+        for shape, count in log.get_repeated(settings.QUERY_REPEAT_THRESHOLD).items():
+            logger.warning(
+                "Possible N+1 problem in %s %s, query repeated %d times: %s",
+                request.method,
+                request.path,
+                count,
+                shape,
+            )
+        return response
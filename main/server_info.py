@@ -0,0 +1,133 @@
+import heapq
+from functools import partial
+from operator import itemgetter
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from nanoid import generate
+from .etag import serialize
+from .metrics import count_cache_lookups
+from .models import Army, Board, Emote, Link
+from .shards import get_shard
+
+VERSION_KEY = "server_info:version"
+ARMY_FIELDS = ("id", "name", "custom", "private", "utility", "keyshortcut")
+
+
+def bump_version():
+    cache.set(VERSION_KEY, generate(size=12), None)
+
+
+def invalidate():
+    # Bump immediately so this process stops serving stale data and once again
+    # after commit so other processes can't cache data read before the commit.
+    bump_version()
+    transaction.on_commit(bump_version)
+
+
+def get_version():
+    return cache.get_or_set(VERSION_KEY, partial(generate, size=12), None)
+
+
+async def aget_version():
+    return await cache.aget_or_set(VERSION_KEY, partial(generate, size=12), None)
+
+
+def build_public_info():
+    armies = list(Army.objects.filter(private=False).values(*ARMY_FIELDS, "my_order"))
+    emotes = [
+        el.get_info()
+        for el in Emote.objects.prefetch_related("emotealternativeimage_set").all()
+    ]
+    return {
+        "serverName": "local",
+        "serverVersion": "1.0.0",
+        "res": {
+            "armies": armies,
+            "emotes": emotes,
+            "utilities": [],
+            "links": list(Link.objects.values("name", "url")),
+            "boards": list(Board.objects.values("id", "name")),
+        },
+        "tss_url": get_shard(None)["url"],
+        "tss_ws_url": get_shard(None)["ws_url"],
+    }
+
+
+def merge_armies(info, private_armies):
+    # armies are kept sorted by my_order which is used only for merging
+    armies = heapq.merge(
+        info["res"]["armies"], private_armies, key=itemgetter("my_order")
+    )
+    armies = [{key: army[key] for key in ARMY_FIELDS} for army in armies]
+    return info | {"res": info["res"] | {"armies": armies}}
+
+
+def build_public_entry(key):
+    info = build_public_info()
+    content, etag = serialize(merge_armies(info, []))
+    entry = {"info": info, "content": content, "etag": etag}
+    cache.set(key, entry, settings.SERVER_INFO_CACHE_TIMEOUT)
+    return entry
+
+
+def get_public_entry():
+    key = f"server_info:{get_version()}"
+    entry = cache.get(key)
+    count_cache_lookups("server_info", entry is not None, entry is None)
+    return entry or build_public_entry(key)
+
+
+async def aget_public_entry():
+    key = f"server_info:{await aget_version()}"
+    entry = await cache.aget(key)
+    count_cache_lookups("server_info", entry is not None, entry is None)
+    return entry or await sync_to_async(build_public_entry)(key)
+
+
+def get_private_armies_queryset(user):
+    if user is None or not user.is_authenticated:
+        return Army.objects.none()
+    return Army.objects.filter(owner=user, private=True).values(
+        *ARMY_FIELDS, "my_order"
+    )
+
+
+def get_private_armies(user):
+    return list(get_private_armies_queryset(user))
+
+
+async def aget_private_armies(user):
+    return [army async for army in get_private_armies_queryset(user)]
+
+
+def with_shard(info, shard):
+    # public info points to the first shard
+    urls = {
+        "tss_url": get_shard(shard)["url"],
+        "tss_ws_url": get_shard(shard)["ws_url"],
+    }
+    if all(info[key] == value for key, value in urls.items()):
+        return info
+    return info | urls
+
+
+def get_server_info(user, shard=None):
+    info = merge_armies(get_public_entry()["info"], get_private_armies(user))
+    return with_shard(info, shard)
+
+
+def get_content(entry, private_armies, shard):
+    if not private_armies and with_shard(entry["info"], shard) is entry["info"]:
+        return entry["content"], entry["etag"]
+    return serialize(with_shard(merge_armies(entry["info"], private_armies), shard))
+
+
+def get_server_info_content(user, shard=None):
+    return get_content(get_public_entry(), get_private_armies(user), shard)
+
+
+async def aget_server_info_content(user, shard=None):
+    entry = await aget_public_entry()
+    return get_content(entry, await aget_private_armies(user), shard)
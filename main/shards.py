@@ -0,0 +1,82 @@
+import bisect
+import hashlib
+from collections import Counter
+from functools import lru_cache
+from django.conf import settings
+from django.db.models import Count
+from .models import Table
+
+# Tables are spread over table sync servers (shards) configured in TSS_SHARDS. Each
+# table is placed on one of them when created and its name is stored in Table.shard.
+# Placement either hashes table's placement key (its owner, see Table.placement_key)
+# on a consistent hashing ring (so adding shard moves only its share of placements)
+# or picks shard with the fewest tables relative to its weight.
+DEFAULT_SHARD = "default"
+VIRTUAL_NODES = 64
+
+
+def get_shards():
+    if settings.TSS_SHARDS:
+        return settings.TSS_SHARDS
+    return {
+        DEFAULT_SHARD: {
+            "internal_url": settings.INTERNAL_TSS_URL,
+            "url": settings.TSS_URL,
+            "ws_url": settings.TSS_WS_URL,
+        }
+    }
+
+
+def get_shard(name):
+    shards = get_shards()
+    # tables of shard which was removed from configuration fall back to the first one
+    return shards.get(name) or next(iter(shards.values()))
+
+
+def get_weight(shard):
+    return shard.get("weight", 1)
+
+
+def hash_value(key):
+    return int.from_bytes(hashlib.sha256(key.encode()).digest()[:8], "big")
+
+
+@lru_cache
+def build_ring(weights):
+    ring = sorted(
+        (hash_value(f"{name}#{i}"), name)
+        for name, weight in weights
+        for i in range(max(1, round(weight * VIRTUAL_NODES)))
+    )
+    return [point for point, _ in ring], [name for _, name in ring]
+
+
+def place_by_hash(key, shards=None):
+    shards = get_shards() if shards is None else shards
+    weights = tuple(sorted((name, get_weight(shard)) for name, shard in shards.items()))
+    points, names = build_ring(weights)
+    return names[bisect.bisect(points, hash_value(key)) % len(points)]
+
+
+def place_least_loaded(shards=None, pending=None):
+    # pending maps shards to numbers of tables placed there but not saved yet
+    shards = get_shards() if shards is None else shards
+    counts = Counter(
+        dict(
+            Table.objects.filter(shard__in=shards)
+            .values_list("shard")
+            .annotate(Count("id"))
+            .order_by()
+        )
+    )
+    counts.update(pending or {})
+    return min(shards, key=lambda name: counts[name] / get_weight(shards[name]))
+
+
+def place(key, shards=None, pending=None):
+    shards = get_shards() if shards is None else shards
+    if len(shards) == 1:
+        return next(iter(shards))
+    if settings.TSS_PLACEMENT == "least_loaded":
+        return place_least_loaded(shards, pending)
+    return place_by_hash(key, shards)
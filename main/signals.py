@@ -1,6 +1,22 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
-from .models import UserDiskQuota
+from .models import (
+    Army,
+    ArmyInfo,
+    AtlasPage,
+    Board,
+    Chair,
+    Emote,
+    EmoteAlternativeImage,
+    Link,
+    NamedInvitation,
+    ProfilingRule,
+    Resource,
+    Table,
+    Token,
+    UserDiskQuota,
+)
+from . import authorization, profiling, server_info
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
@@ -10,3 +26,62 @@ User = get_user_model()
 def create_user_disk_quota(sender, instance, created, **kwargs):
     if created:
         UserDiskQuota.objects.create(user=instance)
+
+
+@receiver([post_save, post_delete], sender=Army)
+@receiver([post_save, post_delete], sender=Emote)
+@receiver([post_save, post_delete], sender=EmoteAlternativeImage)
+@receiver([post_save, post_delete], sender=Link)
+@receiver([post_save, post_delete], sender=Board)
+def invalidate_server_info(sender, **kwargs):
+    server_info.invalidate()
+
+
+@receiver(post_save, sender=Army)
+def update_army_info(sender, instance, created, **kwargs):
+    if created:
+        ArmyInfo.objects.create(army=instance)
+    else:
+        ArmyInfo.invalidate(instance.id)
+
+
+@receiver([post_save, post_delete], sender=Token)
+@receiver([post_save, post_delete], sender=Resource)
+def invalidate_army_info(sender, instance, origin=None, **kwargs):
+    # army info is removed together with the army
+    if isinstance(origin, Army):
+        return
+    ArmyInfo.invalidate(instance.army_id)
+
+
+@receiver([post_save, post_delete], sender=Token)
+@receiver([post_save, post_delete], sender=Resource)
+def update_atlas_pages(sender, instance, origin=None, **kwargs):
+    # pages are removed together with the army
+    if isinstance(origin, Army):
+        return
+    AtlasPage.schedule_update(instance.army_id)
+
+
+@receiver([post_save, post_delete], sender=Table)
+def invalidate_table_role_decisions(sender, instance, **kwargs):
+    authorization.invalidate(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Chair)
+def invalidate_chair_role_decisions(sender, instance, **kwargs):
+    authorization.invalidate(instance.table_id)
+
+
+@receiver([post_save, post_delete], sender=NamedInvitation)
+def invalidate_invitation_role_decisions(sender, instance, **kwargs):
+    try:
+        authorization.invalidate(instance.chair.table_id)
+    except Chair.DoesNotExist:
+        # chair is being deleted and invalidates decisions on its own
+        pass
+
+
+@receiver([post_save, post_delete], sender=ProfilingRule)
+def update_profiling_rules(sender, **kwargs):
+    profiling.update_rules()
@@ -0,0 +1,98 @@
+import logging
+import random
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from .models import ProvisionedTable
+from .shards import DEFAULT_SHARD
+from . import tss
+
+# Pool of tables which table sync servers have already created (without board), so
+# creating new table doesn't wait for them. Every shard has its own pool. Whenever
+# pool drops below TABLE_ID_POOL_LOW_WATERMARK it is topped up to
+# TABLE_ID_POOL_HIGH_WATERMARK with single /tables/batch/ request made in the
+# background. Pools live in the database, so they are shared by all worker processes.
+# Pooled table is given to user only once table server set its board, otherwise new
+# table is created on demand.
+logger = logging.getLogger(__name__)
+executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="table-pool")
+REFILL_LOCK_TIMEOUT = 60
+BOARD_ATTEMPTS = 2
+
+
+def get_refill_lock_key(shard):
+    return f"table_pool:{shard}:refilling"
+
+
+def pop(shard=DEFAULT_SHARD):
+    # Row is claimed by deleting it, so concurrent workers never get the same id.
+    pool = ProvisionedTable.objects.filter(shard=shard)
+    while True:
+        candidates = list(pool.values_list("id", flat=True)[:20])
+        if not candidates:
+            return None
+        random.shuffle(candidates)
+        for table_id in candidates:
+            if ProvisionedTable.objects.filter(id=table_id).delete()[0]:
+                return table_id
+
+
+def create_table(board_id, shard=DEFAULT_SHARD):
+    if settings.TABLE_ID_POOL_HIGH_WATERMARK <= 0:
+        return tss.get_client(shard).create_table(board_id)
+    table_id = pop(shard)
+    pool_size = ProvisionedTable.objects.filter(shard=shard).count()
+    if pool_size < settings.TABLE_ID_POOL_LOW_WATERMARK:
+        transaction.on_commit(lambda: request_refill(shard))
+    if table_id is not None:
+        try:
+            set_initial_board(table_id, board_id, shard)
+            return table_id
+        except tss.TssError as e:
+            # popped table stays without board and is never used
+            logger.warning("Unable to set board of table %s: %s", table_id, e)
+    # errors of table server reach the caller
+    return tss.get_client(shard).create_table(board_id)
+
+
+def set_initial_board(table_id, board_id, shard=DEFAULT_SHARD):
+    for attempt in range(BOARD_ATTEMPTS):
+        try:
+            return tss.get_client(shard).set_initial_board(table_id, board_id)
+        except tss.TssUnavailable:
+            raise
+        except tss.TssError:
+            if attempt == BOARD_ATTEMPTS - 1:
+                raise
+
+
+def request_refill(shard=DEFAULT_SHARD):
+    # cache key prevents several processes from refilling pool at the same time
+    if cache.add(get_refill_lock_key(shard), True, REFILL_LOCK_TIMEOUT):
+        executor.submit(in_background, refill, shard)
+
+
+def refill(shard=DEFAULT_SHARD):
+    try:
+        pool = ProvisionedTable.objects.filter(shard=shard)
+        missing = settings.TABLE_ID_POOL_HIGH_WATERMARK - pool.count()
+        if missing > 0:
+            table_ids = tss.get_client(shard).provision_tables(missing)
+            ProvisionedTable.objects.bulk_create(
+                [ProvisionedTable(id=table_id, shard=shard) for table_id in table_ids],
+                ignore_conflicts=True,
+            )
+    except tss.TssError as e:
+        logger.warning("Unable to refill table id pool of %s shard: %s", shard, e)
+    finally:
+        cache.delete(get_refill_lock_key(shard))
+
+
+def in_background(task, *args):
+    try:
+        task(*args)
+    except Exception:
+        logger.exception("Table pool task failed.")
+    finally:
+        connections.close_all()
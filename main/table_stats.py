@@ -0,0 +1,68 @@
+import logging
+from collections import defaultdict
+from datetime import datetime, timezone
+from django.conf import settings
+from django.core.cache import cache
+from . import tss
+from .metrics import count_cache_lookups
+
+# Occupancy and last activity of tables, fetched from table sync servers with single
+# /tables/stats/ request per shard and cached for TABLE_STATS_CACHE_TIMEOUT seconds.
+# Tables unknown to their table server are cached as None.
+logger = logging.getLogger(__name__)
+BATCH_SIZE = 500
+
+
+def get_key(table_id):
+    return f"table_stats:{table_id}"
+
+
+def parse(stats):
+    if stats is None:
+        return None
+    last_activity = datetime.fromtimestamp(stats["lastActivity"] / 1000, timezone.utc)
+    return {
+        "online": stats["online"],
+        "players": stats["players"],
+        "last_activity": last_activity,
+    }
+
+
+def fetch(shard, table_ids):
+    stats = {}
+    for start in range(0, len(table_ids), BATCH_SIZE):
+        batch = table_ids[start : start + BATCH_SIZE]
+        try:
+            fetched = tss.get_client(shard).get_tables_stats(batch)
+        except tss.TssError as e:
+            logger.warning("Unable to fetch stats of tables from %s: %s", shard, e)
+            continue
+        stats |= {table_id: parse(fetched.get(table_id)) for table_id in batch}
+    return stats
+
+
+def get_stats(tables):
+    keys = {table.pk: get_key(table.pk) for table in tables}
+    cached = cache.get_many(keys.values())
+    stats = {table_id: cached[key] for table_id, key in keys.items() if key in cached}
+    count_cache_lookups("table_stats", len(stats), len(keys) - len(stats))
+    missing = defaultdict(list)
+    for table in tables:
+        if table.pk not in stats:
+            missing[table.shard].append(table.pk)
+    for shard, table_ids in missing.items():
+        fetched = fetch(shard, table_ids)
+        cache.set_many(
+            {get_key(table_id): value for table_id, value in fetched.items()},
+            settings.TABLE_STATS_CACHE_TIMEOUT,
+        )
+        stats |= fetched
+    return stats
+
+
+def annotate(tables):
+    # sets live_stats attribute of given tables (None when they are unavailable)
+    stats = get_stats(tables)
+    for table in tables:
+        table.live_stats = stats.get(table.pk)
+    return tables
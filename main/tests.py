@@ -1,11 +1,60 @@
+from collections import Counter
+from contextlib import contextmanager
+from datetime import timedelta
 from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
 import os
+import pstats
 import shutil
-from django.test import TestCase, TransactionTestCase, override_settings
+import threading
+import time
+from unittest import mock
+from urllib.parse import parse_qs
+import zipfile
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import DatabaseError, transaction
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.conf import settings
+from django.test import (
+    LiveServerTestCase,
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
 from django.contrib.auth import get_user_model
-from django.urls import reverse
-
-from .models import Board, Chair, Table, Army, Resource, Token
+from django.contrib.auth.models import AnonymousUser
+from django.urls import resolve, reverse
+from django.utils import timezone
+from nanoid import generate
+from PIL import Image
+
+from .models import (
+    Army,
+    ArmyInfo,
+    AtlasPage,
+    Blob,
+    Board,
+    Chair,
+    Emote,
+    NamedInvitation,
+    ProfilingRule,
+    ProvisionedTable,
+    PublicationRequest,
+    Resource,
+    Table,
+    TableVisit,
+    Token,
+    UserDiskQuota,
+)
+from .tickets import make_ticket, verify_ticket
+from .views import serve_media
+from . import async_views, authorization, views
+from . import metrics, profiling, querycount, shards, table_pool, tss, visits
 from django.core.files.uploadedfile import SimpleUploadedFile
 import json
 
@@ -19,6 +68,83 @@ def create_user(username: str, password: str):
     return get_user_model().objects.create_user(username=username, password=password)
 
 
+class StandInTableServer:
+    # Local replacement of table sync server. Creates tables and reports stats unless
+    # responses were queued with respond(). Received requests are recorded as
+    # (method, path), internal secrets they carried in secrets.
+    def __init__(self):
+        self.requests = []
+        self.secrets = []
+        self.responses = []
+        # table id -> stats reported by /tables/stats/
+        self.stats = {}
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stand_in.handle(self)
+
+            do_POST = do_GET
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}"
+
+    def respond(self, status=200, payload=None, delay=0):
+        self.responses.append((status, payload, delay))
+
+    def handle(self, handler):
+        body = handler.rfile.read(int(handler.headers.get("Content-Length", 0)))
+        data = parse_qs(body.decode())
+        self.requests.append((handler.command, handler.path))
+        self.secrets.append(handler.headers.get("X-Internal-Secret"))
+        status, payload, delay = (
+            self.responses.pop(0) if self.responses else (200, None, 0)
+        )
+        time.sleep(delay)
+        if payload is None and handler.path == "/tables/":
+            payload = {"tableId": generate(size=12)}
+        if payload is None and handler.path == "/tables/stats/":
+            ids = data.get("ids", [])
+            payload = {"stats": {i: self.stats[i] for i in ids if i in self.stats}}
+        if payload is None and handler.path == "/tables/batch/":
+            payload = {
+                "tableIds": [generate(size=12) for _ in range(int(data["count"][0]))]
+            }
+        body = json.dumps(payload).encode()
+        try:
+            handler.send_response(status)
+            handler.send_header("Content-Type", "application/json")
+            handler.send_header("Content-Length", str(len(body)))
+            handler.end_headers()
+            handler.wfile.write(body)
+        except ConnectionError:
+            # client gave up waiting (timeout tests)
+            pass
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class QueryBudgetMixin:
+    @contextmanager
+    def assertQueryBudget(self, budget):
+        # Budgets are checked against large datasets, so views loading related
+        # objects row by row exceed them and repeated query shapes are reported.
+        with querycount.record_queries() as log:
+            yield log
+        repeated = log.get_repeated(settings.QUERY_REPEAT_THRESHOLD)
+        self.assertFalse(repeated, f"Repeated queries:\n{log}")
+        self.assertLessEqual(len(log), budget, f"Queries over budget:\n{log}")
+
+
 # Below tests aren't independent, because they share the same upload directory.
 @override_settings(MEDIA_ROOT=(TEST_DIR + "/media"))
 class ResourceUploading(TestCase):
@@ -182,6 +308,270 @@ class ResourceCleanup(TransactionTestCase):
         self.assertEqual(Resource.objects.count(), 0)
 
 
+@override_settings(MEDIA_ROOT=(TEST_DIR + "/media"))
+class DiskQuotaAccounting(TransactionTestCase):
+    def setUp(self):
+        self.user = create_user(username="user", password="user")
+        self.army = Army.objects.create(name="test", owner=self.user)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(TEST_DIR, ignore_errors=True)
+        return super().tearDown()
+
+    def add_resource(self, content=b"dummy content"):
+        return self.army.resource_set.create(
+            name="res", file=SimpleUploadedFile("res.txt", content)
+        )
+
+    def get_used(self):
+        return UserDiskQuota.objects.get(user=self.user).used
+
+    def test_upload_is_charged(self):
+        self.client.login(username="user", password="user")
+        self.client.post(
+            f"/armies/{self.army.pk}/resources/",
+            {"file_field": SimpleUploadedFile("res.txt", b"12345")},
+        )
+        self.assertEqual(self.get_used(), 5)
+
+    def test_delete_is_refunded(self):
+        res = self.add_resource()
+        self.assertEqual(self.get_used(), len(b"dummy content"))
+        res.delete()
+        self.assertEqual(self.get_used(), 0)
+
+    def test_bulk_delete_is_refunded(self):
+        res1 = self.add_resource(b"123")
+        self.add_resource(b"4567")
+        self.client.login(username="user", password="user")
+        self.client.post(
+            f"/armies/{self.army.pk}/resources/del_many/", {"res": [res1.pk]}
+        )
+        self.assertEqual(self.get_used(), 4)
+
+    def test_clone_and_army_delete(self):
+        self.add_resource(b"123")
+        clone = self.army.clone("clone")
+        self.assertEqual(self.get_used(), 6)
+        clone.delete()
+        self.assertEqual(self.get_used(), 3)
+
+    def test_reconcile_fixes_drift(self):
+        self.add_resource(b"123")
+        UserDiskQuota.objects.filter(user=self.user).update(used=1000)
+        call_command("reconcile_disk_quota", "--dry-run", stdout=StringIO())
+        self.assertEqual(self.get_used(), 1000)
+        out = StringIO()
+        call_command("reconcile_disk_quota", stdout=out)
+        self.assertEqual(self.get_used(), 3)
+        self.assertIn("drift +997 B", out.getvalue())
+
+
+@override_settings(MEDIA_ROOT=(TEST_DIR + "/media"))
+class BlobStore(TransactionTestCase):
+    def setUp(self):
+        self.user = create_user(username="user", password="user")
+        self.army = Army.objects.create(name="test", owner=self.user)
+        self.res = self.army.resource_set.create(
+            name="res", file=SimpleUploadedFile("res.txt", b"dummy content")
+        )
+
+    def tearDown(self) -> None:
+        shutil.rmtree(TEST_DIR, ignore_errors=True)
+        return super().tearDown()
+
+    def test_clone_shares_blob(self):
+        clone = self.army.clone("clone")
+        clone_res = clone.resource_set.get()
+        self.assertEqual(self.res.blob_id, clone_res.blob_id)
+        self.assertEqual(Blob.objects.get().refcount, 2)
+        self.assertTrue(os.path.samefile(self.res.file.path, clone_res.file.path))
+        self.assertEqual(b"dummy content", clone_res.file.read())
+        clone_res.file.close()
+
+    def test_blob_removed_with_last_reference(self):
+        clone = self.army.clone("clone")
+        blob_path = Blob.objects.get().file.path
+        self.army.delete()
+        self.assertEqual(Blob.objects.get().refcount, 1)
+        self.assertTrue(os.path.exists(clone.resource_set.get().file.path))
+        clone.delete()
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(os.path.exists(blob_path))
+
+    def test_bulk_delete_releases_blob(self):
+        self.army.resource_set.all().delete()
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(os.path.exists(self.res.file.path))
+
+    def test_upload_reuses_blob(self):
+        other = Army.objects.create(name="other", owner=self.user)
+        res = other.resource_set.create(
+            name="res", file=SimpleUploadedFile("copy.txt", b"dummy content")
+        )
+        self.assertEqual(self.res.blob_id, res.blob_id)
+        self.assertTrue(os.path.samefile(self.res.file.path, res.file.path))
+        self.assertTrue(res.file.name.startswith(f"armies/{other.pk}/"))
+
+    def test_dedupe_media(self):
+        duplicate = os.path.join(os.path.dirname(self.res.file.path), "copy.txt")
+        with open(duplicate, "wb") as f:
+            f.write(b"dummy content")
+        out = StringIO()
+        call_command("dedupe_media", "--dry-run", stdout=out)
+        self.assertIn("Found 1 duplicate file(s)", out.getvalue())
+        self.assertFalse(os.path.samefile(self.res.file.path, duplicate))
+        out = StringIO()
+        call_command("dedupe_media", stdout=out)
+        self.assertIn(
+            "Collapsed 1 duplicate file(s) occupying 13 Bytes", out.getvalue()
+        )
+        self.assertTrue(os.path.samefile(self.res.file.path, duplicate))
+
+
+def make_png(width=400, height=300, color="red"):
+    buffer = BytesIO()
+    Image.new("RGB", (width, height), color).save(buffer, "PNG")
+    return SimpleUploadedFile("img.png", buffer.getvalue())
+
+
+@override_settings(MEDIA_ROOT=(TEST_DIR + "/media"))
+class ResourceThumbnails(TransactionTestCase):
+    def setUp(self):
+        self.user = create_user(username="user", password="user")
+        self.army = Army.objects.create(name="test", owner=self.user)
+        self.client.login(username="user", password="user")
+
+    def tearDown(self) -> None:
+        shutil.rmtree(TEST_DIR, ignore_errors=True)
+        return super().tearDown()
+
+    def upload(self, file):
+        self.client.post(f"/armies/{self.army.pk}/resources/", {"file_field": file})
+        return self.army.resource_set.get()
+
+    def test_thumbnail_generated_on_upload(self):
+        res = self.upload(make_png())
+        self.assertTrue(res.get_thumbnail_url().endswith(".thumb.webp"))
+        with Image.open(res.blob.thumbnail.path) as thumbnail:
+            self.assertEqual((213, 160), thumbnail.size)
+
+    def test_non_image_uses_original(self):
+        res = self.upload(SimpleUploadedFile("res.txt", b"dummy content"))
+        self.assertEqual(res.file.url, res.get_thumbnail_url())
+
+    @override_settings(RESOURCE_WEBP_UPLOADS=True)
+    def test_webp_uploads(self):
+        res = self.upload(make_png())
+        self.assertEqual("img", res.name)
+        self.assertTrue(res.file.name.endswith("/img.webp"))
+        with Image.open(res.file.path) as img:
+            self.assertEqual((400, 300), img.size)
+
+    def test_rebuild_thumbnails(self):
+        res = self.upload(make_png())
+        os.remove(res.blob.thumbnail.path)
+        Blob.objects.update(thumbnail="")
+        out = StringIO()
+        call_command("rebuild_thumbnails", "-j", "2", stdout=out)
+        self.assertIn("Generated 1 thumbnail(s)", out.getvalue())
+        self.assertTrue(os.path.exists(Blob.objects.get().thumbnail.path))
+
+
+@override_settings(MEDIA_ROOT=(TEST_DIR + "/media"))
+class ArmyAtlas(TransactionTestCase):
+    def setUp(self):
+        self.user = create_user(username="user", password="user")
+        self.army = Army.objects.create(name="test", owner=self.user)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(TEST_DIR, ignore_errors=True)
+        return super().tearDown()
+
+    def add_token(self, color, rect=None, size=(40, 30)):
+        res = self.army.resource_set.create(
+            name=color, file=make_png(*size, color=color)
+        )
+        return self.army.token_set.create(
+            name=color,
+            front_image=res,
+            back_image=res,
+            front_image_rect=rect,
+            back_image_rect=rect,
+        )
+
+    def get_pixel(self, data):
+        rect = data["imgRect"]
+        page = AtlasPage.objects.get(file__endswith=data["img"].split("?")[0])
+        with Image.open(page.file.path) as img:
+            return img.convert("RGB").getpixel((rect["x"], rect["y"]))
+
+    def test_token_images_are_packed(self):
+        self.add_token("red")
+        self.add_token("blue", rect={"x": 10, "y": 5, "w": 20, "h": 10})
+        red, blue = self.army.get_info()["tokens"]
+        self.assertEqual(red["img"], blue["img"])
+        self.assertTrue(red["img"].startswith("atlas-"))
+        self.assertEqual((40, 30), (red["imgRect"]["w"], red["imgRect"]["h"]))
+        self.assertEqual((20, 10), (blue["imgRect"]["w"], blue["imgRect"]["h"]))
+        self.assertEqual((255, 0, 0), self.get_pixel(red))
+        self.assertEqual((0, 0, 255), self.get_pixel(blue))
+
+    def test_tokens_added_one_at_a_time_share_page(self):
+        for color in ["red", "green", "blue"]:
+            self.add_token(color)
+        page = AtlasPage.objects.get()
+        self.assertEqual(3, len(page.entries))
+
+    @override_settings(ARMY_ATLAS_PAGE_SIZE=64)
+    def test_incremental_update(self):
+        self.add_token("red")
+        first_page = self.army.get_info()["tokens"][0]["img"]
+        self.add_token("blue")
+        red, blue = self.army.get_info()["tokens"]
+        self.assertEqual(first_page, red["img"])
+        self.assertNotEqual(first_page, blue["img"])
+        self.assertEqual(2, AtlasPage.objects.count())
+        self.assertEqual(red, self.army.get_info()["tokens"][0])
+
+    @override_settings(ARMY_ATLAS_PAGE_SIZE=128)
+    def test_unused_pages_are_repacked(self):
+        red = self.add_token("red", size=(100, 100))
+        self.add_token("blue")
+        self.add_token("green")
+        self.assertEqual(2, AtlasPage.objects.count())
+        red.delete()
+        page = AtlasPage.objects.get()
+        self.assertEqual(2, len(page.entries))
+
+    def test_info_doesnt_build_pages(self):
+        self.add_token("red")
+        AtlasPage.objects.all().delete()
+        with self.assertNumQueries(2):
+            token = self.army.get_info()["tokens"][0]
+        self.assertFalse(token["img"].startswith("atlas-"))
+        self.assertFalse(AtlasPage.objects.exists())
+        call_command("update_atlas_pages", stdout=StringIO())
+        self.assertTrue(self.army.get_info()["tokens"][0]["img"].startswith("atlas-"))
+
+    def test_army_info_is_rebuilt_with_new_pages(self):
+        self.add_token("red")
+        AtlasPage.objects.all().delete()
+        ArmyInfo.get_content(self.army.pk)
+        AtlasPage.update(self.army.pk)
+        content, _ = ArmyInfo.get_content(self.army.pk)
+        self.assertIn(b"atlas-", content)
+
+    def test_non_images_are_not_packed(self):
+        res = self.army.resource_set.create(
+            name="txt", file=SimpleUploadedFile("res.txt", b"dummy content")
+        )
+        self.army.token_set.create(name="txt", front_image=res, back_image=res)
+        token = self.army.get_info()["tokens"][0]
+        self.assertTrue(token["img"].startswith("res.txt"))
+        self.assertNotIn("imgRect", token)
+
+
 class SimpleTest(TestCase):
     def test_home(self):
         response = self.client.get("/")
@@ -199,6 +589,10 @@ class TablesTest(TestCase):
         board_image = SimpleUploadedFile("dummy.txt", b"dummy content")
         cls.board = Board.objects.create(name="test_board", image=board_image)
 
+    def setUp(self):
+        self.tss = self.enterContext(StandInTableServer())
+        self.enterContext(override_settings(INTERNAL_TSS_URL=self.tss.url))
+
     def tearDown(self) -> None:
         shutil.rmtree(TEST_DIR, ignore_errors=True)
         return super().tearDown()
@@ -212,6 +606,16 @@ class TablesTest(TestCase):
         self.assertEqual(2, Table.objects.count())
         self.assertEqual(0, Chair.objects.count())
 
+    def test_table_creation_fails_when_table_server_fails(self):
+        self.client.login(username="owner", password="owner")
+        self.tss.respond(status=500)
+        response = self.client.post(
+            "/tables/", {"name": "new_table", "board": self.board.pk}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Failed to create table")
+        self.assertEqual(1, Table.objects.count())
+
     def test_table_creation_without_board_fails(self):
         self.client.login(username="owner", password="owner")
         response = self.client.post("/tables/", {"name": "new_table"})
@@ -280,6 +684,548 @@ class TablesTest(TestCase):
         self.assertContains(response, table)
 
 
+@override_settings(TABLE_ID_POOL_LOW_WATERMARK=2, TABLE_ID_POOL_HIGH_WATERMARK=5)
+class TablePoolTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.board = Board.objects.create(name="test_board", image="dummy.png")
+
+    def setUp(self):
+        self.tss = self.enterContext(StandInTableServer())
+        self.enterContext(override_settings(INTERNAL_TSS_URL=self.tss.url))
+
+    def test_refill_tops_up_pool_with_single_request(self):
+        ProvisionedTable.objects.create(id="pooled")
+        table_pool.refill()
+        self.assertEqual(5, ProvisionedTable.objects.count())
+        self.assertEqual([("POST", "/tables/batch/")], self.tss.requests)
+
+    def test_table_creation_uses_pooled_table(self):
+        for table_id in ["pooled1", "pooled2", "pooled3"]:
+            ProvisionedTable.objects.create(id=table_id)
+        with self.captureOnCommitCallbacks():
+            response = self.client.post(
+                "/tables/", {"name": "new_table", "board": self.board.pk}
+            )
+        self.assertEqual(response.status_code, 302)
+        table = Table.objects.get(name="new_table")
+        self.assertIn(table.pk, ["pooled1", "pooled2", "pooled3"])
+        self.assertFalse(ProvisionedTable.objects.filter(pk=table.pk).exists())
+        self.assertEqual([("POST", f"/tables/{table.pk}/board/")], self.tss.requests)
+
+    def test_setting_board_is_retried(self):
+        ProvisionedTable.objects.create(id="pooled")
+        self.tss.respond(status=500)
+        self.assertEqual("pooled", table_pool.create_table(self.board.pk))
+        self.assertEqual(2, len(self.tss.requests))
+
+    def test_table_is_created_when_board_cant_be_set(self):
+        ProvisionedTable.objects.create(id="pooled")
+        for _ in range(table_pool.BOARD_ATTEMPTS):
+            self.tss.respond(status=409)
+        table_id = table_pool.create_table(self.board.pk)
+        self.assertNotEqual("pooled", table_id)
+        self.assertEqual(("POST", "/tables/"), self.tss.requests[-1])
+
+    def test_table_server_errors_reach_caller(self):
+        ProvisionedTable.objects.create(id="pooled")
+        for _ in range(table_pool.BOARD_ATTEMPTS + 1):
+            self.tss.respond(status=400)
+        with self.assertRaises(tss.TssError):
+            table_pool.create_table(self.board.pk)
+
+    def test_pool_is_refilled_below_low_watermark(self):
+        ProvisionedTable.objects.create(id="pooled")
+        with mock.patch.object(table_pool, "request_refill") as request_refill:
+            with self.captureOnCommitCallbacks(execute=True):
+                table_pool.create_table(self.board.pk)
+        request_refill.assert_called_once_with("default")
+
+    def test_table_is_created_on_demand_when_pool_is_empty(self):
+        table_id = table_pool.create_table(self.board.pk)
+        self.assertEqual(12, len(table_id))
+        self.assertEqual([("POST", "/tables/")], self.tss.requests)
+
+    def test_pooled_tables_are_popped_once(self):
+        ProvisionedTable.objects.create(id="pooled1")
+        ProvisionedTable.objects.create(id="pooled2")
+        popped = {table_pool.pop(), table_pool.pop()}
+        self.assertEqual({"pooled1", "pooled2"}, popped)
+        self.assertIsNone(table_pool.pop())
+
+
+def make_shards(*names, **weights):
+    return {
+        name: {
+            "internal_url": f"http://{name}.internal",
+            "url": f"https://{name}.example.com",
+            "ws_url": f"wss://{name}.example.com",
+            "weight": weights.get(name, 1),
+        }
+        for name in names
+    }
+
+
+class TableStatsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.owner = get_user_model().objects.create_superuser(
+            username="owner", password="owner"
+        )
+        cls.tables = [
+            Table.objects.create(name=f"table{i}", owner=cls.owner) for i in range(3)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.tss = self.enterContext(StandInTableServer())
+        self.enterContext(override_settings(INTERNAL_TSS_URL=self.tss.url))
+        self.tss.stats[self.tables[0].pk] = {
+            "online": 3,
+            "players": 2,
+            "lastActivity": time.time() * 1000,
+        }
+        self.tss.stats[self.tables[1].pk] = {
+            "online": 0,
+            "players": 0,
+            "lastActivity": (time.time() - 2 * 60 * 60) * 1000,
+        }
+        self.client.login(username="owner", password="owner")
+
+    def test_tables_list_shows_occupancy(self):
+        response = self.client.get("/tables/")
+        self.assertContains(response, "3 online")
+        self.assertContains(response, "last active 2\xa0hours ago")
+        self.assertEqual([("POST", "/tables/stats/")], self.tss.requests)
+
+    def test_stats_are_cached(self):
+        self.client.get("/tables/")
+        response = self.client.get("/tables/")
+        self.assertContains(response, "3 online")
+        self.assertEqual(1, len(self.tss.requests))
+
+    def test_admin_changelist_shows_occupancy(self):
+        response = self.client.get(reverse("admin:main_table_changelist"))
+        self.assertContains(response, "3 (2 playing)")
+        self.assertEqual([("POST", "/tables/stats/")], self.tss.requests)
+
+    def test_tables_list_works_without_table_server(self):
+        self.tss.respond(status=500)
+        response = self.client.get("/tables/")
+        self.assertContains(response, self.tables[0].name)
+        self.assertNotContains(response, "online")
+
+
+class ShardPlacementTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.owner = create_user(username="owner", password="owner")
+        cls.board = Board.objects.create(name="test_board", image="dummy.png")
+
+    def test_hash_placement_is_stable_and_spread(self):
+        keys = [str(i) for i in range(1000)]
+        with override_settings(TSS_SHARDS=make_shards("a", "b", "c")):
+            before = [shards.place(key) for key in keys]
+            self.assertEqual(before, [shards.place(key) for key in keys])
+            self.assertGreater(min(Counter(before).values()), 200)
+        with override_settings(TSS_SHARDS=make_shards("a", "b", "c", "d")):
+            after = [shards.place(key) for key in keys]
+        moved = [(b, a) for b, a in zip(before, after) if b != a]
+        # only tables placed on the new shard change their placement
+        self.assertTrue(all(a == "d" for _, a in moved))
+        self.assertLess(len(moved), 400)
+
+    @override_settings(
+        TSS_SHARDS=make_shards("a", "b", b=2), TSS_PLACEMENT="least_loaded"
+    )
+    def test_least_loaded_placement(self):
+        Table.objects.create(name="t1", shard="a")
+        Table.objects.create(name="t2", shard="b")
+        self.assertEqual("b", shards.place("key"))
+        Table.objects.create(name="t3", shard="b")
+        self.assertEqual("a", shards.place("key"))
+
+    def test_table_is_created_on_placed_shard(self):
+        with StandInTableServer() as a, StandInTableServer() as b:
+            servers = {"a": a, "b": b}
+            shard_config = make_shards("a", "b")
+            for name, server in servers.items():
+                shard_config[name]["internal_url"] = server.url
+            self.client.login(username="owner", password="owner")
+            with override_settings(
+                TSS_SHARDS=shard_config, TABLE_ID_POOL_HIGH_WATERMARK=0
+            ):
+                response = self.client.post(
+                    "/tables/", {"name": "new_table", "board": self.board.pk}
+                )
+                self.assertEqual(response.status_code, 302)
+                table = Table.objects.get(name="new_table")
+                self.assertEqual(str(self.owner.pk), table.placement_key)
+                self.assertEqual(shards.place(table.placement_key), table.shard)
+                self.assertEqual(1, len(servers[table.shard].requests))
+                ws_url = f"wss://{table.shard}.example.com"
+                response = self.client.get(table.get_play_url())
+                self.assertContains(response, ws_url)
+                response = self.client.get(f"/tables/{table.pk}/info/")
+                self.assertEqual(ws_url, response.json()["tssWsUrl"])
+                response = self.client.get(f"/serverInfo/?table={table.pk}")
+                self.assertEqual(ws_url, response.json()["tss_ws_url"])
+
+    @override_settings(TSS_SHARDS=make_shards("a", "b"))
+    def test_invitation_play_pages_connect_to_table_shard(self):
+        table = Table.objects.create(name="table", owner=self.owner, shard="b")
+        chair = Chair.objects.create(table=table, kind="p", enable_link_invitation=True)
+        invitation = NamedInvitation.objects.create(chair=chair, user=self.owner)
+        self.client.login(username="owner", password="owner")
+        for url in [
+            reverse("main:link_invitation_play", args=[chair.link_invitation]),
+            reverse("main:named_invitation_play", args=[invitation.pk]),
+        ]:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertContains(
+                    response,
+                    '<script id="tssWsUrl" type="application/json">'
+                    '"wss://b.example.com"</script>',
+                    html=True,
+                )
+
+
+class RebalanceTablesTest(TestCase):
+    def setUp(self):
+        self.shards = make_shards("a", "b")
+        for name, shard in self.shards.items():
+            shard["data_dir"] = os.path.join(TEST_DIR, "shards", name)
+            os.makedirs(os.path.join(shard["data_dir"], "tables"))
+        self.enterContext(override_settings(TSS_SHARDS=self.shards))
+
+    def tearDown(self):
+        shutil.rmtree(TEST_DIR, ignore_errors=True)
+        return super().tearDown()
+
+    def create_table(self, shard, content='{"act": {"board": 1}}\n'):
+        table = Table.objects.create(name="table", shard=shard)
+        path = os.path.join(self.shards[shard]["data_dir"], "tables", table.pk)
+        with open(path, "w") as f:
+            f.write(content)
+        return table
+
+    def get_dump(self, shard, name):
+        with open(os.path.join(self.shards[shard]["data_dir"], name)) as f:
+            return f.read()
+
+    def test_drain_shard(self):
+        tables = [self.create_table("a") for _ in range(3)]
+        out = StringIO()
+        call_command("rebalance_tables", "--drain", "a", stdout=out)
+        self.assertIn("Moved 3 table(s)", out.getvalue())
+        for table in tables:
+            table.refresh_from_db()
+            self.assertEqual("b", table.shard)
+            self.assertEqual(
+                '{"act": {"board": 1}}\n', self.get_dump("b", f"tables/{table.pk}")
+            )
+
+    def test_dry_run(self):
+        table = self.create_table("a")
+        out = StringIO()
+        call_command("rebalance_tables", "--drain", "a", "--dry-run", stdout=out)
+        self.assertIn(f"Would move {table.pk} from a to b (22 Bytes)", out.getvalue())
+        table.refresh_from_db()
+        self.assertEqual("a", table.shard)
+        self.assertFalse(
+            os.path.exists(os.path.join(self.shards["b"]["data_dir"], "tables"))
+            and os.listdir(os.path.join(self.shards["b"]["data_dir"], "tables"))
+        )
+
+    def test_referenced_dump_files_are_moved(self):
+        with open(os.path.join(self.shards["a"]["data_dir"], "old"), "w") as f:
+            f.write('{"act": {"board": 1}}\n')
+        table = self.create_table("a", '{"prev": {"file": "old", "line": 0}}\n')
+        call_command(
+            "rebalance_tables", "--drain", "a", "--delete-source", stdout=StringIO()
+        )
+        self.assertEqual('{"act": {"board": 1}}\n', self.get_dump("b", "old"))
+        self.assertFalse(
+            os.path.exists(
+                os.path.join(self.shards["a"]["data_dir"], "tables", table.pk)
+            )
+        )
+
+    def test_missing_dump_file_fails_move(self):
+        table = Table.objects.create(name="table", shard="a")
+        with self.assertRaises(CommandError):
+            call_command(
+                "rebalance_tables",
+                "--drain",
+                "a",
+                stdout=StringIO(),
+                stderr=StringIO(),
+            )
+        table.refresh_from_db()
+        self.assertEqual("a", table.shard)
+
+    def test_hash_rebalancing_uses_placement_key(self):
+        key = next(str(i) for i in range(100) if shards.place_by_hash(str(i)) == "b")
+        table = Table.objects.create(name="table", shard="b", placement_key=key)
+        # owner claiming the table doesn't change its placement
+        table.owner = create_user(username="owner", password="owner")
+        table.save()
+        out = StringIO()
+        call_command("rebalance_tables", "--placement", "hash", stdout=out)
+        self.assertIn("Moved 0 table(s)", out.getvalue())
+
+    def test_least_loaded_rebalancing_moves_only_excess_tables(self):
+        for _ in range(4):
+            self.create_table("a")
+        call_command(
+            "rebalance_tables", "--placement", "least_loaded", stdout=StringIO()
+        )
+        self.assertEqual(2, Table.objects.filter(shard="a").count())
+        self.assertEqual(2, Table.objects.filter(shard="b").count())
+
+
+@override_settings(MEDIA_ROOT=(TEST_DIR + "/media"))
+class SeedLoadDataTest(TestCase):
+    def tearDown(self):
+        shutil.rmtree(TEST_DIR, ignore_errors=True)
+        return super().tearDown()
+
+    def seed(self, *args):
+        out = StringIO()
+        call_command(
+            "seed_load_data",
+            *["--users", "20", "--armies", "3", "--tokens", "30"],
+            *["--army-images", "5", "--distinct-images", "4", "--tables", "15"],
+            *["--visits", "50", "--boards", "2", "--emotes", "2", "-b", "7"],
+            *args,
+            stdout=out,
+        )
+        return out.getvalue()
+
+    def test_generated_data(self):
+        self.seed("-j", "2")
+        self.assertEqual(20, get_user_model().objects.count())
+        self.assertEqual(90, Token.objects.count())
+        self.assertEqual(15, Table.objects.count())
+        self.assertEqual(30, Chair.objects.count())
+        self.assertEqual(50, TableVisit.objects.count())
+        self.assertEqual(2, Emote.objects.count())
+        for res in Resource.objects.select_related("blob", "army"):
+            self.assertTrue(os.path.samefile(res.file.path, res.blob.file.path))
+        for blob in Blob.objects.all():
+            self.assertEqual(blob.refcount, blob.resource_set.count())
+        for quota in UserDiskQuota.objects.all():
+            self.assertEqual(quota.compute_used(), quota.used)
+        board = Board.objects.first()
+        self.assertTrue(os.path.exists(board.image.path))
+        self.assertTrue(self.client.login(username="load0", password="load"))
+
+    def generate_ids(self, *args):
+        with transaction.atomic():
+            self.seed("--no-media", *args)
+            ids = [
+                sorted(model.objects.values_list("pk", flat=True))
+                for model in [Army, Token, Table, Chair, NamedInvitation]
+            ]
+            transaction.set_rollback(True)
+        return ids
+
+    def test_same_seed_generates_same_data(self):
+        self.assertEqual(self.generate_ids(), self.generate_ids())
+        self.assertNotEqual(self.generate_ids(), self.generate_ids("-s", "1"))
+
+    @override_settings(TSS_SHARDS=make_shards("a", "b", "c"))
+    def test_seeded_tables_dont_need_rebalancing(self):
+        self.seed("--no-media")
+        self.assertGreater(Table.objects.filter(owner=None).count(), 0)
+        out = StringIO()
+        call_command("rebalance_tables", "--placement", "hash", stdout=out)
+        self.assertIn("Moved 0 table(s)", out.getvalue())
+
+    @override_settings(
+        TSS_SHARDS=make_shards("a", "b", "c"), TSS_PLACEMENT="least_loaded"
+    )
+    def test_seeded_tables_follow_configured_placement(self):
+        self.seed("--no-media")
+        counts = Counter(Table.objects.values_list("shard", flat=True))
+        self.assertEqual({"a": 5, "b": 5, "c": 5}, counts)
+
+    def test_existing_prefix(self):
+        self.seed("--no-media")
+        with self.assertRaises(CommandError):
+            self.seed("--no-media")
+
+
+class LoadTestCommandTest(LiveServerTestCase):
+    def setUp(self):
+        call_command(
+            "seed_load_data",
+            "--no-media",
+            *["--users", "10", "--armies", "3", "--public-ratio", "1", "--tables", "5"],
+            stdout=StringIO(),
+        )
+        self.tss = self.enterContext(StandInTableServer())
+        self.enterContext(override_settings(INTERNAL_TSS_URL=self.tss.url))
+
+    def test_load_test(self):
+        out = StringIO()
+        call_command(
+            "load_test",
+            *["--url", self.live_server_url, "--rate", "20", "--duration", "1"],
+            # only correctness is checked, test machines may stall at times
+            *["--accounts", "4", "--max-p95", "10000"],
+            stdout=out,
+        )
+        output = out.getvalue()
+        self.assertIn("0.00% errors", output)
+        self.assertIn("handled all rates", output)
+        for endpoint in ["play", "server_info", "army_info", "board_info"]:
+            self.assertIn(endpoint, output)
+        self.assertIn("authorize_role_request", output)
+
+
+class TssClientTest(SimpleTestCase):
+    def setUp(self):
+        self.tss = self.enterContext(StandInTableServer())
+
+    def make_client(self, **kwargs):
+        return tss.TssClient(self.tss.url, **{"read_timeout": 0.5} | kwargs)
+
+    def test_internal_secret_is_sent(self):
+        with override_settings(
+            INTERNAL_TSS_URL=self.tss.url, TSS_INTERNAL_SECRET="secret"
+        ):
+            tss.get_client().provision_tables(1)
+        self.assertEqual(["secret"], self.tss.secrets)
+
+    def test_create_table(self):
+        client = self.make_client()
+        self.assertEqual(12, len(client.create_table(1)))
+        self.assertEqual(1, client.metrics.snapshot()["POST /tables/"]["requests"])
+
+    def test_read_timeout(self):
+        self.tss.respond(delay=1)
+        with self.assertRaises(tss.TssError):
+            self.make_client(read_timeout=0.1).create_table(1)
+
+    def test_idempotent_requests_are_retried(self):
+        self.tss.respond(status=503)
+        self.tss.respond(status=503)
+        self.tss.respond(payload={"stats": {}})
+        self.assertEqual({}, self.make_client().get_tables_stats(["table"]))
+        self.assertEqual(3, len(self.tss.requests))
+
+    def test_table_creation_is_not_retried(self):
+        self.tss.respond(status=503)
+        with self.assertRaises(tss.TssError):
+            self.make_client().create_table(1)
+        self.assertEqual(1, len(self.tss.requests))
+
+    def test_circuit_breaker(self):
+        client = self.make_client(circuit_failures=2, circuit_reset_timeout=60)
+        for _ in range(2):
+            self.tss.respond(status=500)
+            with self.assertRaises(tss.TssError):
+                client.create_table(1)
+        with self.assertRaises(tss.TssUnavailable):
+            client.create_table(1)
+        self.assertEqual(2, len(self.tss.requests))
+        self.assertEqual(1, client.metrics.snapshot()["POST /tables/"]["rejected"])
+
+    def test_circuit_breaker_closes_after_successful_trial(self):
+        client = self.make_client(circuit_failures=1, circuit_reset_timeout=0)
+        self.tss.respond(status=500)
+        with self.assertRaises(tss.TssError):
+            client.create_table(1)
+        self.assertTrue(client.breaker.is_open())
+        client.create_table(1)
+        self.assertFalse(client.breaker.is_open())
+
+    def test_client_errors_dont_open_circuit(self):
+        client = self.make_client(circuit_failures=1)
+        self.tss.respond(status=400)
+        with self.assertRaises(tss.TssError):
+            client.create_table(1)
+        self.assertFalse(client.breaker.is_open())
+
+
+class TableVisitsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.owner = create_user(username="owner", password="owner")
+        cls.table = Table.objects.create(name="test_table", owner=cls.owner)
+
+    def tearDown(self):
+        visits.pending.clear()
+        return super().tearDown()
+
+    @override_settings(TABLE_VISITS_FLUSH_INTERVAL=0)
+    def test_visits_are_counted(self):
+        self.client.login(username="owner", password="owner")
+        self.client.get(self.table.get_play_url())
+        self.client.get(self.table.get_play_url())
+        visit = TableVisit.objects.get()
+        self.assertEqual(2, visit.visit_count)
+        self.assertEqual([self.owner], list(self.table.visits.all()))
+
+    @override_settings(TABLE_VISITS_FLUSH_INTERVAL=3600)
+    def test_visits_are_buffered(self):
+        other = Table.objects.create(name="other", owner=self.owner)
+        visits.flush()
+        for table in [self.table, self.table, other]:
+            visits.record(self.owner, table)
+        self.assertFalse(TableVisit.objects.exists())
+        with self.assertNumQueries(7):
+            visits.flush()
+        self.assertEqual(
+            {self.table.pk: 2, other.pk: 1},
+            dict(TableVisit.objects.values_list("table", "visit_count")),
+        )
+        visits.record(self.owner, other)
+        visits.flush()
+        self.assertEqual(2, TableVisit.objects.get(table=other).visit_count)
+
+    @override_settings(TABLE_VISITS_FLUSH_INTERVAL=3600, TABLE_VISITS_BATCH_SIZE=1)
+    def test_visits_are_kept_when_they_cant_be_saved(self):
+        self.client.login(username="owner", password="owner")
+        error = DatabaseError("database is locked")
+        with mock.patch.object(TableVisit, "add_visits", side_effect=error):
+            with self.assertLogs("main.visits", "WARNING"):
+                response = self.client.get(self.table.get_play_url())
+        self.assertEqual(200, response.status_code)
+        self.client.get(self.table.get_play_url())
+        self.assertEqual(2, TableVisit.objects.get().visit_count)
+        self.assertFalse(visits.pending)
+
+    @override_settings(TABLE_VISITS_FLUSH_INTERVAL=0.5)
+    def test_visits_are_saved_without_further_requests(self):
+        saved = threading.Event()
+        with mock.patch.object(TableVisit, "add_visits", lambda v: saved.set()):
+            visits.flush()
+            visits.record(self.owner, self.table)
+            self.assertTrue(saved.wait(5))
+        self.assertFalse(visits.pending)
+
+    def test_anonymous_visits_are_ignored(self):
+        visits.record(AnonymousUser(), self.table)
+        self.assertFalse(visits.pending)
+
+    def test_visits_of_deleted_tables_are_dropped(self):
+        other = Table.objects.create(name="other", owner=self.owner)
+        visits.record(self.owner, self.table)
+        visits.record(self.owner, other)
+        other.delete()
+        visits.flush()
+        self.assertEqual(
+            [self.table.pk], [v.table_id for v in TableVisit.objects.all()]
+        )
+
+
 class ChairManagementTest(TestCase):
     @classmethod
     def setUpTestData(cls) -> None:
@@ -420,6 +1366,25 @@ class InvitationsCheckingTest(TestCase):
         cls.player2 = create_user(username="player2", password="player2")
         cls.invitation = cls.chair.namedinvitation_set.create(user=cls.player1)
 
+    def setUp(self):
+        cache.clear()
+        # otherwise the first request loads them and query counts differ
+        profiling.load_rules()
+
+    def authorizeRoleRequests(self, roleRequests):
+        return self.client.post(
+            "/authorizeRoleRequests/",
+            data=json.dumps(
+                {
+                    "requests": [
+                        {"tableId": self.table.pk, "roleRequest": roleRequest}
+                        for roleRequest in roleRequests
+                    ]
+                }
+            ),
+            content_type="application/json",
+        ).json()["results"]
+
     def authorizeRoleRequest(self, roleRequest):
         return self.client.post(
             f"/authorizeRoleRequest/",
@@ -461,6 +1426,452 @@ class InvitationsCheckingTest(TestCase):
         res = self.authorizeRoleRequest({"namedInvitation": self.invitation.pk})
         self.assertJSONEqual(res.content, {"result": False, "reason": "Unauthorized"})
 
+    def testBatchAuthorization(self):
+        self.chair.enable_link_invitation()
+        self.chair.save()
+        self.client.login(username="player1", password="player1")
+        roleRequests = [
+            {"role": "owner"},
+            {"namedInvitation": self.invitation.pk},
+            {"linkInvitation": self.chair.link_invitation},
+            {"namedInvitation": "missing"},
+            {},
+        ] * 3
+        # session, user and one query per kind of role request
+        with self.assertNumQueries(5):
+            results = self.authorizeRoleRequests(roleRequests)
+        self.assertEqual(
+            [
+                {"result": False, "reason": "Unauthorized"},
+                {"result": True, "role": "player"},
+                {"result": True, "role": "player"},
+                {"result": False, "reason": "Not found"},
+                {"result": False, "reason": "Unauthorized"},
+            ]
+            * 3,
+            results,
+        )
+        # decisions are cached
+        with self.assertNumQueries(2):
+            self.assertEqual(results, self.authorizeRoleRequests(roleRequests))
+
+    def testDecisionsCachedInProcessMemoryExpireSoon(self):
+        self.assertEqual(2, authorization.get_decision_timeout())
+        dummy = {"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}
+        with override_settings(CACHES=dummy):
+            self.assertEqual(30, authorization.get_decision_timeout())
+
+    def testDecisionsInvalidation(self):
+        self.client.login(username="player1", password="player1")
+        roleRequest = {"namedInvitation": self.invitation.pk}
+        self.assertTrue(self.authorizeRoleRequests([roleRequest])[0]["result"])
+        self.invitation.delete()
+        self.assertFalse(self.authorizeRoleRequests([roleRequest])[0]["result"])
+        self.assertFalse(self.authorizeRoleRequests([{"role": "owner"}])[0]["result"])
+        self.table.owner = self.player1
+        self.table.save()
+        self.assertTrue(self.authorizeRoleRequests([{"role": "owner"}])[0]["result"])
+
+    def testBatchRejectsMalformedRequests(self):
+        res = self.client.post(
+            "/authorizeRoleRequests/",
+            data=json.dumps({"requests": [{"tableId": self.table.pk}]}),
+            content_type="application/json",
+        )
+        self.assertEqual(res.status_code, HTTPStatus.BAD_REQUEST)
+
+    def get_play_role_request(self, url):
+        response = self.client.get(url)
+        return response.context["roleRequest"]
+
+    def testOwnerGetsTicket(self):
+        self.client.login(username="owner", password="owner")
+        role_request = self.get_play_role_request(self.table.get_play_url())
+        ticket = verify_ticket(role_request["ticket"], self.table.pk)
+        self.assertEqual("owner", ticket["role"])
+        self.assertEqual(self.owner.pk, ticket["user"])
+        # only session and user are loaded
+        with self.assertNumQueries(2):
+            res = self.authorizeRoleRequest(role_request)
+        self.assertJSONEqual(res.content, {"result": True, "role": "owner"})
+
+    def testTicketsOfOtherUsersAreIgnored(self):
+        self.client.login(username="owner", password="owner")
+        role_request = self.get_play_role_request(self.table.get_play_url())
+        self.client.logout()
+        res = self.authorizeRoleRequest(role_request)
+        self.assertEqual(res.status_code, HTTPStatus.UNAUTHORIZED)
+        self.client.login(username="player1", password="player1")
+        res = self.authorizeRoleRequest(role_request)
+        self.assertEqual(res.status_code, HTTPStatus.UNAUTHORIZED)
+
+    def testNamedInvitationTicket(self):
+        self.client.login(username="player1", password="player1")
+        role_request = self.get_play_role_request(
+            reverse("main:named_invitation_play", args=[self.invitation.pk])
+        )
+        self.assertEqual(self.invitation.pk, role_request["namedInvitation"])
+        ticket = verify_ticket(role_request["ticket"], self.table.pk)
+        self.assertEqual("player", ticket["role"])
+
+    def testRejectingInvalidTickets(self):
+        ticket = make_ticket(self.table.pk, "owner", self.player1)
+        self.assertIsNone(verify_ticket(ticket, "other"))
+        self.assertIsNone(verify_ticket(ticket[:-2], self.table.pk))
+        self.assertIsNone(verify_ticket("garbage", self.table.pk))
+        self.assertIsNone(verify_ticket(None, self.table.pk))
+        with override_settings(ROLE_TICKET_TTL=-1):
+            expired = make_ticket(self.table.pk, "owner", self.owner)
+        self.assertIsNone(verify_ticket(expired, self.table.pk))
+        with override_settings(ROLE_TICKET_SECRET="other"):
+            self.assertIsNone(verify_ticket(ticket, self.table.pk))
+
+
+@override_settings(ROOT_URLCONF="nhex.asgi_urls")
+class AsyncInvitationsCheckingTest(InvitationsCheckingTest):
+    # the same checks against async views served under ASGI
+    pass
+
+
+class AsyncViewsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.owner = create_user(username="owner", password="owner")
+        cls.table = Table.objects.create(name="table", owner=cls.owner)
+        cls.table.chair_set.create(name="Players", arity=2, kind="p")
+        cls.board = Board.objects.create(name="board", image="board.png", info={})
+
+    def test_asgi_urls_use_async_views(self):
+        for path, view in [
+            (f"/tables/{self.table.pk}/info/", async_views.table_info),
+            ("/serverInfo/", async_views.server_info),
+            ("/authorizeRoleRequests/", async_views.authorize_role_requests_batch),
+        ]:
+            match = resolve(path, "nhex.asgi_urls")
+            self.assertIs(view, match.func)
+            # labeled the same way in metrics and profiling rules
+            self.assertEqual(resolve(path).view_name, match.view_name)
+        self.assertIs(views.tables, resolve("/tables/", "nhex.asgi_urls").func)
+
+    @override_settings(ROOT_URLCONF="nhex.asgi_urls")
+    async def test_async_views_match_sync_ones(self):
+        for path in [
+            f"/tables/{self.table.pk}/info/",
+            f"/boards/{self.board.pk}/info/",
+            "/serverInfo/",
+        ]:
+            response = await self.async_client.get(path)
+            self.assertEqual(200, response.status_code)
+            with self.settings(ROOT_URLCONF="nhex.urls"):
+                expected = await sync_to_async(self.client.get)(path)
+            self.assertEqual(expected.json(), response.json())
+
+    @override_settings(ROOT_URLCONF="nhex.asgi_urls")
+    async def test_async_views_reject_wrong_method(self):
+        response = await self.async_client.post(f"/tables/{self.table.pk}/info/")
+        self.assertEqual(HTTPStatus.METHOD_NOT_ALLOWED, response.status_code)
+
+
+@override_settings(MEDIA_ROOT=(TEST_DIR + "/media"), TABLE_VISITS_FLUSH_INTERVAL=3600)
+class QueryBudgetTest(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.owner = get_user_model().objects.create_superuser(
+            username="owner", password="owner"
+        )
+        users = [create_user(username=f"user{i}", password="user") for i in range(30)]
+        for i, user in enumerate(users):
+            cls.table = Table.objects.create(name=f"table{i}", owner=cls.owner)
+            for kind in ["p", "s"]:
+                chair = Chair.objects.create(
+                    table=cls.table, kind=kind, enable_link_invitation=True
+                )
+                NamedInvitation.objects.bulk_create(
+                    NamedInvitation(chair=chair, user=u) for u in users[:10]
+                )
+            # invitations of the owner to tables of other users
+            other = Table.objects.create(name=f"other{i}", owner=user)
+            chair = Chair.objects.create(table=other, kind="p")
+            NamedInvitation.objects.create(chair=chair, user=cls.owner)
+            TableVisit.objects.create(user=user, table=cls.table)
+            army = Army.objects.create(name=f"army{i}", owner=cls.owner)
+            PublicationRequest.objects.create(source_army=army)
+        # the army shown on army pages has many tokens of many resources
+        cls.army = army
+        colors = ["red", "green", "blue", "white", "black", "yellow"]
+        images = [
+            army.resource_set.create(name=color, file=make_png(8, 8, color))
+            for color in colors
+        ]
+        for i, front_image in enumerate(images):
+            for back_image in images[i - 2 : i] or images[-2:]:
+                cls.token = army.token_set.create(
+                    name=f"{front_image.name} {back_image.name}",
+                    front_image=front_image,
+                    back_image=back_image,
+                )
+        cls.pub_req = PublicationRequest.objects.create(source_army=army)
+        cls.board = Board.objects.create(name="board", image="board.png", info={})
+        cls.chair = cls.table.chair_set.first()
+        cls.invitation = cls.chair.namedinvitation_set.first()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TEST_DIR, ignore_errors=True)
+        return super().tearDownClass()
+
+    def setUp(self):
+        self.tss = self.enterContext(StandInTableServer())
+        self.enterContext(override_settings(INTERNAL_TSS_URL=self.tss.url))
+        self.client.login(username="owner", password="owner")
+
+    def test_views_stay_within_budget(self):
+        for path, budget in [
+            (reverse("main:tables"), 10),
+            (reverse("main:table_details", args=[self.table.pk]), 9),
+            (reverse("main:chairs", args=[self.table.pk]), 6),
+            (reverse("main:invitations", args=[self.table.pk]), 9),
+            (reverse("main:armies"), 5),
+            (reverse("main:pub_reqs"), 4),
+            (reverse("main:server_info"), 7),
+            ("/admin/main/table/", 7),
+            (f"/admin/main/table/{self.table.pk}/change/", 10),
+            (reverse("main:play", args=[self.table.pk]), 4),
+            (reverse("main:table_info", args=[self.table.pk]), 2),
+            (reverse("main:link_invitation", args=[self.chair.link_invitation]), 4),
+            (
+                reverse("main:link_invitation_play", args=[self.chair.link_invitation]),
+                3,
+            ),
+            (reverse("main:named_invitation", args=[self.invitation.pk]), 6),
+            (reverse("main:named_invitation_play", args=[self.invitation.pk]), 5),
+            (reverse("main:army_details", args=[self.army.pk]), 6),
+            (reverse("main:tokens", args=[self.army.pk]), 7),
+            (reverse("main:token_details", args=[self.token.pk]), 6),
+            (reverse("main:resources", args=[self.army.pk]), 8),
+            (reverse("main:army_info", args=[self.army.pk]), 10),
+            (reverse("main:pub_req_details", args=[self.pub_req.pk]), 6),
+            (reverse("main:board_info", args=[self.board.pk]), 1),
+        ]:
+            with self.subTest(path=path), self.assertQueryBudget(budget):
+                self.assertEqual(200, self.client.get(path).status_code)
+
+    def test_query_count_header(self):
+        with querycount.record_queries() as log:
+            response = self.client.get(reverse("main:tables"))
+        self.assertEqual(str(len(log)), response["X-Query-Count"])
+
+    def test_repeated_queries_are_reported(self):
+        path = reverse("main:table_details", args=[self.table.pk])
+        # invited users loaded one by one
+        chairs = lambda table: table.chair_set.filter(namedinvitation__isnull=False)
+        with mock.patch.object(Table, "get_chairs_with_existing_invitations", chairs):
+            with self.assertLogs("main.querycount", "WARNING") as logs:
+                self.client.get(path)
+            with self.assertRaises(AssertionError), self.assertQueryBudget(100):
+                self.client.get(path)
+        self.assertIn(path, logs.output[0])
+
+    def test_query_shape(self):
+        self.assertEqual(
+            querycount.get_shape("SELECT a FROM t WHERE b IN (%s, %s) LIMIT 21"),
+            querycount.get_shape("SELECT a FROM t WHERE b IN (%s) LIMIT 2"),
+        )
+
+
+class MetricsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = get_user_model().objects.create_user(
+            username="staff", password="staff", is_staff=True
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def get_samples(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse("main:metrics"))
+        self.client.logout()
+        self.assertEqual(200, response.status_code)
+        samples = {}
+        for line in response.content.decode().splitlines():
+            if not line.startswith("#"):
+                name, value = line.rsplit(" ", 1)
+                samples[name] = float(value)
+        return samples
+
+    def get_increase(self, before, name):
+        return self.get_samples().get(name, 0) - before.get(name, 0)
+
+    def test_request_metrics(self):
+        before = self.get_samples()
+        for _ in range(3):
+            self.client.get(reverse("main:server_info"))
+        view = 'view="main:server_info"'
+        for name, increase in [
+            (f'nhex_http_requests_total{{{view},method="GET",status="200"}}', 3),
+            (f"nhex_http_request_duration_seconds_count{{{view}}}", 3),
+            (f'nhex_http_request_duration_seconds_bucket{{{view},le="+Inf"}}', 3),
+            (f'nhex_http_request_queries_bucket{{{view},le="100"}}', 3),
+            (f"nhex_http_response_size_bytes_count{{{view}}}", 3),
+            ('nhex_cache_lookups_total{cache="server_info",result="hit"}', 2),
+        ]:
+            with self.subTest(name=name):
+                self.assertEqual(increase, self.get_increase(before, name))
+
+    def test_access(self):
+        self.assertEqual(403, self.client.get(reverse("main:metrics")).status_code)
+        with override_settings(METRICS_ALLOWED_IPS=["127.0.0.1"]):
+            self.assertEqual(200, self.client.get(reverse("main:metrics")).status_code)
+        self.get_samples()
+
+    def test_tss_metrics(self):
+        self.assertEqual(
+            "POST /tables/{id}/board/",
+            tss.get_endpoint("POST", "/tables/abc/board/"),
+        )
+        self.assertEqual(
+            "POST /tables/stats/", tss.get_endpoint("POST", "/tables/stats/")
+        )
+        before = self.get_samples()
+        with StandInTableServer() as server:
+            tss.TssClient(server.url).set_initial_board("abc", 1)
+        name = (
+            'nhex_tss_requests_total{endpoint="POST /tables/{id}/board/",outcome="ok"}'
+        )
+        self.assertEqual(1, self.get_increase(before, name))
+
+    def test_metrics_of_processes_are_summed(self):
+        directory = f"{TEST_DIR}/metrics"
+        self.addCleanup(shutil.rmtree, TEST_DIR, ignore_errors=True)
+        os.makedirs(directory)
+        with open(f"{directory}/1-other.json", "w") as file:
+            json.dump(
+                [
+                    ["nhex_uploaded_bytes_total", ["resource"], 100],
+                    ["nhex_http_request_queries", ["main:tables"], [1] + [0] * 9],
+                ],
+                file,
+            )
+        with override_settings(METRICS_DIR=directory):
+            before = self.get_samples()
+            metrics.uploaded_bytes.inc(10, kind="resource")
+            metrics.http_request_queries.observe(1, view="main:tables")
+            after = self.get_samples()
+            self.assertTrue(os.path.exists(f"{directory}/{metrics.process_file}"))
+        name = 'nhex_uploaded_bytes_total{kind="resource"}'
+        self.assertEqual(10, after[name] - before[name])
+        self.assertLessEqual(100, after[name])
+        name = 'nhex_http_request_queries_count{view="main:tables"}'
+        self.assertEqual(1, after[name] - before[name])
+        self.assertLessEqual(2, after[name])
+
+
+@override_settings(PROFILING_DIR=f"{TEST_DIR}/profiles")
+class ProfilingTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = get_user_model().objects.create_user(
+            username="staff", password="staff", is_staff=True
+        )
+
+    def setUp(self):
+        self.addCleanup(shutil.rmtree, TEST_DIR, ignore_errors=True)
+        # rules created by tests are rolled back
+        self.addCleanup(cache.delete, profiling.RULES_KEY)
+
+    def test_sampled_requests_are_profiled(self):
+        ProfilingRule.objects.create(url_name="main:server_info", sample_rate=1)
+        content = views.get_server_info_content
+
+        def slow_content(*args):
+            # long enough for stacks to be sampled
+            time.sleep(0.05)
+            return content(*args)
+
+        with mock.patch.object(views, "get_server_info_content", slow_content):
+            self.client.get(reverse("main:server_info"))
+        self.client.get(reverse("main:index"))
+        [capture] = profiling.get_captures()
+        self.assertEqual("main:server_info", capture["view"])
+        self.assertEqual("sample", capture["trigger"])
+        self.assertEqual(
+            capture["queries"], sum(s["count"] for s in capture["query_breakdown"])
+        )
+        path = profiling.get_capture_file(capture["id"] + ".prof")
+        self.assertTrue(pstats.Stats(str(path)).total_calls)
+        stacks = profiling.get_capture_file(capture["id"] + ".folded").read_text()
+        self.assertRegex(stacks, r"server_info \(.*;slow_content \(.* \d+\n")
+
+    def test_inactive_rules(self):
+        ProfilingRule.objects.create(url_name="main:index", sample_rate=0)
+        ProfilingRule.objects.create(
+            url_name="main:server_info", sample_rate=1, enabled=False
+        )
+        ProfilingRule.objects.create(
+            url_name="main:tables",
+            sample_rate=1,
+            expires_at=timezone.now() - timedelta(minutes=1),
+        )
+        for name in ["main:index", "main:server_info", "main:tables"]:
+            self.client.get(reverse(name))
+        self.assertEqual([], profiling.get_captures())
+
+    def test_signed_header(self):
+        header = profiling.get_header_value()
+        self.client.get(reverse("main:index"), headers={"X-Profile": header + "x"})
+        self.assertEqual([], profiling.get_captures())
+        self.client.get(reverse("main:index"), headers={"X-Profile": header})
+        [capture] = profiling.get_captures()
+        self.assertEqual("header", capture["trigger"])
+
+    def test_rules_are_loaded_when_missing_in_cache(self):
+        ProfilingRule.objects.create(url_name="main:server_info", sample_rate=1)
+        cache.delete(profiling.RULES_KEY)
+        self.client.get(reverse("main:server_info"))
+        self.assertEqual(1, len(profiling.get_captures()))
+        self.assertIn("main:server_info", cache.get(profiling.RULES_KEY))
+
+    @override_settings(ROOT_URLCONF="nhex.asgi_urls")
+    async def test_rules_are_loaded_when_missing_in_cache_by_async_requests(self):
+        await ProfilingRule.objects.acreate(url_name="main:server_info", sample_rate=1)
+        await cache.adelete(profiling.RULES_KEY)
+        await self.async_client.get("/serverInfo/")
+        [capture] = profiling.get_captures()
+        self.assertEqual("main:server_info", capture["view"])
+
+    def test_no_rules_are_cached(self):
+        cache.delete(profiling.RULES_KEY)
+        self.client.get(reverse("main:server_info"))
+        with self.assertNumQueries(0):
+            self.client.get(reverse("main:server_info"))
+
+    @override_settings(PROFILING_MAX_CAPTURES=2)
+    def test_rotation(self):
+        ProfilingRule.objects.create(url_name="main:server_info", sample_rate=1)
+        for _ in range(3):
+            self.client.get(reverse("main:server_info"))
+        self.assertEqual(6, len(os.listdir(settings.PROFILING_DIR)))
+
+    def test_profiles_page(self):
+        ProfilingRule.objects.create(url_name="main:server_info", sample_rate=1)
+        self.client.get(reverse("main:server_info"))
+        [capture] = profiling.get_captures()
+        url = reverse("main:profile_file", args=[capture["id"] + ".prof"])
+        self.assertEqual(f"/profiles/{capture['id']}.prof/", url)
+        self.assertEqual(302, self.client.get(reverse("main:profiles")).status_code)
+        self.assertEqual(302, self.client.get(url).status_code)
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse("main:profiles"))
+        self.assertContains(response, capture["path"])
+        self.assertContains(response, url)
+        self.assertEqual(200, self.client.get(url).status_code)
+        url = reverse("main:profile_file", args=["missing.prof"])
+        self.assertEqual(404, self.client.get(url).status_code)
+
 
 class ArmiesTest(TestCase):
     @classmethod
@@ -576,6 +1987,53 @@ class ArmiesTest(TestCase):
         self.assertEqual(1, len(responseJson["res"]["armies"]))
 
 
+class ServerInfoCaching(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.owner = create_user(username="owner", password="owner")
+
+    def setUp(self):
+        cache.clear()
+
+    def test_server_info_has_etag(self):
+        response = self.client.get("/serverInfo/")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header("ETag"))
+
+    def test_matching_etag_returns_not_modified(self):
+        etag = self.client.get("/serverInfo/")["ETag"]
+        response = self.client.get("/serverInfo/", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+
+    def test_anonymous_server_info_is_served_from_cache(self):
+        self.client.get("/serverInfo/")
+        with self.assertNumQueries(0):
+            self.client.get("/serverInfo/")
+
+    def test_army_change_invalidates_cache(self):
+        etag = self.client.get("/serverInfo/")["ETag"]
+        Army.objects.create(name="public", owner=self.owner, private=False)
+        response = self.client.get("/serverInfo/", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(1, len(response.json()["res"]["armies"]))
+
+    def test_private_armies_are_merged_in_order(self):
+        Army.objects.create(name="a", owner=self.owner, private=False)
+        Army.objects.create(name="b", owner=self.owner)
+        Army.objects.create(name="c", owner=self.owner, private=False)
+        self.client.login(username="owner", password="owner")
+        response = self.client.get("/serverInfo/")
+        names = [army["name"] for army in response.json()["res"]["armies"]]
+        self.assertEqual(["a", "b", "c"], names)
+
+
+@override_settings(ROOT_URLCONF="nhex.asgi_urls")
+class AsyncServerInfoCaching(ServerInfoCaching):
+    # the same checks against async views served under ASGI
+    pass
+
+
 class ArmiesTest2(TransactionTestCase):
     def setUp(cls):
         super().setUp()
@@ -730,3 +2188,198 @@ class TokensTest(TestCase):
         response = self.client.get(f"/armies/{self.army.pk}/tokens/")
         self.assertEqual(response.status_code, 200)
         self.assertNotContains(response, "Missing resources info")
+
+
+@override_settings(MEDIA_ROOT=(TEST_DIR + "/media"))
+class ArmyInfoCaching(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.owner = create_user(username="owner", password="owner")
+        cls.army = Army.objects.create(name="test", owner=cls.owner)
+        dummy_file = SimpleUploadedFile("dummy.txt", b"dummy content")
+        cls.resource = cls.army.resource_set.create(name="img1", file=dummy_file)
+        dummy_file.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TEST_DIR, ignore_errors=True)
+        return super().tearDownClass()
+
+    def add_token(self, name="test"):
+        return self.army.token_set.create(
+            name=name, front_image=self.resource, back_image=self.resource
+        )
+
+    def test_army_info_is_served_from_stored_blob(self):
+        self.add_token()
+        self.client.get(f"/armies/{self.army.pk}/info/")
+        with self.assertNumQueries(1):
+            response = self.client.get(f"/armies/{self.army.pk}/info/")
+        self.assertEqual(1, len(response.json()["tokens"]))
+
+    def test_matching_etag_returns_not_modified(self):
+        etag = self.client.get(f"/armies/{self.army.pk}/info/")["ETag"]
+        response = self.client.get(
+            f"/armies/{self.army.pk}/info/", headers={"If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+
+    def test_token_changes_rebuild_army_info(self):
+        self.client.get(f"/armies/{self.army.pk}/info/")
+        token = self.add_token()
+        response = self.client.get(f"/armies/{self.army.pk}/info/")
+        self.assertEqual(1, len(response.json()["tokens"]))
+        token.name = "renamed"
+        token.save()
+        response = self.client.get(f"/armies/{self.army.pk}/info/")
+        self.assertEqual("renamed", response.json()["tokens"][0]["name"])
+        token.delete()
+        response = self.client.get(f"/armies/{self.army.pk}/info/")
+        self.assertEqual(0, len(response.json()["tokens"]))
+
+    def test_missing_army_info(self):
+        response = self.client.get("/armies/missing/info/")
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    def test_army_info_images_are_fingerprinted(self):
+        self.add_token()
+        token = self.client.get(f"/armies/{self.army.pk}/info/").json()["tokens"][0]
+        self.assertEqual(f"dummy.txt?v={self.resource.digest[:12]}", token["img"])
+
+    def test_fingerprinted_media_is_immutable(self):
+        # media urls are registered only in DEBUG mode, so view is called directly
+        path, root = self.resource.file.name, settings.MEDIA_ROOT
+        request = RequestFactory().get(f"/media/{path}?v={self.resource.digest[:12]}")
+        response = serve_media(request, path, document_root=root)
+        self.assertIn("immutable", response["Cache-Control"])
+        response = serve_media(RequestFactory().get(f"/media/{path}"), path, root)
+        self.assertFalse(response.has_header("Cache-Control"))
+
+
+@override_settings(MEDIA_ROOT=(TEST_DIR + "/media"))
+class ImportArmyTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.owner = create_user(username="owner", password="owner")
+
+    def tearDown(self):
+        shutil.rmtree(TEST_DIR, ignore_errors=True)
+        return super().tearDown()
+
+    def make_zip(self, name, info, files):
+        os.makedirs(TEST_DIR, exist_ok=True)
+        zip_path = f"{TEST_DIR}/{name}.zip"
+        with zipfile.ZipFile(zip_path, "w") as archive:
+            archive.writestr("info.json", json.dumps(info))
+            for file_name, content in files.items():
+                archive.writestr(file_name, content)
+        return zip_path
+
+    def make_army_zip(self, name):
+        info = {
+            "name": name,
+            "defBackImg": "back.png",
+            "tokens": [{"name": "unit", "img": "unit.png", "q": 2}],
+            "bases": [{"name": "hq", "img": "hq.png", "q": 1}],
+            "markers": [{"name": "marker", "img": "unit.png", "q": 3}],
+        }
+        files = {"back.png": b"back", "unit.png": b"unit", "hq.png": b"hq"}
+        return self.make_zip(name, info, files)
+
+    def test_import_army(self):
+        out = StringIO()
+        call_command("import_army", "owner", self.make_army_zip("army1"), stdout=out)
+        army = Army.objects.get(name="army1")
+        self.assertEqual(3, army.resource_set.count())
+        self.assertEqual(3, army.token_set.count())
+        self.assertEqual(UserDiskQuota.objects.get(user=self.owner).used, 10)
+        info = army.get_info()
+        self.assertRegex(info["tokens"][0]["backImg"], r"^back\.png\?v=\w{12}$")
+        self.assertRegex(info["markers"][0]["backImg"], r"^unit\.png\?v=\w{12}$")
+        self.assertIn("Imported 1 army(ies)", out.getvalue())
+
+    def test_import_strips_fingerprints(self):
+        info = {
+            "name": "exported",
+            "tokens": [
+                {"name": "u", "img": "u.png?v=0123456789ab", "backImg": "b.png", "q": 1}
+            ],
+        }
+        zip_path = self.make_zip("exported", info, {"u.png": b"u", "b.png": b"b"})
+        call_command("import_army", "owner", zip_path, stdout=StringIO())
+        army = Army.objects.get(name="exported")
+        self.assertEqual(
+            {"u.png", "b.png"}, set(army.resource_set.values_list("name", flat=True))
+        )
+
+    def test_parallel_import(self):
+        zips = [self.make_army_zip(f"army{i}") for i in range(3)]
+        call_command("import_army", "owner", *zips, "--jobs", "2", stdout=StringIO())
+        self.assertEqual(3, Army.objects.count())
+        self.assertEqual(9, Token.objects.count())
+        for res in Resource.objects.all():
+            self.assertTrue(res.is_valid())
+
+    def test_missing_resource_fails_import(self):
+        info = {"name": "broken", "tokens": [{"name": "u", "img": "u.png", "q": 1}]}
+        zip_path = self.make_zip("broken", info, {})
+        with self.assertRaises(CommandError):
+            call_command(
+                "import_army", "owner", zip_path, stdout=StringIO(), stderr=StringIO()
+            )
+        self.assertFalse(Army.objects.exists())
+
+
+@override_settings(MEDIA_ROOT=(TEST_DIR + "/media"))
+class IncrementalExportTest(TransactionTestCase):
+    EXPORT_DIR = TEST_DIR + "/export"
+
+    def setUp(self):
+        self.owner = create_user(username="owner", password="owner")
+        self.army = Army.objects.create(name="test", owner=self.owner, private=False)
+        self.resource = self.army.resource_set.create(
+            name="img", file=SimpleUploadedFile("img.png", b"img")
+        )
+
+    def tearDown(self):
+        shutil.rmtree(TEST_DIR, ignore_errors=True)
+        return super().tearDown()
+
+    def export(self, *args):
+        out = StringIO()
+        call_command("export_army", "*", self.EXPORT_DIR, *args, stdout=out)
+        return out.getvalue()
+
+    def test_unchanged_files_are_skipped(self):
+        self.assertIn("2 file(s) written, 0 skipped, 0 deleted", self.export("-i"))
+        self.assertIn("0 file(s) written, 2 skipped, 0 deleted", self.export("-i"))
+
+    def test_full_export_rewrites_files(self):
+        self.export("-i")
+        self.assertIn("2 file(s) written, 0 skipped", self.export())
+
+    def test_stale_files_are_removed(self):
+        self.export("-i")
+        exported = f"{self.EXPORT_DIR}/{self.army.pk}/img.png"
+        self.assertTrue(os.path.exists(exported))
+        self.resource.delete()
+        self.assertIn("0 file(s) written, 1 skipped, 1 deleted", self.export("-i"))
+        self.assertFalse(os.path.exists(exported))
+
+    def test_exported_info_references_exported_images(self):
+        res = self.army.resource_set.create(name="png", file=make_png())
+        self.army.token_set.create(name="token", front_image=res, back_image=res)
+        self.export()
+        army_dir = f"{self.EXPORT_DIR}/{self.army.pk}"
+        with open(f"{army_dir}/info.json") as file:
+            [token] = json.load(file)["tokens"]
+        self.assertTrue(token["img"].startswith("atlas-"))
+        for image in [token["img"], token["backImg"]]:
+            self.assertTrue(os.path.exists(f"{army_dir}/{image.split('?')[0]}"))
+
+    def test_hardlinked_media(self):
+        self.export("-i", "--link", "hardlink")
+        exported = f"{self.EXPORT_DIR}/{self.army.pk}/img.png"
+        self.assertTrue(os.path.samefile(exported, self.resource.file.path))
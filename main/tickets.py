@@ -0,0 +1,62 @@
+import base64
+import hashlib
+import hmac
+import json
+import time
+from django.conf import settings
+
+# Role ticket is "<payload>.<signature>" where payload is base64url encoded JSON
+# object {"table", "role", "user", "exp"} and signature is base64url encoded
+# HMAC-SHA256 of the encoded payload keyed with ROLE_TICKET_SECRET. Table server
+# verifies tickets on its own (see tss/src/roleTicket.js).
+
+
+def b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def b64decode(data):
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def sign(payload):
+    key = settings.ROLE_TICKET_SECRET.encode()
+    return b64encode(hmac.new(key, payload.encode(), hashlib.sha256).digest())
+
+
+def make_ticket(table_id, role, user):
+    data = {
+        "table": table_id,
+        "role": role,
+        "user": user.pk if user.is_authenticated else None,
+        "exp": int(time.time()) + settings.ROLE_TICKET_TTL,
+    }
+    payload = b64encode(json.dumps(data, separators=(",", ":")).encode())
+    return f"{payload}.{sign(payload)}"
+
+
+def verify_ticket(ticket, table_id):
+    # Returns ticket data or None if it is malformed, forged, expired or issued
+    # for a different table.
+    try:
+        payload, signature = ticket.split(".")
+        if not hmac.compare_digest(sign(payload), signature):
+            return None
+        data = json.loads(b64decode(payload))
+    except (AttributeError, TypeError, ValueError):
+        return None
+    if not isinstance(data, dict) or data.get("table") != table_id:
+        return None
+    if not isinstance(data.get("exp"), int) or data["exp"] < time.time():
+        return None
+    return data
+
+
+def get_role_request(table, role, user, **kwargs):
+    # Role request passed by the client to the table server. Ticket is omitted
+    # when user isn't allowed to take the role, so the table server asks main
+    # server instead.
+    role_request = {"role": role, **kwargs}
+    if role != "owner" or table.has_write_permission(user):
+        role_request["ticket"] = make_ticket(table.pk, role, user)
+    return role_request
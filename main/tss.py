@@ -0,0 +1,214 @@
+import logging
+import re
+import threading
+import time
+import requests
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+from . import metrics, shards
+
+# All communication of the main server with the table sync server goes through
+# TssClient. It reuses keep-alive connections, bounds every request with connect and
+# read timeouts, retries failed connections (and, for idempotent requests, 502/503/504
+# responses) and stops calling the table server for TSS_CIRCUIT_RESET_TIMEOUT seconds
+# after TSS_CIRCUIT_FAILURES consecutive failures, so a table server which is down
+# or overloaded can't tie up web workers.
+logger = logging.getLogger(__name__)
+
+
+class TssError(Exception):
+    pass
+
+
+class TssUnavailable(TssError):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, failures, reset_timeout):
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.failed = 0
+        self.opened_at = None
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            # half open, let single request through to check if server is back
+            self.opened_at = time.monotonic()
+            return True
+
+    def is_open(self):
+        with self.lock:
+            return self.opened_at is not None
+
+    def record_success(self):
+        with self.lock:
+            self.failed = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failed += 1
+            if self.failed >= self.failures and self.opened_at is None:
+                logger.warning(
+                    "Table server failed %d times in a row, pausing requests for %ss.",
+                    self.failed,
+                    self.reset_timeout,
+                )
+                self.opened_at = time.monotonic()
+            elif self.opened_at is not None:
+                self.opened_at = time.monotonic()
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+
+    def record(self, endpoint, elapsed, outcome):
+        with self.lock:
+            stats = self.endpoints.setdefault(
+                endpoint,
+                {"requests": 0, "failures": 0, "rejected": 0, "time": 0.0, "max": 0.0},
+            )
+            stats["requests"] += 1
+            if outcome != "ok":
+                stats[outcome] += 1
+            stats["time"] += elapsed
+            stats["max"] = max(stats["max"], elapsed)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                endpoint: stats
+                | {"avg": stats["time"] / stats["requests"] if stats["requests"] else 0}
+                for endpoint, stats in self.endpoints.items()
+            }
+
+
+def get_endpoint(method, path):
+    # ids of tables are replaced, so endpoints can be used as metric labels
+    path = re.sub(r"^/tables/(?!batch/|stats/)[^/]+/", "/tables/{id}/", path)
+    return f"{method} {path}"
+
+
+def make_adapter(pool_size, retries, allowed_methods):
+    # 502/503/504 responses are retried only for given methods
+    return HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=pool_size,
+        max_retries=Retry(
+            total=retries,
+            allowed_methods=allowed_methods,
+            status_forcelist=(502, 503, 504),
+            backoff_factor=0.1,
+            raise_on_status=False,
+        ),
+    )
+
+
+class TssClient:
+    IDEMPOTENT_PATHS = ("/tables/batch/", "/tables/stats/")
+
+    def __init__(
+        self,
+        url,
+        connect_timeout=1,
+        read_timeout=5,
+        retries=2,
+        pool_size=10,
+        circuit_failures=5,
+        circuit_reset_timeout=30,
+        secret=None,
+    ):
+        self.url = url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        if secret:
+            # endpoints table server serves only to main server require it
+            self.session.headers["X-Internal-Secret"] = secret
+        adapter = make_adapter(pool_size, retries, Retry.DEFAULT_ALLOWED_METHODS)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # repeating these POSTs is harmless, unlike creating a table twice
+        adapter = make_adapter(pool_size, retries, {"POST"})
+        for path in self.IDEMPOTENT_PATHS:
+            self.session.mount(self.url + path, adapter)
+        self.breaker = CircuitBreaker(circuit_failures, circuit_reset_timeout)
+        self.metrics = Metrics()
+
+    def request(self, method, path, **kwargs):
+        endpoint = get_endpoint(method, path)
+        if not self.breaker.allow():
+            self.record(endpoint, 0.0, "rejected")
+            raise TssUnavailable("Table server is unavailable.")
+        start = time.perf_counter()
+        try:
+            response = self.session.request(
+                method, self.url + path, timeout=self.timeout, **kwargs
+            )
+            response.raise_for_status()
+            data = response.json()
+        except (requests.RequestException, ValueError) as e:
+            self.record(endpoint, time.perf_counter() - start, "failures")
+            # 4xx means the request was wrong, not that the server is unhealthy
+            if not (isinstance(e, requests.HTTPError) and e.response.status_code < 500):
+                self.breaker.record_failure()
+            raise TssError(f"{method} {path} failed: {e}") from e
+        self.record(endpoint, time.perf_counter() - start, "ok")
+        self.breaker.record_success()
+        return data
+
+    def record(self, endpoint, elapsed, outcome):
+        self.metrics.record(endpoint, elapsed, outcome)
+        metrics.tss_requests.inc(endpoint=endpoint, outcome=outcome)
+        if outcome != "rejected":
+            metrics.tss_request_duration.observe(elapsed, endpoint=endpoint)
+
+    def create_table(self, board_id):
+        return self.request("POST", "/tables/", data={"board": board_id})["tableId"]
+
+    def provision_tables(self, count):
+        return self.request("POST", "/tables/batch/", data={"count": count})["tableIds"]
+
+    def set_initial_board(self, table_id, board_id):
+        self.request("POST", f"/tables/{table_id}/board/", data={"board": board_id})
+
+    def get_tables_stats(self, table_ids):
+        return self.request("POST", "/tables/stats/", data={"ids": table_ids})["stats"]
+
+
+clients = {}
+clients_lock = threading.Lock()
+
+
+def get_client(shard=shards.DEFAULT_SHARD):
+    # every shard has its own connection pool and circuit breaker
+    with clients_lock:
+        if shard not in clients:
+            clients[shard] = TssClient(
+                shards.get_shard(shard)["internal_url"],
+                connect_timeout=settings.TSS_CONNECT_TIMEOUT,
+                read_timeout=settings.TSS_READ_TIMEOUT,
+                retries=settings.TSS_RETRIES,
+                pool_size=settings.TSS_POOL_SIZE,
+                circuit_failures=settings.TSS_CIRCUIT_FAILURES,
+                circuit_reset_timeout=settings.TSS_CIRCUIT_RESET_TIMEOUT,
+                secret=settings.TSS_INTERNAL_SECRET,
+            )
+        return clients[shard]
+
+
+@receiver(setting_changed)
+def reset_clients(setting, **kwargs):
+    if setting == "INTERNAL_TSS_URL" or setting.startswith("TSS_"):
+        with clients_lock:
+            clients.clear()
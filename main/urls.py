@@ -40,6 +40,9 @@ urlpatterns = [
     path("tokens/<slug:pk>/delete/", views.tokenDelete, name="token_delete"),
     path("resModal/<slug:pk>/", views.ResModal.as_view(), name="resModal"),
     path("serverInfo/", views.server_info, name="server_info"),
+    path("metrics/", views.export_metrics, name="metrics"),
+    path("profiles/", views.profiles, name="profiles"),
+    path("profiles/<str:name>/", views.profile_file, name="profile_file"),
     path(
         "invitations/<slug:pk>/delete/",
         views.invitation_delete,
@@ -62,4 +65,9 @@ urlpatterns = [
         views.authorize_role_request,
         name="authorize_role_request",
     ),
+    path(
+        "authorizeRoleRequests/",
+        views.authorize_role_requests_batch,
+        name="authorize_role_requests",
+    ),
 ]
@@ -2,28 +2,42 @@ import functools
 import json
 from pathlib import Path
 from random import choice
+from asgiref.sync import iscoroutinefunction
 from django import forms
 from django.conf import settings
 from django.db.models.query import QuerySet
 from django.forms import modelform_factory
-from django.http import HttpRequest, HttpResponse, HttpResponseRedirect, JsonResponse
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpRequest,
+    HttpResponse,
+    HttpResponseForbidden,
+    HttpResponseRedirect,
+    JsonResponse,
+)
 from django.shortcuts import get_object_or_404, render
 from django.views.generic import CreateView, UpdateView
 from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
+from django.views.static import serve
 from django.core.paginator import Paginator
-import requests
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
+from nanoid import generate
 
 from .models import (
     Board,
     Chair,
-    Emote,
-    Link,
     NamedInvitation,
     PublicationRequest,
     Table,
     Resource,
     Army,
+    ArmyInfo,
     Token,
 )
 from .forms import (
@@ -35,6 +49,11 @@ from .forms import (
     AddArmyForm,
     CreatePubReq,
 )
+from .server_info import get_server_info_content
+from .images import normalize_upload
+from .authorization import NOT_FOUND, authorize_role_requests
+from .tickets import get_role_request
+from . import metrics, profiling, shards, table_pool, table_stats, tss, visits
 from django_htmx.http import trigger_client_event, HttpResponseClientRedirect
 from django.contrib.auth.decorators import login_required
 from http import HTTPStatus
@@ -87,6 +106,16 @@ def obj_view(klass, perm=read_perm):
 
 def method_in(methods):
     def decorator(view_func):
+        if iscoroutinefunction(view_func):
+
+            @functools.wraps(view_func)
+            async def async_wrapper(request, *args, **kwargs):
+                if request.method not in methods:
+                    return HttpResponse(status=HTTPStatus.METHOD_NOT_ALLOWED)
+                return await view_func(request, *args, **kwargs)
+
+            return async_wrapper
+
         @functools.wraps(view_func)
         def wrapper(request, *args, **kwargs):
             if request.method not in methods:
@@ -157,18 +186,25 @@ def tables(request):
     user = None
     if request.user.is_authenticated:
         tables = request.user.table_set.all()
-        invitations = request.user.namedinvitation_set.all()
+        invitations = request.user.namedinvitation_set.select_related(
+            "chair__table__owner"
+        )
         user = request.user
     form = prep_form(request, AddTableForm)
     if request.method == "POST":
         form.instance.owner = user
         if form.is_valid():
-            tableId = requests.post(
-                settings.INTERNAL_TSS_URL + "/tables/",
-                data={"board": form.instance.board.id},
-            ).json()["tableId"]
+            # tables of the same owner are kept on the same shard
+            placement_key = str(user.pk) if user else generate(size=12)
+            shard = shards.place(placement_key)
+            try:
+                tableId = table_pool.create_table(form.instance.board.id, shard)
+            except tss.TssError:
+                tableId = None
             if tableId:
                 form.instance.id = tableId
+                form.instance.shard = shard
+                form.instance.placement_key = placement_key
                 table = form.save()
                 players_num = default(form.cleaned_data.get("add_chair_for_players"), 0)
                 if players_num > 0:
@@ -198,6 +234,7 @@ def tables(request):
     paginator = Paginator(tables, 20)
     page_number = request.GET.get("page")
     tables_page = paginator.get_page(page_number)
+    tables_page.object_list = table_stats.annotate(list(tables_page.object_list))
     context = {
         "tables": tables,
         "tables_page": tables_page,
@@ -394,23 +431,43 @@ def tokenDetails(request, token):
 # TODO reconsider access control
 @only_GET
 def army_info(request: HttpRequest, pk: str) -> HttpResponse:
-    try:
-        army = Army.objects.get(pk=pk)
-    except Army.DoesNotExist:
+    entry = ArmyInfo.get_content(pk)
+    if entry is None:
         return JsonResponse({"error": "Army not found"}, status=HTTPStatus.NOT_FOUND)
-
-    return JsonResponse(army.get_info())
+    content, etag = entry
+    response = HttpResponse(content, content_type="application/json")
+    response["ETag"] = etag
+    patch_cache_control(response, no_cache=True)
+    return get_conditional_response(request, etag=etag, response=response)
+
+
+def serve_media(request, path, document_root=None, show_indexes=False):
+    response = serve(request, path, document_root, show_indexes)
+    # fingerprinted urls (see models.fingerprint) never change their content
+    if "v" in request.GET and response.status_code in (200, 304):
+        patch_cache_control(
+            response, public=True, max_age=settings.IMMUTABLE_MAX_AGE, immutable=True
+        )
+    return response
 
 
 def resources_to_json(resources):
-    return [{"name": res.name, "url": res.file.url, "id": res.id} for res in resources]
+    return [
+        {
+            "name": res.name,
+            "url": res.file.url,
+            "thumbnail": res.get_thumbnail_url(),
+            "id": res.id,
+        }
+        for res in resources
+    ]
 
 
 def add_resource_context(pk, context):
     army = Army.objects.get(pk=pk)
     context["pk"] = pk
     context["army"] = army
-    context["resources"] = army.resource_set.all()
+    context["resources"] = army.resource_set.select_related("blob")
     context["resources_json_lazy"] = lambda: resources_to_json(context["resources"])
     return context
 
@@ -435,6 +492,10 @@ def resources(request, army):
         return render(request, template_name, context=context)
     # successful form handling
     files = form.cleaned_data["file_field"]
+    metrics.uploaded_files.inc(len(files), kind="resource")
+    metrics.uploaded_bytes.inc(sum(f.size for f in files), kind="resource")
+    if settings.RESOURCE_WEBP_UPLOADS:
+        files = [normalize_upload(f) for f in files]
     new_resources = [
         Resource(army_id=army.pk, file=f, name=Path(f.name).stem) for f in files
     ]
@@ -470,28 +531,46 @@ class ResModal(UpdateView):
     template_name = "main/resModal.html"
 
 
+def get_play_context(table, role_request):
+    # play page connects directly to the table sync server of table's shard
+    return {
+        "table": table,
+        "roleRequest": role_request,
+        "tssWsUrl": shards.get_shard(table.shard)["ws_url"],
+    }
+
+
 @only_GET
 @obj_view(Table)
 def play(request, table):
-    table.register_visit(request.user)
-    return render(
-        request, "main/play.html", {"table": table, "roleRequest": {"role": "owner"}}
-    )
+    visits.record(request.user, table)
+    role_request = get_role_request(table, "owner", request.user)
+    return render(request, "main/play.html", get_play_context(table, role_request))
 
 
-@only_GET
-def table_info(request, pk):
-    table = get_object_or_404(Table, pk=pk)
-    chairs = list(table.chair_set.values("id", "name", "arity", "kind"))
-    info = {
-        "id": str(pk),
+def get_table_chairs(table):
+    return table.chair_set.values("id", "name", "arity", "kind")
+
+
+def get_table_info(table, chairs):
+    # chairs are fetched by caller (see get_table_chairs), so async views can too
+    shard = shards.get_shard(table.shard)
+    return {
+        "id": table.pk,
         "name": table.name,
         "defNumOfPlayers": 2,
         "board": table.board_id,
         "owner": table.owner_id,
         "chairs": chairs,
+        "tssUrl": shard["url"],
+        "tssWsUrl": shard["ws_url"],
     }
-    return JsonResponse(info)
+
+
+@only_GET
+def table_info(request, pk):
+    table = get_object_or_404(Table, pk=pk)
+    return JsonResponse(get_table_info(table, list(get_table_chairs(table))))
 
 
 @only_GET
@@ -500,34 +579,52 @@ def board_info(request, pk):
     return JsonResponse(board.get_info())
 
 
-def get_server_info(user):
-    armies = list(
-        Army.get_user_armies(user).values(
-            "id", "name", "custom", "private", "utility", "keyshortcut"
-        )
+@only_GET
+def server_info(request):
+    # table sync server urls point to shard hosting given table
+    shard = None
+    if "table" in request.GET:
+        tables = Table.objects.filter(pk=request.GET["table"])
+        shard = tables.values_list("shard", flat=True).first()
+    content, etag = get_server_info_content(request.user, shard)
+    response = HttpResponse(content, content_type="application/json")
+    response["ETag"] = etag
+    patch_cache_control(response, no_cache=True)
+    patch_vary_headers(response, ["Cookie"])
+    return get_conditional_response(request, etag=etag, response=response)
+
+
+@only_GET
+def export_metrics(request):
+    # scraped by Prometheus from allowed addresses, staff can look at it in browser
+    if not (
+        request.user.is_staff
+        or request.META.get("REMOTE_ADDR") in settings.METRICS_ALLOWED_IPS
+    ):
+        return HttpResponseForbidden()
+    return HttpResponse(
+        metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
     )
-    emotes = [
-        el.get_info()
-        for el in Emote.objects.prefetch_related("emotealternativeimage_set").all()
-    ]
-    return {
-        "serverName": "local",
-        "serverVersion": "1.0.0",
-        "res": {
-            "armies": armies,
-            "emotes": emotes,
-            "utilities": [],
-            "links": list(Link.objects.values("name", "url")),
-            "boards": list(Board.objects.values("id", "name")),
-        },
-        "tss_url": settings.TSS_URL,
-        "tss_ws_url": settings.TSS_WS_URL,
+
+
+@only_GET
+@admin_required
+def profiles(request):
+    context = {
+        "captures": profiling.get_captures()[:50],
+        "header": profiling.get_header_value(),
+        "header_max_age": settings.PROFILING_HEADER_MAX_AGE // 60,
     }
+    return render(request, "main/profiles.html", context)
 
 
 @only_GET
-def server_info(request):
-    return JsonResponse(get_server_info(request.user))
+@admin_required
+def profile_file(request, name):
+    path = profiling.get_capture_file(name)
+    if path is None:
+        raise Http404()
+    return FileResponse(path.open("rb"), as_attachment=True)
 
 
 @GET_or_POST
@@ -550,7 +647,7 @@ def chair_delete(request, chair):
 
 
 @GET_or_POST
-@obj_view(Table.objects.prefetch_related("chair_set__namedinvitation_set"))
+@obj_view(Table.objects.prefetch_related("chair_set__namedinvitation_set__user"))
 def invitations(request, table):
     form = prep_form(request, AddInvitationForm)
     form.fields["chair"].queryset = table.chair_set.all()
@@ -614,11 +711,12 @@ def link_invitation(request, pk):
 @only_GET
 def link_invitation_play(request, pk):
     chair = get_object_or_404(Chair.objects.select_related("table"), link_invitation=pk)
-    chair.table.register_visit(request.user)
+    visits.record(request.user, chair.table)
+    role_request = get_role_request(
+        chair.table, chair.get_role(), request.user, linkInvitation=pk
+    )
     return render(
-        request,
-        "main/play.html",
-        {"table": chair.table, "roleRequest": {"role": chair.get_role()}},
+        request, "main/play.html", get_play_context(chair.table, role_request)
     )
 
 
@@ -631,41 +729,53 @@ def named_invitation(request, invitation):
 @only_GET
 @obj_view(NamedInvitation.objects.select_related("chair__table"))
 def named_invitation_play(request, invitation):
-    invitation.chair.table.register_visit(request.user)
+    visits.record(request.user, invitation.chair.table)
+    role_request = get_role_request(
+        invitation.chair.table,
+        invitation.chair.get_role(),
+        request.user,
+        namedInvitation=invitation.pk,
+    )
     return render(
         request,
         "main/play.html",
-        {
-            "table": invitation.chair.table,
-            "roleRequest": {"role": invitation.chair.get_role()},
-        },
+        get_play_context(invitation.chair.table, role_request),
     )
 
 
+def parse_role_requests(items):
+    if not isinstance(items, list) or len(items) > settings.ROLE_REQUESTS_BATCH_LIMIT:
+        return None
+    requests = []
+    for item in items:
+        if not isinstance(item, dict) or not isinstance(item.get("roleRequest"), dict):
+            return None
+        requests.append((item.get("tableId"), item["roleRequest"]))
+    return requests
+
+
 @csrf_exempt
 @only_POST
 def authorize_role_request(request):
     data = json.loads(request.body)
-    table = get_object_or_404(Table, pk=data["tableId"])
-    roleReq = data["roleRequest"]
-    if roleReq.get("role") == "owner":
-        if table.owner == request.user:
-            return JsonResponse({"result": True, "role": "owner"})
-    elif roleReq.get("namedInvitation") is not None:
-        invitation = get_object_or_404(
-            NamedInvitation.objects.select_related("chair"),
-            pk=roleReq["namedInvitation"],
-        )
-        if invitation.user == request.user and invitation.chair.table_id == table.pk:
-            return JsonResponse({"result": True, "role": invitation.chair.get_role()})
-    elif roleReq.get("linkInvitation") is not None:
-        chair = get_object_or_404(
-            Chair,
-            link_invitation=roleReq["linkInvitation"],
-        )
-        if chair.table_id == table.pk:
-            return JsonResponse({"result": True, "role": chair.get_role()})
-    return JsonResponse(
-        {"result": False, "reason": "Unauthorized"},
-        status=HTTPStatus.UNAUTHORIZED,
-    )
+    requests = parse_role_requests([data])
+    if requests is None:
+        return HttpResponse(status=HTTPStatus.BAD_REQUEST)
+    [result] = authorize_role_requests(request.user, requests)
+    if result == NOT_FOUND:
+        raise Http404()
+    if not result["result"]:
+        return JsonResponse(result, status=HTTPStatus.UNAUTHORIZED)
+    return JsonResponse(result)
+
+
+@csrf_exempt
+@only_POST
+def authorize_role_requests_batch(request):
+    try:
+        requests = parse_role_requests(json.loads(request.body).get("requests"))
+    except (ValueError, AttributeError):
+        requests = None
+    if requests is None:
+        return HttpResponse(status=HTTPStatus.BAD_REQUEST)
+    return JsonResponse({"results": authorize_role_requests(request.user, requests)})
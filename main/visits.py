@@ -0,0 +1,86 @@
+import atexit
+import logging
+import threading
+import time
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.utils import timezone
+from .models import TableVisit
+
+# Visits are buffered in process memory and written in batches, at most once per
+# TABLE_VISITS_FLUSH_INTERVAL seconds or when TABLE_VISITS_BATCH_SIZE (user, table)
+# pairs are waiting. Interval is checked when new visit is recorded and by timer
+# started with the first buffered visit, so visits of idle processes are written
+# too. Batches which can't be written are kept for the next flush, so requests
+# recording visits don't fail.
+logger = logging.getLogger(__name__)
+lock = threading.Lock()
+pending = {}
+last_flush = time.monotonic()
+timer = None
+
+
+def record(user, table):
+    if not user.is_authenticated:
+        return
+    key = (user.pk, table.pk)
+    with lock:
+        count, _ = pending.get(key, (0, None))
+        pending[key] = (count + 1, timezone.now())
+        due = (
+            len(pending) >= settings.TABLE_VISITS_BATCH_SIZE
+            or time.monotonic() - last_flush >= settings.TABLE_VISITS_FLUSH_INTERVAL
+        )
+        if not due:
+            schedule_flush()
+    if due:
+        flush()
+
+
+def schedule_flush():
+    # called with lock held
+    global timer
+    if timer is None:
+        timer = threading.Timer(settings.TABLE_VISITS_FLUSH_INTERVAL, flush_by_timer)
+        timer.daemon = True
+        timer.start()
+
+
+def flush_by_timer():
+    try:
+        flush()
+    except Exception:
+        logger.exception("Unable to save buffered table visits.")
+    finally:
+        connections.close_all()
+
+
+def flush():
+    global pending, last_flush, timer
+    with lock:
+        visits, pending = pending, {}
+        last_flush = time.monotonic()
+        if timer is not None:
+            timer.cancel()
+            timer = None
+    if not visits:
+        return
+    try:
+        TableVisit.add_visits(visits)
+    except DatabaseError as e:
+        logger.warning("Unable to save %d table visits: %s", len(visits), e)
+        with lock:
+            for key, (count, visited_at) in visits.items():
+                # visits recorded meanwhile are newer
+                newer_count, newer_visited_at = pending.get(key, (0, None))
+                pending[key] = (count + newer_count, newer_visited_at or visited_at)
+            schedule_flush()
+
+
+@atexit.register
+def flush_at_exit():
+    # database might be already unavailable while interpreter is shutting down
+    try:
+        flush()
+    except Exception as e:
+        logger.warning("Unable to save buffered table visits: %s", e)
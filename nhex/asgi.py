@@ -9,8 +9,20 @@ https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+from django.core.handlers.asgi import ASGIHandler
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "nhex.settings")
 
-application = get_asgi_application()
+
+class NhexASGIHandler(ASGIHandler):
+    # Serves async versions of endpoints called at high fan-out by table servers
+    # (see nhex/asgi_urls.py). Note that synchronous middleware (like debug
+    # toolbar's) makes every request pass through a thread anyway.
+    async def get_response_async(self, request):
+        request.urlconf = "nhex.asgi_urls"
+        return await super().get_response_async(request)
+
+
+django.setup(set_prefix=False)
+application = NhexASGIHandler()
@@ -0,0 +1,41 @@
+"""
+URL configuration used when serving nhex over ASGI (see nhex/asgi.py).
+
+It is the same as nhex.urls, except endpoints called at high fan-out by table
+servers and table clients, which are served by async views. They keep names of
+their sync counterparts in the main namespace, so reversing URLs, metrics and
+profiling rules work the same under both.
+"""
+
+from django.urls import include, path
+from main import async_views
+from main.urls import urlpatterns as main_urlpatterns
+from .urls import urlpatterns as sync_urlpatterns
+
+async_urlpatterns = [
+    path("tables/<slug:pk>/info/", async_views.table_info, name="table_info"),
+    path("armies/<slug:pk>/info/", async_views.army_info, name="army_info"),
+    path("boards/<slug:pk>/info/", async_views.board_info, name="board_info"),
+    path("serverInfo/", async_views.server_info, name="server_info"),
+    path(
+        "authorizeRoleRequest/",
+        async_views.authorize_role_request,
+        name="authorize_role_request",
+    ),
+    path(
+        "authorizeRoleRequests/",
+        async_views.authorize_role_requests_batch,
+        name="authorize_role_requests",
+    ),
+]
+
+# main namespace can be included only once, so async routes are put before its
+# sync ones
+urlpatterns = [
+    (
+        path("", include((async_urlpatterns + main_urlpatterns, "main")))
+        if getattr(pattern, "namespace", None) == "main"
+        else pattern
+    )
+    for pattern in sync_urlpatterns
+]
@@ -59,6 +59,9 @@ DJANGO_VITE = {"default": {"dev_mode": True}}
 
 MIDDLEWARE = [
     "debug_toolbar.middleware.DebugToolbarMiddleware",
+    "main.metrics.MetricsMiddleware",
+    "main.profiling.ProfilingMiddleware",
+    "main.querycount.QueryCountMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -171,6 +174,84 @@ INTERNAL_TSS_URL = "http://localhost:3001"
 # Table sync server URL from users perspective
 TSS_URL = "http://localhost:3001"
 TSS_WS_URL = "ws://localhost:3001"
+# Table sync servers (shards) among which tables are spread, e.g.
+# {"eu1": {"internal_url": ..., "url": ..., "ws_url": ..., "weight": 2}, ...}.
+# Empty means single "default" shard configured with the three settings above.
+# Optional "data_dir" (working directory of the shard's table server as seen from
+# this machine) is needed to move tables with rebalance_tables command.
+TSS_SHARDS = {}
+# How new tables are placed on shards: "hash" (consistent hashing of table owner)
+# or "least_loaded" (shard hosting the fewest tables relative to its weight).
+TSS_PLACEMENT = "hash"
+# Requests to table sync server (see main/tss.py) time out after this many seconds
+# when connecting and when waiting for response.
+TSS_CONNECT_TIMEOUT = 1
+TSS_READ_TIMEOUT = 5
+# Failed connections (and 502/503/504 responses to idempotent requests) are retried
+# this many times.
+TSS_RETRIES = 2
+# Maximal number of kept alive connections to table sync server per process.
+TSS_POOL_SIZE = 10
+# After this many consecutive failures requests fail fast for given number of seconds.
+TSS_CIRCUIT_FAILURES = 5
+TSS_CIRCUIT_RESET_TIMEOUT = 30
+# SECURITY WARNING: keep the internal secret used in production secret!
+# Shared with table sync servers (their INTERNAL_API_SECRET environment variable),
+# which accept provisioning, board and stats requests only when it is sent.
+TSS_INTERNAL_SECRET = "insecure-internal-api-secret"
+# Tables are created from pool of tables provisioned by table sync server in advance.
+# Pool is refilled up to high watermark once it drops below low watermark. Set high
+# watermark to 0 to create each table on demand.
+TABLE_ID_POOL_LOW_WATERMARK = 20
+TABLE_ID_POOL_HIGH_WATERMARK = 100
+# Occupancy of tables shown in tables list is fetched from table sync servers at
+# most once per this many seconds.
+TABLE_STATS_CACHE_TIMEOUT = 5
+# Count database queries of every request (X-Query-Count response header) and warn
+# about query shapes repeated at least QUERY_REPEAT_THRESHOLD times (see
+# main/querycount.py).
+QUERY_INSTRUMENTATION = DEBUG
+QUERY_REPEAT_THRESHOLD = 5
+# Collect Prometheus metrics of requests, table sync server calls, caches and uploads
+# (see main/metrics.py). They are served at /metrics/ to staff users and to requests
+# from METRICS_ALLOWED_IPS. Addresses are compared with REMOTE_ADDR, so list real
+# address of the scraper. Behind local reverse proxy every request comes from the
+# proxy's address, so the list can't be used there.
+METRICS_ENABLED = True
+METRICS_ALLOWED_IPS = []
+# Directory where every worker process saves its metrics at most once per
+# METRICS_FLUSH_INTERVAL seconds, so /metrics/ reports sums of all processes. Required
+# when running multiple worker processes, should be emptied on deployment.
+METRICS_DIR = None
+METRICS_FLUSH_INTERVAL = 5
+# Profile requests to URL names chosen by profiling rules in admin or carrying signed
+# X-Profile header shown at /profiles/ (see main/profiling.py). Profiles are saved to
+# PROFILING_DIR, only PROFILING_MAX_CAPTURES most recent ones are kept.
+PROFILING_ENABLED = True
+PROFILING_DIR = BASE_DIR / "profiles"
+PROFILING_MAX_CAPTURES = 200
+# Stacks of profiled requests are sampled every this many seconds for flame graphs.
+PROFILING_SAMPLE_INTERVAL = 0.001
+# Signed profiling header is valid for this many seconds.
+PROFILING_HEADER_MAX_AGE = 60 * 60
+
+# SECURITY WARNING: keep the role ticket secret used in production secret!
+# Shared with table sync server (its ROLE_TICKET_SECRET environment variable), so it
+# can verify signed role tickets without calling back to authorizeRoleRequest/.
+ROLE_TICKET_SECRET = "insecure-role-ticket-secret"
+# Lifetime of role tickets in seconds, afterwards table server calls back, which
+# checks the invitation again. Tickets can't be revoked, so keep it short, they keep
+# granting seats of deleted invitations until they expire.
+ROLE_TICKET_TTL = 5 * 60
+# Role authorization decisions are cached for this many seconds. They are also
+# invalidated whenever table ownership, its chairs or invitations change, but only
+# in the shared CACHES backend. Per process cache (the default LocMemCache) can't be
+# invalidated by other worker processes, so decisions are cached there at most for
+# ROLE_DECISION_LOCAL_CACHE_TIMEOUT seconds.
+ROLE_DECISION_CACHE_TIMEOUT = 30
+ROLE_DECISION_LOCAL_CACHE_TIMEOUT = 2
+# Maximal number of role requests authorized by single authorizeRoleRequests/ call.
+ROLE_REQUESTS_BATCH_LIMIT = 500
 
 # Main server URL from perspective of app users (to be used for constructing copy links)
 # This configuration can be omitted and then copy link will be constructed based on requests
@@ -180,3 +261,26 @@ MiB = 1024 * 1024
 MAX_RESOURCE_FILE_SIZE = MiB
 MAX_SIZE_OF_SINGLE_UPLOAD = 10 * MiB
 DEFAULT_DISK_QUOTA_SIZE = 10 * MiB
+
+# Public part of /serverInfo/ payload is cached for at most this many seconds. It is
+# also invalidated whenever armies, emotes, links or boards change. Deployments running
+# multiple worker processes should configure a shared CACHES backend (e.g. Redis).
+SERVER_INFO_CACHE_TIMEOUT = 60 * 60
+
+# Cache lifetime (in seconds) of media files requested with content fingerprint
+# (`?v=<digest>`). Production web server serving MEDIA_ROOT should do the same.
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Resource thumbnails are shown in the management UI at half of this size.
+RESOURCE_THUMBNAIL_SIZE = (224, 160)
+# Re-encode uploaded raster resources as WebP when it makes them smaller.
+RESOURCE_WEBP_UPLOADS = False
+# Maximal width and height of army texture atlas pages. Pages are updated whenever
+# tokens or resources of an army change (see update_atlas_pages command for armies
+# saved before). Set to 0 to serve token images as separate files.
+ARMY_ATLAS_PAGE_SIZE = 4096
+
+# Table visits are buffered in memory and written this many seconds after the first
+# of them was buffered or once this many (user, table) pairs are waiting.
+TABLE_VISITS_FLUSH_INTERVAL = 10
+TABLE_VISITS_BATCH_SIZE = 500
@@ -19,6 +19,7 @@ from django.contrib import admin
 from django.urls import include, path
 from django.conf.urls.static import static
 from django.conf import settings
+from main.views import serve_media
 
 urlpatterns = [
     path("__reload__/", include("django_browser_reload.urls")),
@@ -26,4 +27,4 @@ urlpatterns = [
     path("accounts/", include("users.urls")),
     path("admin/", admin.site.urls),
     path("", include("main.urls")),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+] + static(settings.MEDIA_URL, view=serve_media, document_root=settings.MEDIA_ROOT)
@@ -9,6 +9,8 @@ if (history.scrollRestoration) {
 }
 const tableId = JSON.parse(document.getElementById('tableId').textContent);
 const roleRequest = JSON.parse(document.getElementById('roleRequest').textContent);
+// table sync server (shard) hosting this table
+const tssWsUrl = JSON.parse(document.getElementById('tssWsUrl').textContent);
 async function fetchResource(resource) {
     try {
         return await (await fetch(`${window.location.protocol}//${window.location.host}/${resource}`)).json();
@@ -16,7 +18,7 @@ async function fetchResource(resource) {
         reportError(`Unable to fetch resource: ${resource}`, error);
     }
 }
-fetchResource('serverInfo').then(serverInfo => {
+fetchResource(`serverInfo/?table=${tableId}`).then(serverInfo => {
     return mount(document.getElementById('content'), tableId, {
         getArmyInfo: (armyId) => fetchResource(`armies/${armyId}/info/`),
         getBoardInfo: (boardId) => fetchResource(`boards/${boardId}/info/`),
@@ -24,7 +26,7 @@ fetchResource('serverInfo').then(serverInfo => {
         getEmoteImg: (emote) => `/media/${emote}`,
         // getHelp: undefined,
         getTokenImg: (army, token) => `/media/armies/${army}/${token}`,
-    }, roleRequest, (conf) => (new ReconnectingWS(`${serverInfo.tss_ws_url}/ws2/`, conf)), serverInfo);
+    }, roleRequest, (conf) => (new ReconnectingWS(`${tssWsUrl}/ws2/`, conf)), serverInfo);
 }).then((game) => {
     window.game = game;
 }).catch(error => reportError('Unable to load server info', error));
@@ -21,6 +21,8 @@ export const ADJUST_SERVICE_WS_CONNECTION_THRESHOLD = 8;
 export const ADJUST_SERVICE_INCREASE_INSENSITIVITY = 2;
 export const ADJUST_SERVICE_DECREASE_INSENSITIVITY = 3;
 export const ARMY_SIZE_LIMIT = 1024 * 1024 * 2;
+// maximal number of tables handled by single /tables/batch/ or /tables/stats/ request
+export const MAX_TABLES_BATCH = 500;
 export { ADDITIONAL_QUALITY };
 export { QUALITY_LEVELS };
 export default {
@@ -39,5 +41,6 @@ export default {
   ADJUST_SERVICE_WS_CONNECTION_THRESHOLD,
   ADJUST_SERVICE_INCREASE_INSENSITIVITY,
   ADJUST_SERVICE_DECREASE_INSENSITIVITY,
-  ARMY_SIZE_LIMIT
+  ARMY_SIZE_LIMIT,
+  MAX_TABLES_BATCH,
 };
@@ -0,0 +1,15 @@
+import { timingSafeEqual } from "node:crypto";
+
+export const INTERNAL_API_SECRET = process.env.INTERNAL_API_SECRET || "insecure-internal-api-secret";
+
+// Express middleware letting through only requests of the main server, which sends
+// shared secret (its TSS_INTERNAL_SECRET setting) in X-Internal-Secret header.
+export function requireMainServer(req, res, next) {
+  const expected = Buffer.from(INTERNAL_API_SECRET);
+  const received = Buffer.from(req.get("X-Internal-Secret") ?? "");
+  if (expected.length !== received.length || !timingSafeEqual(expected, received)) {
+    res.status(403).send({ error: "Only main server can call this endpoint." });
+    return;
+  }
+  next();
+}
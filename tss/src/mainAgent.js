@@ -2,16 +2,35 @@ import axios from 'axios';
 export default (class MainServer {
   constructor(url) {
     this.url = url;
+    // role requests waiting to be sent, grouped by cookie of their senders
+    this.pending = new Map();
   }
-  async authorizeRoleRequest(ws, tableId, roleRequest) {
+  authorizeRoleRequest(ws, tableId, roleRequest) {
+    // requests made in the same tick with the same cookie are sent in one batch
+    const cookie = ws.userData.cookie;
+    return new Promise((resolve) => {
+      if (!this.pending.has(cookie)) {
+        this.pending.set(cookie, []);
+        setImmediate(() => this.flush(cookie));
+      }
+      this.pending.get(cookie).push({ tableId, roleRequest, resolve });
+    });
+  }
+  async flush(cookie) {
+    const batch = this.pending.get(cookie);
+    this.pending.delete(cookie);
+    let results = [];
     try {
-      return (await axios.post(`${this.url}/authorizeRoleRequest/`, { tableId, roleRequest }, {
+      results = (await axios.post(`${this.url}/authorizeRoleRequests/`, {
+        requests: batch.map(({ tableId, roleRequest }) => ({ tableId, roleRequest })),
+      }, {
         headers: {
-          Cookie: ws.userData.cookie,
+          Cookie: cookie,
         }
-      })).data;
+      })).data.results;
     } catch (error) {
-      return false;
+      results = [];
     }
+    batch.forEach(({ resolve }, i) => resolve(results[i] ?? false));
   }
 });
@@ -0,0 +1,28 @@
+import { createHmac, timingSafeEqual } from "node:crypto";
+
+export const ROLE_TICKET_SECRET = process.env.ROLE_TICKET_SECRET || "insecure-role-ticket-secret";
+
+// Verifies role ticket signed by the main server (see main/tickets.py). Returns
+// ticket data or null if it is malformed, forged, expired or issued for a different
+// table. Table server doesn't know which user is connected, so tickets are bearer
+// credentials here: whoever holds one gets its role until it expires, which is why
+// main server issues them only for a few minutes (ROLE_TICKET_TTL).
+export function verifyRoleTicket(ticket, tableId, secret = ROLE_TICKET_SECRET, now = Date.now() / 1000) {
+  if (!secret || typeof ticket !== "string") return null;
+  const parts = ticket.split(".");
+  if (parts.length !== 2) return null;
+  const [payload, signature] = parts;
+  const expected = Buffer.from(createHmac("sha256", secret).update(payload).digest("base64url"));
+  const received = Buffer.from(signature);
+  if (expected.length !== received.length || !timingSafeEqual(expected, received)) return null;
+  let data;
+  try {
+    data = JSON.parse(Buffer.from(payload, "base64url").toString());
+  } catch (err) {
+    return null;
+  }
+  if (data === null || data.table !== tableId || !Number.isInteger(data.exp) || data.exp < now) {
+    return null;
+  }
+  return data;
+}
@@ -1,5 +1,6 @@
 import { QUALITY_LEVELS } from "./config.js";
 import shuffle from "./shuffle.js";
+import { verifyRoleTicket } from "./roleTicket.js";
 const OBJ = 1;
 const TOKEN = 2;
 const SPAWNER = 3;
@@ -42,6 +43,7 @@ export default (class Table {
     this.secrets = new Map();
     this.mainAgent = mainAgent;
     this.tableStorage = tableStorage;
+    this.lastActivity = Date.now();
   }
   async load() {
     try {
@@ -682,6 +684,7 @@ export default (class Table {
     }
   }
   handleMessage(data, ws) {
+    this.lastActivity = Date.now();
     try {
       if (this.owners.has(ws)) {
         if (data.promoteUser !== undefined) this.promoteUser(data.promoteUser);
@@ -740,11 +743,14 @@ export default (class Table {
     }
   }
   async addUser(ws, roleRequest) {
-    // const authInfo = await this.mainAgent.authorizeRoleRequest(ws, this.id, roleRequest);
-    // if (!authInfo.result) {
-    //   return false;
-    // }
-    const authInfo = roleRequest;
+    // signed ticket saves authorization round-trip to the main server
+    let authInfo = verifyRoleTicket(roleRequest?.ticket, this.id);
+    if (authInfo === null) {
+      authInfo = await this.mainAgent.authorizeRoleRequest(ws, this.id, roleRequest);
+      if (!authInfo.result) {
+        return false;
+      }
+    }
     if (authInfo.role == "owner") {
       this.addPlayer(ws)
       ws.userData.role = ROLE_OWNER;
@@ -839,6 +845,13 @@ export default (class Table {
     this.globalQuality = globalQuality;
     this.adjustLocalQuality();
   }
+  getStats() {
+    return {
+      online: this.subscribers.size,
+      players: this.players.size,
+      lastActivity: this.lastActivity,
+    };
+  }
   getInfo() {
     return {
       id: this.id,
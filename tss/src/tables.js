@@ -106,6 +106,54 @@ export default (class Tables {
       return false;
     }
   }
+  async provisionTables(count) {
+    // tables without board, which main server keeps in its pool of ready table ids
+    const ids = [];
+    for (let i = 0; i < count; ++i) {
+      const id = await this.createTable(undefined);
+      if (id === false) break;
+      ids.push(id);
+    }
+    return ids;
+  }
+  async setInitialBoard(id, boardName) {
+    // only tables which were never used can get their initial board
+    const table = this.tables.get(id);
+    if (table !== undefined) {
+      if (table.history.length !== 0 || table.future.length !== 0) return false;
+      table.execute({ board: boardName }, {
+        type: 0,
+        place: table.tableStorage.getCurrentPlace(),
+      });
+      return true;
+    }
+    const path = this.getTablePath(id);
+    try {
+      if ((await fs.stat(path)).size !== 0) return false;
+      await fs.appendFile(path, JSON.stringify({ act: { board: boardName } }) + '\n');
+      return true;
+    } catch (error) {
+      return false;
+    }
+  }
+  async getStats(ids) {
+    // tables which aren't loaded are idle since their dump file was last written
+    const stats = {};
+    await Promise.all(ids.map(async (id) => {
+      const table = this.tables.get(id);
+      if (table !== undefined) {
+        stats[id] = table.getStats();
+        return;
+      }
+      try {
+        const { mtimeMs } = await fs.stat(this.getTablePath(id));
+        stats[id] = { online: 0, players: 0, lastActivity: mtimeMs };
+      } catch (error) {
+        // table doesn't exist on this server
+      }
+    }));
+    return stats;
+  }
   getTablePath(id) {
     return `tables/${id}`;
   }
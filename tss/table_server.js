@@ -6,6 +6,7 @@ import DbStorage from "./src/DbStorage.js";
 import config from "./src/config.js";
 import Tables from "./src/tables.js";
 import MainAgent from "./src/mainAgent.js";
+import { requireMainServer } from "./src/internalApi.js";
 import url from "url";
 import cors from "cors";
 const app = express();
@@ -307,8 +308,27 @@ app.post("/tables/", async (req, res) => {
   const tableId = await tablesList.createTable(board);
   res.send({ tableId });
 });
+app.post("/tables/batch/", requireMainServer, async (req, res) => {
+  const count = Math.min(Number(req.body?.count) || 0, config.MAX_TABLES_BATCH);
+  res.send({ tableIds: await tablesList.provisionTables(count) });
+});
+app.post("/tables/stats/", requireMainServer, async (req, res) => {
+  const ids = [req.body?.ids ?? []].flat().slice(0, config.MAX_TABLES_BATCH);
+  res.send({ stats: await tablesList.getStats(ids.map(String)) });
+});
+app.post("/tables/:id/board/", requireMainServer, async (req, res) => {
+  const ok = await tablesList.setInitialBoard(req.params.id, req.body?.board);
+  res.status(ok ? 200 : 409).send({ ok });
+});
 if (SERVE_STATIC) {
-  app.use(express.static(SERVE_STATIC));
+  app.use(express.static(SERVE_STATIC, {
+    setHeaders: (res) => {
+      // assets requested with content fingerprint (?v=<digest>) never change
+      if (res.req.query.v !== undefined) {
+        res.set("Cache-Control", "public, max-age=31536000, immutable");
+      }
+    },
+  }));
 }
 
 // start our server